@@ -142,6 +142,22 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Attachment downloads (see todo/downloads.py). Set to 'x-accel-redirect'
+# (nginx) or 'x-sendfile' (Apache, lighttpd) to let the front proxy send
+# the files; MEDIA_ROOT then no longer needs to be served publicly.
+TODO_SENDFILE_BACKEND = None
+TODO_SENDFILE_PREFIX = '/protected/'  # internal nginx location for MEDIA_ROOT
+
+# Chunked attachment uploads (see todo/uploads.py); clean up abandoned
+# sessions with `python manage.py cleanup_uploads`
+TODO_UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024
+TODO_MAX_UPLOAD_SIZE = 2 * 1024 ** 3
+TODO_UPLOAD_SESSION_TTL = 24 * 60 * 60  # seconds without a chunk before a session expires
+
+# Dashboard analytics (see todo/rollups.py); build the daily rollups of
+# existing data with `python manage.py backfill_rollups`
+TODO_DASHBOARD_MAX_DAYS = 3660  # longest date range one request may cover
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -171,7 +187,28 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache settings
+# The per-user response cache in todo/cache.py needs a backend shared by
+# every process (see settings_prod.py); a process-local one is only used
+# because the development server runs in a single process.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+TODO_CACHE_ALLOW_LOCAL = True
+TODO_CACHE_TIMEOUT = 300  # seconds
+TODO_LOCAL_CACHE_SIZE = 1024  # entries in the in-process LRU tier
+
 # Authentication settings
 LOGIN_URL = '/login/'
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
+
+# Background jobs (see todo/jobs.py, run with `python manage.py run_jobs`)
+TODO_INLINE_IMPORT_MAX_BYTES = 1024 * 1024  # larger imports go to the job queue
+TODO_MAX_RUNNING_JOBS_PER_USER = 1
+TODO_MAX_RUNNING_THUMBNAILS_PER_USER = 2  # limited separately from imports and exports
+TODO_JOB_LEASE_SECONDS = 300  # running jobs without a heartbeat for this long are requeued
+TODO_MAX_JOB_ATTEMPTS = 3
@@ -148,4 +148,15 @@ CHANNEL_LAYERS = {
             "hosts": [(os.environ.get('REDIS_HOST', 'localhost'), 6379)],
         },
     },
-}
\ No newline at end of file
+}
+
+# Shared cache: the per-user cache versions in todo/cache.py must be seen by
+# every gunicorn worker, daphne and run_jobs process
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.environ.get('REDIS_HOST', 'localhost')}:6379/1",
+    },
+}
+
+TODO_CACHE_ALLOW_LOCAL = False
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Todo, Category, TodoAttachment, TodoShare
+from .models import (
+    Todo, Category, TodoAttachment, AttachmentBlob, TodoShare, BackgroundJob, Notification, TodoDailyRollup,
+)
 
 @admin.register(Todo)
 class TodoAdmin(admin.ModelAdmin):
@@ -23,8 +25,37 @@ class TodoAttachmentAdmin(admin.ModelAdmin):
     search_fields = ['file_name', 'todo__title']
 
 
+@admin.register(AttachmentBlob)
+class AttachmentBlobAdmin(admin.ModelAdmin):
+    list_display = ['digest', 'size', 'ref_count', 'created_at']
+    search_fields = ['digest']
+    readonly_fields = ['digest', 'size', 'ref_count', 'created_at']
+
+
 @admin.register(TodoShare)
 class TodoShareAdmin(admin.ModelAdmin):
     list_display = ['todo', 'shared_by', 'shared_with', 'can_edit', 'shared_at']
     list_filter = ['can_edit', 'shared_at']
-    search_fields = ['shared_by__username', 'shared_with__username', 'todo__title']
\ No newline at end of file
+    search_fields = ['shared_by__username', 'shared_with__username', 'todo__title']
+
+@admin.register(BackgroundJob)
+class BackgroundJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'kind', 'status', 'progress', 'created_at', 'finished_at']
+    list_filter = ['kind', 'status', 'created_at']
+    search_fields = ['user__username']
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ['user', 'kind', 'is_read', 'created_at', 'read_at']
+    list_filter = ['kind', 'is_read', 'created_at']
+    search_fields = ['user__username']
+
+
+@admin.register(TodoDailyRollup)
+class TodoDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ['user', 'day', 'category_id', 'priority', 'created', 'completed']
+    list_filter = ['priority', 'day']
+    search_fields = ['user__username']
+    date_hierarchy = 'day'
+    readonly_fields = ['user', 'day', 'category_id', 'priority', 'created', 'completed']
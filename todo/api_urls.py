@@ -8,8 +8,21 @@ urlpatterns = [
     path('todos/<int:pk>/toggle-status/', api_views.toggle_todo_status, name='api-todo-toggle-status'),
     path('todos/search/', api_views.search_todos, name='api-todo-search'),
     path('todos/stats/', api_views.todo_stats, name='api-todo-stats'),
+    path('todos/dashboard/', api_views.todo_dashboard, name='api-todo-dashboard'),
+    path('todos/changes/', api_views.todo_changes, name='api-todo-changes'),
+    path('todos/bulk/', api_views.bulk_todos, name='api-todo-bulk'),
     
     # Category endpoints
     path('categories/', api_views.CategoryListCreateView.as_view(), name='api-category-list-create'),
     path('categories/<int:pk>/', api_views.CategoryDetailView.as_view(), name='api-category-detail'),
+    
+    # Chunked upload endpoints
+    path('uploads/', api_views.create_upload, name='api-upload-create'),
+    path('uploads/<uuid:pk>/', api_views.upload_status, name='api-upload-detail'),
+    path('uploads/<uuid:pk>/chunks/<int:index>/', api_views.upload_chunk, name='api-upload-chunk'),
+    path('uploads/<uuid:pk>/commit/', api_views.commit_upload, name='api-upload-commit'),
+    
+    # Notification endpoints
+    path('notifications/', api_views.notification_list, name='api-notification-list'),
+    path('notifications/read/', api_views.mark_notifications_read, name='api-notification-read'),
 ]
\ No newline at end of file
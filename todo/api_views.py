@@ -2,49 +2,75 @@ from rest_framework import generics, status
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
-from django.shortcuts import get_object_or_404
-from django.db.models import Q
-from .models import Todo, Category, TodoAttachment
-from .serializers import TodoSerializer, CategorySerializer
-
-
-class TodoPagination(PageNumberPagination):
-    page_size = 10
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
-
+from rest_framework.filters import OrderingFilter
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .models import Todo, Category, TodoAttachment, UploadSession
+from .serializers import TodoSerializer, TodoListSerializer, CategorySerializer, TodoAttachmentSerializer
+from .permissions import EDIT_PERMISSIONS, get_todo_or_404
+from .search import full_text_search
+from .pagination import TodoPagination
+from . import bulk, cache, etags, notifications, rollups, sync, uploads
+
+
+@method_decorator(condition(etag_func=etags.todo_list_etag), name='get')
 class TodoListCreateView(generics.ListCreateAPIView):
     serializer_class = TodoSerializer
     pagination_class = TodoPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['created_at', 'updated_at', 'title']
+    ordering = ['-created_at']
 
     def get_queryset(self):
         user = self.request.user
-        return Todo.objects.filter(
-            Q(user=user) | Q(shares__shared_with=user)
-        ).distinct().order_by('-created_at')
+        return TodoListSerializer.with_related(
+            Todo.objects.visible_to(user).order_by('-created_at')
+        )
+
+    def get_serializer_class(self):
+        if self.request.method == 'GET':
+            return TodoListSerializer
+        return TodoSerializer
+
+    def list(self, request, *args, **kwargs):
+        # Keyed by the ETag so the body always matches the tag it is sent with
+        data = cache.get_or_set(
+            request.user.id, 'api-todo-list', etags.validator(request, etags.todo_list_etag),
+            lambda: super(TodoListCreateView, self).list(request, *args, **kwargs).data,
+        )
+        return Response(data)
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
 
+@method_decorator(condition(
+    etag_func=etags.todo_detail_etag,
+    last_modified_func=etags.todo_detail_last_modified,
+), name='get')
 class TodoDetailView(generics.RetrieveUpdateDestroyAPIView):
     serializer_class = TodoSerializer
 
     def get_queryset(self):
         user = self.request.user
-        return Todo.objects.filter(
-            Q(user=user) | Q(shares__shared_with=user)
-        ).distinct()
+        return Todo.objects.visible_to(user)
 
 
+@method_decorator(condition(etag_func=etags.category_list_etag), name='get')
 class CategoryListCreateView(generics.ListCreateAPIView):
     serializer_class = CategorySerializer
 
     def get_queryset(self):
         return Category.objects.filter(user=self.request.user).order_by('name')
 
+    def list(self, request, *args, **kwargs):
+        # Keyed by the ETag so the body always matches the tag it is sent with
+        data = cache.get_or_set(
+            request.user.id, 'api-category-list', etags.validator(request, etags.category_list_etag),
+            lambda: super(CategoryListCreateView, self).list(request, *args, **kwargs).data,
+        )
+        return Response(data)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
@@ -59,22 +85,17 @@ class CategoryDetailView(generics.RetrieveUpdateDestroyAPIView):
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def toggle_todo_status(request, pk):
-    todo = get_object_or_404(Todo, pk=pk)
+    todo, permission = get_todo_or_404(request, pk)
     
     # Check if user has permission to edit this todo
-    if todo.user != request.user and not todo.shares.filter(shared_with=request.user, can_edit=True).exists():
+    if permission not in EDIT_PERMISSIONS:
         return Response({'error': 'Permission denied'}, status=status.HTTP_403_FORBIDDEN)
     
-    if todo.status == 'completed':
-        todo.status = 'pending'
-        todo.completed_at = None
-    else:
-        todo.status = 'completed'
-        from django.utils import timezone
-        todo.completed_at = timezone.now()
-    
-    todo.save()
-    serializer = TodoSerializer(todo, context={'request': request})
+    state = bulk.toggle([todo.id])[todo.id]
+    todo.status = state['status']
+    todo.completed_at = state['completed_at']
+    todo.updated_at = state['updated_at']
+    serializer = TodoListSerializer(todo, context={'request': request})
     return Response(serializer.data)
 
 
@@ -83,42 +104,144 @@ def toggle_todo_status(request, pk):
 def search_todos(request):
     query = request.GET.get('q', '')
     if query:
-        todos = Todo.objects.filter(
-            Q(user=request.user) | Q(shares__shared_with=request.user),
-            Q(title__icontains=query) | Q(description__icontains=query)
-        ).distinct()
-        
-        paginator = TodoPagination()
-        page = paginator.paginate_queryset(todos, request)
-        
-        if page is not None:
-            serializer = TodoSerializer(page, many=True, context={'request': request})
-            return paginator.get_paginated_response(serializer.data)
-        
-        serializer = TodoSerializer(todos, many=True, context={'request': request})
-        return Response(serializer.data)
+        data = cache.get_or_set(
+            request.user.id, 'api-todo-search', request.build_absolute_uri(),
+            lambda: _search_results(request, query),
+        )
+        return Response(data)
     
     return Response([])
 
 
+def _search_results(request, query):
+    todos = full_text_search(
+        TodoListSerializer.with_related(Todo.objects.visible_to(request.user)), query
+    )
+    
+    paginator = TodoPagination()
+    page = paginator.paginate_queryset(todos, request)
+    
+    if page is not None:
+        serializer = TodoListSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data).data
+    
+    serializer = TodoListSerializer(todos, many=True, context={'request': request})
+    return serializer.data
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@condition(etag_func=etags.todo_stats_etag)
 def todo_stats(request):
-    user = request.user
-    todos = Todo.objects.filter(
-        Q(user=user) | Q(shares__shared_with=user)
-    ).distinct()
-    
-    total = todos.count()
-    completed = todos.filter(status='completed').count()
-    pending = todos.filter(status='pending').count()
-    in_progress = todos.filter(status='in_progress').count()
-    high_priority = todos.filter(priority='high').count()
-    
+    return Response(etags.request_stats(request))
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def todo_dashboard(request):
+    try:
+        start, end = rollups.parse_range(request.GET.get('start'), request.GET.get('end'))
+    except ValueError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(rollups.dashboard(request.user, start, end))
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_todos(request):
+    try:
+        results = bulk.apply(request, request.data.get('operations'))
+    except bulk.BulkError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({'results': results})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def todo_changes(request):
+    try:
+        limit = int(request.GET.get('limit', sync.CHANGES_PAGE_SIZE))
+        return Response(sync.changes_since(request.user, request.GET.get('since'), limit, request=request))
+    except ValueError:
+        return Response({'error': 'Invalid cursor'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def notification_list(request):
     return Response({
-        'total': total,
-        'completed': completed,
-        'pending': pending,
-        'in_progress': in_progress,
-        'high_priority': high_priority
-    })
\ No newline at end of file
+        'unread': notifications.unread_count(request.user.id),
+        'notifications': notifications.unread_notifications(request.user.id),
+    })
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def mark_notifications_read(request):
+    if request.data.get('all'):
+        marked = notifications.mark_all_read(request.user.id)
+    else:
+        try:
+            ids = [int(notification_id) for notification_id in request.data.get('ids', [])]
+        except (TypeError, ValueError):
+            return Response({'error': 'ids must be a list of notification ids'}, status=status.HTTP_400_BAD_REQUEST)
+        marked = notifications.mark_read(request.user.id, ids)
+    return Response({'marked': marked, 'unread': notifications.unread_count(request.user.id)})
+
+
+UPLOAD_NOT_FOUND = {'error': 'Upload session not found'}
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_upload(request):
+    try:
+        session = uploads.create_session(
+            request.user, request.data.get('todo_id'), request.data.get('file_name'), request.data.get('size')
+        )
+    except uploads.UploadError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(uploads.status(session), status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAuthenticated])
+def upload_status(request, pk):
+    try:
+        if request.method == 'DELETE':
+            uploads.abort(request.user, pk)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(uploads.status(uploads.get_session(request.user, pk)))
+    except UploadSession.DoesNotExist:
+        return Response(UPLOAD_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+
+
+@api_view(['PUT'])
+@permission_classes([IsAuthenticated])
+def upload_chunk(request, pk, index):
+    # The body is the raw chunk, read straight from the request stream
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+        session = uploads.write_chunk(
+            request.user, pk, index, request.stream, length, request.headers.get('X-Chunk-SHA256')
+        )
+    except UploadSession.DoesNotExist:
+        return Response(UPLOAD_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+    except uploads.ChunkOutOfOrder as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+    except uploads.UploadError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(uploads.status(session))
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def commit_upload(request, pk):
+    try:
+        attachment = uploads.commit(request.user, pk)
+    except UploadSession.DoesNotExist:
+        return Response(UPLOAD_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+    except uploads.UploadError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = TodoAttachmentSerializer(attachment, context={'request': request})
+    return Response(serializer.data, status=status.HTTP_201_CREATED)
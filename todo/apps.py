@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class TodoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'todo'
\ No newline at end of file
+    name = 'todo'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,226 @@
+"""Many todo writes in one request, behind ``/api/todos/bulk/``.
+
+A request is a list of operations:
+
+    {"op": "create", "todo": {...}}
+    {"op": "update", "ids": [...], "changes": {...}}
+    {"op": "toggle", "ids": [...]}
+    {"op": "delete", "ids": [...]}
+
+All operations run in one transaction, as one set-based statement each.
+Permissions for every id in the request are resolved at its start with two
+queries: the owner or a sharee with ``can_edit`` may write. The result
+lists the outcome of every operation and target id.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from .models import Category, Todo, TodoAttachment, TodoShare, TodoVisibility, UploadSession
+from .serializers import TodoSerializer
+from .signals import todos_bulk_created, todos_bulk_deleted, todos_bulk_updated
+
+# Largest number of creates plus target ids accepted in one request
+MAX_BULK_ITEMS = getattr(settings, 'TODO_BULK_MAX_ITEMS', 1000)
+
+# Fields an update operation may set
+UPDATE_FIELDS = ('title', 'description', 'due_date', 'priority', 'status', 'category_id')
+
+# Fields whose updates the stats and rollups follow by deltas
+STATE_FIELDS = {*Todo.TRACKED_FIELDS, *Todo.ROLLUP_FIELDS}
+
+NOT_FOUND = 'Todo not found.'
+PERMISSION_DENIED = 'Permission denied.'
+
+
+class BulkError(ValueError):
+    """The request as a whole is malformed."""
+
+
+def _target_ids(operation):
+    ids = operation.get('ids')
+    if not isinstance(ids, list):
+        raise BulkError(f"Operation '{operation.get('op')}' needs a list of ids.")
+    try:
+        return list(dict.fromkeys(int(todo_id) for todo_id in ids))
+    except (TypeError, ValueError):
+        raise BulkError('Todo ids must be integers.')
+
+
+def _parse(operations):
+    if not isinstance(operations, list):
+        raise BulkError('operations must be a list.')
+    parsed = []
+    items = 0
+    for operation in operations:
+        if not isinstance(operation, dict):
+            raise BulkError('Each operation must be an object.')
+        op = operation.get('op')
+        if op == 'create':
+            parsed.append((op, operation.get('todo') or {}, []))
+            items += 1
+        elif op in ('update', 'toggle', 'delete'):
+            ids = _target_ids(operation)
+            parsed.append((op, operation.get('changes') or {}, ids))
+            items += len(ids)
+        else:
+            raise BulkError(f'Unknown operation: {op}')
+    if items > MAX_BULK_ITEMS:
+        raise BulkError(f'A bulk request may touch at most {MAX_BULK_ITEMS} todos.')
+    return parsed
+
+
+def _writable(user, todo_ids):
+    """Map each existing id to whether ``user`` may write it.
+
+    Call inside the write transaction: ``user``'s shares of the todos are
+    locked, so a share revoked meanwhile is either seen here or waits.
+    """
+    shares = TodoShare.objects.filter(todo_id__in=todo_ids, shared_with=user).select_for_update()
+    can_edit = dict(shares.values_list('todo_id', 'can_edit'))
+    owners = Todo.objects.filter(id__in=todo_ids).values_list('id', 'user_id')
+    return {todo_id: owner_id == user.id or can_edit.get(todo_id, False) for todo_id, owner_id in owners}
+
+
+def _check(todo_ids, writable, removed):
+    """Split ``todo_ids`` into the allowed ones and per-id errors."""
+    allowed, errors = [], {}
+    for todo_id in todo_ids:
+        if todo_id in removed or todo_id not in writable:
+            errors[todo_id] = NOT_FOUND
+        elif not writable[todo_id]:
+            errors[todo_id] = PERMISSION_DENIED
+        else:
+            allowed.append(todo_id)
+    return allowed, errors
+
+
+def _completed_at(status, now):
+    """completed_at for an update to ``status``, kept on rows already completed."""
+    if status == 'completed':
+        return Case(When(status='completed', then=F('completed_at')), default=Value(now))
+    return None
+
+
+def _create(request, items):
+    """Validate and bulk_create the create operations; returns their results."""
+    user = request.user
+    categories = set(Category.objects.filter(user=user).values_list('id', flat=True))
+    todos, results = [], []
+    for data in items:
+        serializer = TodoSerializer(data=data, context={'request': request})
+        if not serializer.is_valid():
+            results.append({'ok': False, 'errors': serializer.errors})
+            continue
+        values = dict(serializer.validated_data)
+        category_id = values.pop('category_id', None)
+        # TodoSerializer.validate has already set completed_at
+        todo = Todo(**values, user=user, category_id=category_id if category_id in categories else None)
+        todos.append(todo)
+        results.append({'ok': True, 'todo': todo})
+    if todos:
+        created = Todo.objects.bulk_create(todos)
+        todos_bulk_created(created)
+    for result in results:
+        if result['ok']:
+            result['id'] = result.pop('todo').pk
+    return results
+
+
+def _update_values(request, changes):
+    """Validated column values for an update operation."""
+    unknown = set(changes) - set(UPDATE_FIELDS)
+    if unknown:
+        raise BulkError(f"Fields cannot be bulk updated: {', '.join(sorted(unknown))}")
+    serializer = TodoSerializer(data=changes, partial=True, context={'request': request})
+    if not serializer.is_valid():
+        return None, serializer.errors
+    values = dict(serializer.validated_data)
+    if 'category_id' in values:
+        category_id = values['category_id']
+        if category_id is not None and not Category.objects.filter(id=category_id, user=request.user).exists():
+            # Same as TodoSerializer: an unknown category clears it
+            values['category_id'] = None
+    if 'status' in values:
+        values['completed_at'] = _completed_at(values['status'], timezone.now())
+    return values, None
+
+
+def toggle(todo_ids, using='default'):
+    """Toggle completion of ``todo_ids`` in one UPDATE; returns their new state.
+
+    The result maps each id to its ``status``, ``completed_at`` and
+    ``updated_at``, read back in the same transaction as the UPDATE.
+    """
+    todo_ids = list(todo_ids)
+    with transaction.atomic(using=using):
+        todos = Todo.objects.using(using).filter(id__in=todo_ids)
+        # What the UPDATE changes, for the stats and rollup deltas
+        before = todos.saved_states()
+        todos.toggle_status()
+        todos_bulk_updated(todo_ids, ['status', 'completed_at'], using, before=before)
+        return {
+            row['id']: row
+            for row in todos.values('id', 'status', 'completed_at', 'updated_at')
+        }
+
+
+def delete(todo_ids, using='default'):
+    """Delete ``todo_ids`` and the rows depending on them, one DELETE per table.
+
+    QuerySet.delete() would load every todo, attachment and share and send
+    their signals one by one, so the rows are removed directly and
+    ``todos_bulk_deleted`` updates the derived tables for all of them.
+    """
+    todo_ids = list(todo_ids)
+    with transaction.atomic(using=using):
+        todos_bulk_deleted(todo_ids, using)
+        for model in (TodoAttachment, TodoShare, TodoVisibility, UploadSession):
+            model.objects.using(using).filter(todo_id__in=todo_ids)._raw_delete(using)
+        return Todo.objects.using(using).filter(id__in=todo_ids)._raw_delete(using)
+
+
+def apply(request, operations):
+    """Run ``operations`` for ``request.user``; returns one result per operation.
+
+    Raises BulkError when the request is malformed. Operations checked as
+    they run may raise it after earlier ones wrote, and the transaction is
+    then rolled back, so nothing is kept.
+    """
+    parsed = _parse(operations)
+    user = request.user
+    removed = set()
+    results = []
+
+    with transaction.atomic():
+        writable = _writable(user, {todo_id for _, _, ids in parsed for todo_id in ids})
+        creates = [data for op, data, _ in parsed if op == 'create']
+        created = iter(_create(request, creates))
+
+        for index, (op, data, ids) in enumerate(parsed):
+            result = {'index': index, 'op': op}
+            if op == 'create':
+                result.update(next(created))
+                results.append(result)
+                continue
+
+            allowed, errors = _check(ids, writable, removed)
+            result.update(ok=not errors, ids=allowed, errors={str(k): v for k, v in errors.items()})
+            if op == 'update':
+                values, invalid = _update_values(request, data)
+                if invalid:
+                    result.update(ok=False, ids=[], errors=invalid)
+                elif allowed:
+                    now = timezone.now()
+                    before = None
+                    if STATE_FIELDS.intersection(values):
+                        before = Todo.objects.filter(id__in=allowed).saved_states()
+                    Todo.objects.filter(id__in=allowed).update(**values, updated_at=now)
+                    todos_bulk_updated(allowed, values, before=before)
+            elif op == 'toggle' and allowed:
+                toggle(allowed)
+            elif op == 'delete' and allowed:
+                delete(allowed)
+                removed.update(allowed)
+            results.append(result)
+    return results
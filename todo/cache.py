@@ -0,0 +1,168 @@
+"""Per-user versioned caching of read responses.
+
+Every cached value is keyed by the user's data version. Writes that change
+what a user sees (their todos, categories and shares, plus todos shared
+with them) bump the version instead of deleting keys, so stale entries are
+simply never read again and expire on their own.
+
+Values are held in the Django cache named by TODO_CACHE_ALIAS and in a
+small LRU tier inside each process. The version itself is always read from
+the Django cache, so a bump made by one process reaches the others only if
+that cache is shared between them (Redis, Memcached, a database table).
+With a process-local backend such as LocMemCache the layer is bypassed,
+unless TODO_CACHE_ALLOW_LOCAL says the site runs in a single process.
+
+Versions are bumped as soon as the write happens and again when its
+transaction commits. The second bump discards anything a concurrent reader
+cached from the pre-commit state.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+CACHE_ALIAS = getattr(settings, 'TODO_CACHE_ALIAS', 'default')
+
+# Seconds a cached response may be served while the version is unchanged
+CACHE_TIMEOUT = getattr(settings, 'TODO_CACHE_TIMEOUT', 300)
+
+# Entries kept by the in-process tier; 0 disables it
+LOCAL_CACHE_SIZE = getattr(settings, 'TODO_LOCAL_CACHE_SIZE', 1024)
+
+# Use a process-local cache backend anyway, e.g. for the development server
+ALLOW_LOCAL = getattr(settings, 'TODO_CACHE_ALLOW_LOCAL', False)
+
+# Backends whose contents no other process can see
+LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class LocalLRU:
+    """Thread-safe, size-bounded in-process cache with per-entry expiry."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, timeout):
+        if self.maxsize <= 0 or timeout <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic() + timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LocalLRU(LOCAL_CACHE_SIZE)
+
+
+def _cache():
+    return caches[CACHE_ALIAS]
+
+
+def enabled():
+    """Whether values are cached: only when a bump reaches every process."""
+    backend = settings.CACHES[CACHE_ALIAS]['BACKEND']
+    return ALLOW_LOCAL or backend not in LOCAL_BACKENDS
+
+
+def _version_key(user_id):
+    return f'todo:version:{user_id}'
+
+
+def _new_version():
+    # Never reuse a number, even if the version key itself was evicted
+    return time.time_ns()
+
+
+def get_version(user_id):
+    cache = _cache()
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump(user_ids):
+    """Make every cached value of ``user_ids`` unreachable."""
+    if not enabled():
+        return
+    cache = _cache()
+    for user_id in set(user_ids):
+        key = _version_key(user_id)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_version(), None)
+
+
+def invalidate(user_ids, using='default'):
+    """Bump ``user_ids`` now and again once the current transaction commits."""
+    user_ids = set(user_ids)
+    if not user_ids or not enabled():
+        return
+    bump(user_ids)
+    transaction.on_commit(lambda: bump(user_ids), using=using)
+
+
+def _key(user_id, namespace, params):
+    digest = hashlib.md5(repr(params).encode('utf-8'), usedforsecurity=False).hexdigest()
+    return f'todo:{namespace}:{user_id}:{get_version(user_id)}:{digest}'
+
+
+def get_or_set(user_id, namespace, params, compute):
+    """Return the cached value for ``params`` or store what ``compute()`` returns."""
+    return get_or_set_until(user_id, namespace, params, lambda: (compute(), None))
+
+
+def get_or_set_until(user_id, namespace, params, compute):
+    """Like get_or_set for values that go stale with time rather than writes.
+
+    ``compute()`` returns ``(value, expires_at)``; ``expires_at`` is an aware
+    datetime after which the value must be recomputed, or None.
+    """
+    if not enabled():
+        return compute()[0]
+    key = _key(user_id, namespace, params)
+    value = local_cache.get(key)
+    if value is not None:
+        return value
+    entry = _cache().get(key)
+    if entry is not None:
+        value, deadline = entry
+        local_cache.set(key, value, deadline - time.time())
+        return value
+
+    value, expires_at = compute()
+    timeout = CACHE_TIMEOUT
+    if expires_at is not None:
+        timeout = min(timeout, (expires_at - timezone.now()).total_seconds())
+    if timeout >= 1:
+        _cache().set(key, (value, time.time() + timeout), int(timeout))
+        local_cache.set(key, value, timeout)
+    return value
@@ -1,8 +1,22 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth.models import User
+from django.conf import settings
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.db import DatabaseError, transaction
 from .models import Todo
+from . import notifications, permissions
+from .realtime import merge_actions, notification_group, todo_group
+
+# Group events arriving within this many seconds reach the client as one frame
+TODO_COALESCE_SECONDS = 0.05
+
+# Largest number of operations accepted in one todo.batch frame
+MAX_BATCH_OPERATIONS = getattr(settings, 'TODO_MAX_BATCH_OPERATIONS', 500)
+
+# Fields a todo.update message may set; sharees with edit rights can send it too
+UPDATE_FIELDS = ('title', 'description', 'due_date', 'priority', 'status')
 
 
 class NotificationConsumer(AsyncWebsocketConsumer):
@@ -10,7 +24,7 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         self.user = self.scope["user"]
         
         if self.user.is_authenticated:
-            self.group_name = f"notifications_{self.user.id}"
+            self.group_name = notification_group(self.user.id)
             
             # Join notification group
             await self.channel_layer.group_add(
@@ -19,6 +33,14 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             )
             
             await self.accept()
+            
+            # Everything the user missed while offline, in one frame
+            unread, pending = await self.get_unread_notifications()
+            await self.send(text_data=json.dumps({
+                'type': 'notification.unread',
+                'unread': unread,
+                'notifications': pending,
+            }))
         else:
             await self.close()
 
@@ -36,9 +58,17 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         message_type = text_data_json['type']
         
         if message_type == 'notification.read':
-            notification_id = text_data_json['notification_id']
-            # Mark notification as read in database
-            # await self.mark_notification_as_read(notification_id)
+            # Accept a single id or a batch of ids per frame
+            notification_ids = text_data_json.get('notification_ids')
+            if notification_ids is None:
+                notification_ids = [text_data_json['notification_id']]
+            try:
+                notification_ids = [int(notification_id) for notification_id in notification_ids]
+            except (TypeError, ValueError):
+                return
+            await self.mark_notifications_read(notification_ids)
+        elif message_type == 'notification.read_all':
+            await self.mark_all_notifications_read()
 
     # Receive message from room group
     async def notification_message(self, event):
@@ -50,13 +80,37 @@ class NotificationConsumer(AsyncWebsocketConsumer):
             'message': message,
         }))
 
+    # Unread total changed, e.g. after a read-ack from another tab
+    async def notification_count(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'notification.count',
+            'unread': event['unread'],
+        }))
+
+    @database_sync_to_async
+    def get_unread_notifications(self):
+        return (
+            notifications.unread_count(self.user.id),
+            notifications.unread_notifications(self.user.id),
+        )
+
+    @database_sync_to_async
+    def mark_notifications_read(self, notification_ids):
+        return notifications.mark_read(self.user.id, notification_ids)
+
+    @database_sync_to_async
+    def mark_all_notifications_read(self):
+        return notifications.mark_all_read(self.user.id)
+
 
 class TodoConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope["user"]
         
         if self.user.is_authenticated:
-            self.group_name = f"todos_{self.user.id}"
+            self.group_name = todo_group(self.user.id)
+            self.pending_events = {}
+            self.flush_task = None
             
             # Join todo updates group
             await self.channel_layer.group_add(
@@ -69,6 +123,9 @@ class TodoConsumer(AsyncWebsocketConsumer):
             await self.close()
 
     async def disconnect(self, close_code):
+        if getattr(self, 'flush_task', None) is not None:
+            self.flush_task.cancel()
+        
         # Leave todo updates group
         if hasattr(self, 'group_name'):
             await self.channel_layer.group_discard(
@@ -91,46 +148,144 @@ class TodoConsumer(AsyncWebsocketConsumer):
         elif message_type == 'todo.delete':
             todo_id = text_data_json['todo_id']
             await self.delete_todo(todo_id)
+        elif message_type == 'todo.batch':
+            operations = text_data_json.get('operations') or []
+            if len(operations) > MAX_BATCH_OPERATIONS:
+                await self.send(text_data=json.dumps({
+                    'type': 'todo.batch.result',
+                    'error': f'A batch may contain at most {MAX_BATCH_OPERATIONS} operations.',
+                    'results': [],
+                }))
+                return
+            results = await self.apply_batch(operations)
+            await self.send(text_data=json.dumps({
+                'type': 'todo.batch.result',
+                'results': results,
+            }))
 
     # Receive message from room group
     async def todo_message(self, event):
-        todo_data = event['todo_data']
-        action = event['action']
+        self.queue_todo_event(event['action'], event['todo_data'])
+
+    # Receive a batch of changes from room group
+    async def todo_batch(self, event):
+        for item in event['events']:
+            self.queue_todo_event(item['action'], item['todo_data'])
+
+    def queue_todo_event(self, action, todo_data):
+        todo_id = todo_data['id']
+        previous = self.pending_events.get(todo_id)
+        merged = merge_actions(previous[0] if previous else None, action)
+        if merged is None:
+            self.pending_events.pop(todo_id, None)
+        else:
+            self.pending_events[todo_id] = (merged, todo_data)
+        
+        if self.flush_task is None:
+            self.flush_task = asyncio.ensure_future(self.flush_todo_events())
+
+    async def flush_todo_events(self):
+        await asyncio.sleep(TODO_COALESCE_SECONDS)
+        events, self.pending_events = list(self.pending_events.values()), {}
+        self.flush_task = None
         
         # Send message to WebSocket
-        await self.send(text_data=json.dumps({
-            'type': 'todo',
-            'action': action,
-            'todo': todo_data,
-        }))
+        if len(events) == 1:
+            action, todo_data = events[0]
+            await self.send(text_data=json.dumps({
+                'type': 'todo',
+                'action': action,
+                'todo': todo_data,
+            }))
+        elif events:
+            await self.send(text_data=json.dumps({
+                'type': 'todo.batch',
+                'events': [{'action': action, 'todo': todo_data} for action, todo_data in events],
+            }))
 
-    @database_sync_to_async
-    def create_todo(self, todo_data):
-        user = User.objects.get(id=self.user.id)
-        todo = Todo.objects.create(
+    def _create_todo(self, todo_data):
+        return Todo.objects.create(
             title=todo_data.get('title', ''),
             description=todo_data.get('description', ''),
             priority=todo_data.get('priority', 'medium'),
-            user=user
+            user=self.user
         )
+
+    def _resolve(self, todo_id, allowed):
+        todo, permission = permissions.resolve(self.user, todo_id)
+        if todo is None:
+            raise Todo.DoesNotExist
+        if permission not in allowed:
+            raise PermissionDenied('Permission denied.')
+        return todo
+
+    def _update_todo(self, todo_id, todo_data):
+        unknown = set(todo_data) - set(UPDATE_FIELDS)
+        if unknown:
+            raise ValueError(f"Fields cannot be updated: {', '.join(sorted(unknown))}")
+        todo = self._resolve(todo_id, permissions.EDIT_PERMISSIONS)
+        todo.apply_changes(todo_data)
         return todo
 
+    def _delete_todo(self, todo_id):
+        # Same rule as bulk deletes: owners and editors only
+        self._resolve(todo_id, permissions.EDIT_PERMISSIONS).delete()
+
+    def _apply_operation(self, operation):
+        message_type = operation.get('type')
+        if message_type == 'todo.create':
+            return {'id': self._create_todo(operation.get('todo') or {}).id}
+        if message_type == 'todo.update':
+            return {'id': self._update_todo(operation['todo_id'], operation.get('todo') or {}).id}
+        if message_type == 'todo.delete':
+            self._delete_todo(operation['todo_id'])
+            return {'id': operation['todo_id']}
+        raise ValueError(f'Unknown operation type: {message_type}')
+
+    @database_sync_to_async
+    def apply_batch(self, operations):
+        """Apply ``operations`` in one transaction, returning a result per operation.
+
+        Each operation runs in its own savepoint, so a failing item is
+        reported and rolled back without undoing the others.
+        """
+        results = []
+        with transaction.atomic():
+            for index, operation in enumerate(operations):
+                result = {'index': index}
+                try:
+                    if not isinstance(operation, dict):
+                        raise ValueError('Operation must be an object.')
+                    if 'ref' in operation:
+                        result['ref'] = operation['ref']
+                    with transaction.atomic():
+                        result.update(self._apply_operation(operation), ok=True)
+                except Todo.DoesNotExist:
+                    result.update(ok=False, error='Todo not found.')
+                except PermissionDenied as exc:
+                    result.update(ok=False, error=str(exc))
+                except KeyError as exc:
+                    result.update(ok=False, error=f'Missing field: {exc.args[0]}')
+                except (DatabaseError, TypeError, ValueError, ValidationError) as exc:
+                    result.update(ok=False, error=str(exc))
+                results.append(result)
+        return results
+
+    @database_sync_to_async
+    def create_todo(self, todo_data):
+        return self._create_todo(todo_data)
+
     @database_sync_to_async
     def update_todo(self, todo_id, todo_data):
         try:
-            todo = Todo.objects.get(id=todo_id, user=self.user)
-            for attr, value in todo_data.items():
-                setattr(todo, attr, value)
-            todo.save()
-            return todo
-        except Todo.DoesNotExist:
+            return self._update_todo(todo_id, todo_data)
+        except (Todo.DoesNotExist, PermissionDenied, ValueError):
             return None
 
     @database_sync_to_async
     def delete_todo(self, todo_id):
         try:
-            todo = Todo.objects.get(id=todo_id, user=self.user)
-            todo.delete()
+            self._delete_todo(todo_id)
             return True
-        except Todo.DoesNotExist:
-            return False
\ No newline at end of file
+        except (Todo.DoesNotExist, PermissionDenied):
+            return False
@@ -0,0 +1,162 @@
+"""Access-controlled file responses for attachments.
+
+Views check that the user can see the file, then ``serve`` builds the
+response. When TODO_SENDFILE_BACKEND is set, only headers are returned
+and the front proxy sends the bytes:
+
+``'x-accel-redirect'``
+    nginx. TODO_SENDFILE_PREFIX names an ``internal`` location that maps
+    to MEDIA_ROOT, e.g. ``location /protected/ { internal; alias /srv/media/; }``.
+``'x-sendfile'``
+    Apache mod_xsendfile or lighttpd, given the file's absolute path.
+
+Without a backend the file is streamed by Django. Whole files go through
+FileResponse, so the server's ``wsgi.file_wrapper`` can use sendfile().
+A single ``Range`` is answered with 206 and only the requested bytes, and
+``If-Range`` falls back to the whole file once the file has changed.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from .storage import blob_digest
+
+# 'x-accel-redirect', 'x-sendfile' or None to stream through Django
+SENDFILE_BACKEND = getattr(settings, 'TODO_SENDFILE_BACKEND', None)
+
+# Internal nginx location that serves MEDIA_ROOT, for 'x-accel-redirect'
+SENDFILE_PREFIX = getattr(settings, 'TODO_SENDFILE_PREFIX', '/protected/')
+
+BLOCK_SIZE = 64 * 1024
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _etag(file, size, modified):
+    digest = blob_digest(file.name)
+    if digest is not None:
+        # Content-addressed, so the digest is a strong validator
+        return f'"{digest}"'
+    return f'"{size:x}-{int(modified):x}"'
+
+
+def parse_range(header, size):
+    """The ``(start, end)`` byte range asked for by ``header``, end inclusive.
+
+    Returns None to send the whole file (no header, several ranges or an
+    unparseable one) and raises ValueError if the range cannot be satisfied.
+    """
+    match = _RANGE.match((header or '').strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _if_range_matches(request, etag, modified):
+    if_range = request.headers.get('If-Range')
+    if if_range is None:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(modified) <= since
+
+
+def _read_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(BLOCK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def _sendfile(file, headers):
+    response = HttpResponse(headers=headers)
+    # The proxy works out the length and ranges from the file itself
+    if SENDFILE_BACKEND == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = SENDFILE_PREFIX.rstrip('/') + '/' + quote(file.name)
+    else:
+        response['X-Sendfile'] = file.storage.path(file.name)
+    return response
+
+
+def serve(request, file, filename, as_attachment=True):
+    """Response sending ``file`` (a FieldFile) to the client as ``filename``."""
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    disposition = content_disposition_header(as_attachment, filename)
+    headers = {'X-Content-Type-Options': 'nosniff'}
+    if SENDFILE_BACKEND:
+        response = _sendfile(file, dict(headers, **{
+            'Content-Type': content_type,
+            'Content-Disposition': disposition,
+        }))
+        patch_cache_control(response, private=True)
+        return response
+
+    path = file.storage.path(file.name)
+    stat = os.stat(path)
+    etag = _etag(file, stat.st_size, stat.st_mtime)
+    headers.update({
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+    })
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if not_modified is not None:
+        for name in ('ETag', 'Last-Modified'):
+            not_modified[name] = headers[name]
+        patch_cache_control(not_modified, private=True)
+        return not_modified
+
+    byte_range = None
+    if request.method == 'GET' and _if_range_matches(request, etag, stat.st_mtime):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416, headers={'Content-Range': f'bytes */{stat.st_size}'})
+            patch_cache_control(response, private=True)
+            return response
+
+    if byte_range is None:
+        response = FileResponse(
+            open(path, 'rb'), as_attachment=as_attachment, filename=filename,
+            content_type=content_type, headers=headers,
+        )
+    else:
+        start, end = byte_range
+        length = end - start + 1
+        response = StreamingHttpResponse(
+            _read_range(open(path, 'rb'), start, length),
+            status=206,
+            content_type=content_type,
+            headers=dict(headers, **{
+                'Content-Disposition': disposition,
+                'Content-Range': f'bytes {start}-{end}/{stat.st_size}',
+                'Content-Length': str(length),
+            }),
+        )
+    patch_cache_control(response, private=True)
+    return response
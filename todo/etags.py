@@ -0,0 +1,87 @@
+"""Validators for conditional GETs on the todo API.
+
+Each function here takes the view's arguments, as Django's ``condition``
+decorator expects, and costs at most one indexed query. List ETags combine
+the row count, the newest ``updated_at`` and the newest visibility row, so
+additions, edits, deletions and share changes all produce a new tag.
+Attachment changes touch their todo's ``updated_at`` for the same reason.
+
+Only detail responses get a Last-Modified date. A list can change by
+losing a row, which no timestamp records.
+
+List tags are remembered on the request, and the views key their cached
+bodies by them, so a body cached before a change can never go out under
+the tag computed after it. Stats are read once per request for both the
+tag and the body.
+"""
+import hashlib
+from django.db.models import Count, Max
+from .models import Category, Todo
+from . import stats
+
+
+def _etag(*parts):
+    return hashlib.md5(repr(parts).encode('utf-8'), usedforsecurity=False).hexdigest()
+
+
+def _remember(request, tag):
+    request._todo_etag = tag
+    return tag
+
+
+def validator(request, etag_func):
+    """The tag ``etag_func`` gave this request, to key its cached body by."""
+    tag = getattr(request, '_todo_etag', None)
+    return tag if tag is not None else etag_func(request)
+
+
+def todo_list_etag(request, *args, **kwargs):
+    state = Todo.objects.visible_to(request.user).aggregate(
+        count=Count('id'),
+        updated=Max('updated_at'),
+        shared=Max('visibility__id'),
+        category_updated=Max('category__updated_at'),
+    )
+    return _remember(request, _etag('todo-list', request.build_absolute_uri(), sorted(state.items())))
+
+
+def _todo_detail_state(request, pk):
+    # Shared by the ETag and Last-Modified functions of one request
+    if getattr(request, '_todo_detail_state', None) is None:
+        request._todo_detail_state = Todo.objects.visible_to(request.user).filter(pk=pk).values_list(
+            'updated_at', 'category__updated_at'
+        ).first() or ()
+    return request._todo_detail_state or None
+
+
+def todo_detail_etag(request, pk, *args, **kwargs):
+    state = _todo_detail_state(request, pk)
+    if state is None:
+        return None
+    return _etag('todo', pk, state)
+
+
+def todo_detail_last_modified(request, pk, *args, **kwargs):
+    state = _todo_detail_state(request, pk)
+    if state is None:
+        return None
+    return max(value for value in state if value is not None)
+
+
+def category_list_etag(request, *args, **kwargs):
+    state = Category.objects.filter(user=request.user).aggregate(
+        count=Count('id'),
+        updated=Max('updated_at'),
+    )
+    return _remember(request, _etag('category-list', request.build_absolute_uri(), sorted(state.items())))
+
+
+def request_stats(request):
+    """The user's stats as a dict, read once per request."""
+    if getattr(request, '_todo_stats', None) is None:
+        request._todo_stats = stats.as_dict(stats.get_cached_stats(request.user))
+    return request._todo_stats
+
+
+def todo_stats_etag(request, *args, **kwargs):
+    return _etag('todo-stats', sorted(request_stats(request).items()))
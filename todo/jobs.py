@@ -0,0 +1,321 @@
+"""Database-backed background jobs for imports, exports, thumbnails and rollups.
+
+Views enqueue BackgroundJob rows and ``manage.py run_jobs`` executes them.
+Progress and completion events of import and export jobs are pushed to the
+owner's ``notifications_<user_id>`` group.
+
+A running job holds a lease that its worker renews by stamping
+``heartbeat_at``, from its own thread and connection because runners may
+hold a transaction open for the whole job, and as the job reports progress.
+Jobs whose worker died stop being renewed, and the next claim puts them
+back in the queue, or fails them once they have been tried MAX_JOB_ATTEMPTS
+times.
+"""
+import logging
+import os
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.base import File
+from django.db import DatabaseError, close_old_connections, connections, transaction
+from django.db.models import Count, F, Q
+from django.urls import reverse
+from django.utils import timezone
+from .models import BackgroundJob, Todo
+from .notifications import notify
+from .realtime import send_notification
+from . import rollups, thumbnails
+from .utils import EXPORT_FORMATS, export_filename, import_todos_from_csv, import_todos_from_json
+
+logger = logging.getLogger(__name__)
+
+# Uploads larger than this are imported by the worker instead of in the request
+INLINE_IMPORT_MAX_BYTES = getattr(settings, 'TODO_INLINE_IMPORT_MAX_BYTES', 1024 * 1024)
+
+# How many of one user's jobs may run at the same time across all workers
+MAX_RUNNING_JOBS_PER_USER = getattr(settings, 'TODO_MAX_RUNNING_JOBS_PER_USER', 1)
+
+# Kinds with a running limit of their own; they neither count towards nor
+# wait for MAX_RUNNING_JOBS_PER_USER, so a long import does not hold back
+# the thumbnails of the user's uploads or a rebuild of their dashboard
+KIND_LIMITS = {
+    'thumbnail': getattr(settings, 'TODO_MAX_RUNNING_THUMBNAILS_PER_USER', 2),
+    'rollup': 1,
+}
+
+# Seconds a running job may go without a heartbeat before it is requeued
+JOB_LEASE_SECONDS = getattr(settings, 'TODO_JOB_LEASE_SECONDS', 300)
+
+# Claims after which a job whose worker keeps dying is failed instead
+MAX_JOB_ATTEMPTS = getattr(settings, 'TODO_MAX_JOB_ATTEMPTS', 3)
+
+# Jobs the user did not start themselves, so they send no events or notifications
+SILENT_KINDS = {'thumbnail', 'rollup'}
+
+
+def enqueue_import(user, uploaded_file):
+    job = BackgroundJob(user=user, kind='import', params={'file_name': uploaded_file.name})
+    job.input_file.save(os.path.basename(uploaded_file.name), uploaded_file, save=False)
+    job.save()
+    return job
+
+
+def enqueue_export(user, export_format='json', include_completed=True):
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'json'
+    return BackgroundJob.objects.create(
+        user=user,
+        kind='export',
+        params={'format': export_format, 'include_completed': include_completed},
+    )
+
+
+def job_payload(job):
+    """JSON-ready description of a job, shared by the status view and events."""
+    payload = {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'progress': job.progress,
+        'result': job.result,
+        'error': job.error or None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'download_url': None,
+    }
+    if job.kind == 'export' and job.status == 'completed' and job.result_file:
+        payload['download_url'] = reverse('job_download', args=[job.pk])
+    return payload
+
+
+def _send_event(job, event):
+    send_notification(job.user_id, dict(job_payload(job), event=event))
+
+
+def _notify_finished(job):
+    # Kept as a Notification so users who were offline still see the outcome
+    notify(job.user_id, dict(job_payload(job), event='job.finished'), kind='job')
+
+
+class _ProgressReporter:
+    """Records progress on the job, pushing an event whenever the percentage changes.
+
+    Each write also renews the job's lease, as does any call once a third of
+    the lease has passed without one. Calls inside the runner's transaction
+    only push the event; a write there would not show until it commits, and
+    would hold the job row against the _LeaseKeeper.
+    """
+
+    def __init__(self, job):
+        self.job = job
+
+    def __call__(self, done, total):
+        percent = min(int(done * 100 / total), 99) if total else 99
+        now = timezone.now()
+        renew = self.job.heartbeat_at is None or now - self.job.heartbeat_at >= timedelta(seconds=JOB_LEASE_SECONDS / 3)
+        if (percent != self.job.progress or renew) and not transaction.get_connection().in_atomic_block:
+            self.job.heartbeat_at = now
+            BackgroundJob.objects.filter(pk=self.job.pk).update(progress=percent, heartbeat_at=now)
+        if percent != self.job.progress:
+            self.job.progress = percent
+            if self.job.kind not in SILENT_KINDS:
+                _send_event(self.job, 'job.progress')
+
+
+class _LeaseKeeper(threading.Thread):
+    """Renews a running job's lease every third of JOB_LEASE_SECONDS until stopped."""
+
+    def __init__(self, job):
+        super().__init__(name=f'lease-{job.pk}', daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(JOB_LEASE_SECONDS / 3):
+                try:
+                    BackgroundJob.objects.filter(pk=self.job.pk, status='running').update(heartbeat_at=timezone.now())
+                except DatabaseError:
+                    # SQLite allows one writer; the next renewal tries again
+                    logger.warning('Could not renew the lease of job %s', self.job.pk, exc_info=True)
+        finally:
+            connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _run_import(job, progress):
+    file_name = job.params.get('file_name', job.input_file.name)
+    with job.input_file.open('rb') as input_file:
+        if file_name.endswith('.json'):
+            report = import_todos_from_json(job.user, input_file.read().decode('utf-8'), progress=progress)
+        elif file_name.endswith('.csv'):
+            report = import_todos_from_csv(job.user, input_file, progress=progress)
+        else:
+            raise ValueError('Unsupported file format. Please upload a JSON or CSV file.')
+    job.input_file.delete(save=False)
+    return report.as_dict()
+
+
+class _ExportChunks:
+    """File-like adapter over an export iterator."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            try:
+                self.buffer += next(self.chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            data, self.buffer = self.buffer, b''
+        else:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+def _run_export(job, progress):
+    export_format = job.params.get('format', 'json')
+    include_completed = job.params.get('include_completed', True)
+    iterator, _ = EXPORT_FORMATS[export_format]
+
+    todos = Todo.objects.filter(user=job.user)
+    if not include_completed:
+        todos = todos.exclude(status='completed')
+    total = todos.count()
+
+    # Counted in rows written, so the CSV header does not count as a chunk of rows
+    chunks = _ExportChunks(iterator(job.user, include_completed, progress=lambda done: progress(done, total)))
+    job.result_file.save(export_filename(job.user, export_format), File(chunks), save=False)
+    return {'rows': total, 'format': export_format}
+
+
+def _run_thumbnail(job, progress):
+    return {'thumbnail': thumbnails.generate(job.params.get('attachment_id'), progress=progress)}
+
+
+def _run_rollup(job, progress):
+    return {'rows': rollups.rebuild(job.user_id, progress=progress)}
+
+
+RUNNERS = {
+    'import': _run_import,
+    'export': _run_export,
+    'thumbnail': _run_thumbnail,
+    'rollup': _run_rollup,
+}
+
+
+def requeue_stale_jobs(now=None):
+    """Requeue running jobs whose lease expired, failing those out of attempts.
+
+    Returns the number of jobs requeued and failed.
+    """
+    now = now or timezone.now()
+    stale = BackgroundJob.objects.filter(
+        status='running', heartbeat_at__lt=now - timedelta(seconds=JOB_LEASE_SECONDS)
+    )
+    failed = stale.filter(attempts__gte=MAX_JOB_ATTEMPTS).update(
+        status='failed', error='The worker running this job stopped responding.', finished_at=now
+    )
+    requeued = stale.update(status='queued', started_at=None, heartbeat_at=None, progress=0)
+    return requeued, failed
+
+
+def _pool(kind):
+    """The kinds sharing ``kind``'s running limit, and that limit."""
+    if kind in KIND_LIMITS:
+        return Q(kind=kind), KIND_LIMITS[kind]
+    return ~Q(kind__in=list(KIND_LIMITS)), MAX_RUNNING_JOBS_PER_USER
+
+
+def _claim(pk, user_id, kind):
+    # Locking the owner's row serializes claims of their jobs, so the limit
+    # check and the claim cannot interleave with another worker's
+    pool, limit = _pool(kind)
+    with transaction.atomic():
+        list(User.objects.select_for_update().filter(pk=user_id).values_list('pk', flat=True))
+        running = BackgroundJob.objects.filter(pool, user_id=user_id, status='running').count()
+        if running >= limit:
+            return False
+        now = timezone.now()
+        return BackgroundJob.objects.filter(pk=pk, status='queued').update(
+            status='running', started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+        )
+
+
+def claim_next_job():
+    """Atomically move the oldest runnable queued job to ``running``.
+
+    Stale jobs are requeued first. A conditional UPDATE makes the claim safe
+    between concurrent workers on any database, and the per-user limit is
+    checked under a lock on the owner. Jobs of users already at the limit
+    for their kind are skipped.
+    """
+    requeue_stale_jobs()
+    candidates = BackgroundJob.objects.filter(status='queued')
+    for kind in [*KIND_LIMITS, None]:
+        pool, limit = _pool(kind)
+        busy_users = BackgroundJob.objects.filter(pool, status='running').values('user_id').annotate(
+            running=Count('id')
+        ).filter(running__gte=limit).values('user_id')
+        candidates = candidates.exclude(pool & Q(user_id__in=busy_users))
+    candidates = candidates.order_by('created_at', 'id').values_list('pk', 'user_id', 'kind')[:5]
+
+    for pk, user_id, kind in candidates:
+        if _claim(pk, user_id, kind):
+            return BackgroundJob.objects.select_related('user').get(pk=pk)
+    return None
+
+
+def run_job(job):
+    """Execute a claimed job, recording its outcome and notifying the owner."""
+    silent = job.kind in SILENT_KINDS
+    if not silent:
+        _send_event(job, 'job.started')
+    lease = _LeaseKeeper(job)
+    lease.start()
+    try:
+        job.result = RUNNERS[job.kind](job, _ProgressReporter(job))
+    except Exception as exc:
+        logger.exception('Background job %s failed', job.pk)
+        job.status = 'failed'
+        job.error = str(exc)
+    else:
+        job.status = 'completed'
+        job.progress = 100
+    finally:
+        lease.stop()
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'result', 'error', 'progress', 'result_file', 'finished_at'])
+    if not silent:
+        _notify_finished(job)
+    return job
+
+
+def run_next_job():
+    """Claim and run one job in the calling thread. Returns the job or None."""
+    close_old_connections()
+    try:
+        job = claim_next_job()
+        if job is not None:
+            run_job(job)
+        return job
+    finally:
+        close_old_connections()
+
+
+def run_pending_jobs():
+    """Run queued jobs one after another until none is runnable."""
+    jobs = []
+    while True:
+        job = claim_next_job()
+        if job is None:
+            return jobs
+        jobs.append(run_job(job))
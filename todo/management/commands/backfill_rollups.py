@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from todo.rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily dashboard rollups from existing todos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only backfill these users')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        count = rows = 0
+        for user_id in users.values_list('id', flat=True).iterator():
+            rows += rebuild(user_id)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {rows} rollup rows for {count} users'))
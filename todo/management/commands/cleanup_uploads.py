@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from todo.uploads import cleanup_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned chunked upload sessions and their partial files'
+
+    def handle(self, *args, **options):
+        removed = cleanup_expired()
+        self.stdout.write(self.style.SUCCESS(f'Removed {removed} expired upload sessions'))
@@ -0,0 +1,238 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from contextlib import nullcontext
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from channels.layers import get_channel_layer
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from todo.consumers import NotificationConsumer, TodoConsumer
+from todo.realtime import notification_group
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+# Relative frequency of each operation once a client owns some todos
+OPERATION_WEIGHTS = {'todo.create': 5, 'todo.update': 3, 'todo.delete': 2}
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of ``samples``; None when there are none."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = max(int(round(fraction * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+def frame_events(frame):
+    """(action, todo) pairs carried by one TodoConsumer frame."""
+    if frame.get('type') == 'todo':
+        return [(frame['action'], frame['todo'])]
+    if frame.get('type') == 'todo.batch':
+        return [(event['action'], event['todo']) for event in frame['events']]
+    return []
+
+
+class Connection:
+    """One in-process websocket connection to a consumer.
+
+    Frames are read straight off the communicator's output queue because
+    ApplicationCommunicator.receive_output cancels the consumer on timeout.
+    """
+
+    def __init__(self, consumer, path, user):
+        scope = {'type': 'websocket', 'path': path, 'user': user, 'headers': [], 'query_string': b''}
+        self.communicator = ApplicationCommunicator(consumer.as_asgi(), scope)
+
+    async def connect(self, timeout):
+        await self.communicator.send_input({'type': 'websocket.connect'})
+        message = await self.receive_message(timeout)
+        if message['type'] != 'websocket.accept':
+            raise CommandError(f'Connection refused: {message}')
+
+    async def receive_message(self, timeout):
+        return await asyncio.wait_for(self.communicator.output_queue.get(), timeout)
+
+    async def receive_frame(self, timeout):
+        message = await self.receive_message(timeout)
+        return json.loads(message['text'])
+
+    async def send_json(self, data):
+        await self.communicator.send_input({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def close(self):
+        await self.communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await self.communicator.wait(1)
+
+
+class LoadTest:
+    def __init__(self, users, operations, broadcasts, timeout, seed):
+        self.users = users
+        self.operations = operations
+        self.broadcasts = broadcasts
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.connect_latencies = []
+        self.round_trips = []
+        self.broadcast_latencies = []
+        self.frames = 0
+        self.timeouts = 0
+
+    async def open(self, consumer, path, user):
+        connection = Connection(consumer, path, user)
+        started = time.perf_counter()
+        await connection.connect(self.timeout)
+        self.connect_latencies.append(time.perf_counter() - started)
+        return connection
+
+    async def wait_for(self, connection, matches):
+        """Read frames until one carries an event satisfying ``matches``."""
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            frame = await connection.receive_frame(remaining)
+            self.frames += 1
+            for action, todo in frame_events(frame):
+                if matches(action, todo):
+                    return todo
+
+    async def drive_todos(self, connection, rng):
+        owned = []
+        for _ in range(self.operations):
+            kind = 'todo.create'
+            if owned:
+                kind = rng.choices(list(OPERATION_WEIGHTS), weights=list(OPERATION_WEIGHTS.values()))[0]
+            marker = uuid.uuid4().hex
+
+            if kind == 'todo.create':
+                message = {'type': kind, 'todo': {'title': marker}}
+                matches = lambda action, todo: todo.get('title') == marker
+            elif kind == 'todo.update':
+                todo_id = rng.choice(owned)
+                message = {'type': kind, 'todo_id': todo_id, 'todo': {'title': marker}}
+                matches = lambda action, todo: todo.get('id') == todo_id and todo.get('title') == marker
+            else:
+                todo_id = owned.pop(rng.randrange(len(owned)))
+                message = {'type': kind, 'todo_id': todo_id}
+                matches = lambda action, todo: action == 'delete' and todo.get('id') == todo_id
+
+            started = time.perf_counter()
+            await connection.send_json(message)
+            try:
+                todo = await self.wait_for(connection, matches)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                continue
+            self.round_trips.append(time.perf_counter() - started)
+            if kind == 'todo.create':
+                owned.append(todo['id'])
+
+    async def receive_broadcasts(self, connection):
+        received = 0
+        while received < self.broadcasts:
+            try:
+                frame = await connection.receive_frame(self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return
+            self.frames += 1
+            if frame.get('type') != 'notification':
+                # e.g. the unread snapshot sent on connect
+                continue
+            received += 1
+            self.broadcast_latencies.append(time.perf_counter() - frame['message']['sent_at'])
+
+    async def broadcast(self, layer):
+        for sequence in range(self.broadcasts):
+            for user in self.users:
+                await layer.group_send(notification_group(user.id), {
+                    'type': 'notification.message',
+                    'message': {'sequence': sequence, 'sent_at': time.perf_counter()},
+                })
+            await asyncio.sleep(0)
+
+    async def run(self):
+        layer = get_channel_layer()
+        connections = await asyncio.gather(*[
+            self.open(consumer, path, user)
+            for user in self.users
+            for consumer, path in ((TodoConsumer, '/ws/todos/'), (NotificationConsumer, '/ws/notifications/'))
+        ])
+        todo_connections, notification_connections = connections[0::2], connections[1::2]
+
+        started = time.perf_counter()
+        await asyncio.gather(
+            self.broadcast(layer),
+            *[self.receive_broadcasts(connection) for connection in notification_connections],
+            *[
+                self.drive_todos(connection, random.Random(self.random.random()))
+                for connection in todo_connections
+            ],
+        )
+        self.elapsed = time.perf_counter() - started
+
+        await asyncio.gather(*[connection.close() for connection in connections])
+
+
+class Command(BaseCommand):
+    help = 'Measure TodoConsumer and NotificationConsumer throughput with in-process websocket clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=50,
+                            help='Concurrent users, each with a todo and a notification socket')
+        parser.add_argument('--operations', type=int, default=20,
+                            help='Create/update/delete messages sent by each user')
+        parser.add_argument('--broadcasts', type=int, default=20,
+                            help='Notifications broadcast to every user')
+        parser.add_argument('--timeout', type=float, default=5.0,
+                            help='Seconds to wait for any single reply')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the operation mix')
+        parser.add_argument('--use-configured-layer', action='store_true',
+                            help='Use CHANNEL_LAYERS from settings instead of an in-memory layer')
+
+    def handle(self, *args, **options):
+        prefix = f'loadtest-{uuid.uuid4().hex[:8]}'
+        User.objects.bulk_create([
+            User(username=f'{prefix}-{index}') for index in range(max(options['connections'], 1))
+        ])
+        users = list(User.objects.filter(username__startswith=f'{prefix}-').order_by('id'))
+        load_test = LoadTest(users, options['operations'], options['broadcasts'], options['timeout'], options['seed'])
+
+        layer_settings = nullcontext()
+        if not options['use_configured_layer']:
+            layer_settings = override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+        with layer_settings:
+            try:
+                async_to_sync(load_test.run)()
+            finally:
+                # Deleting the users cascades to the todos they created
+                User.objects.filter(username__startswith=f'{prefix}-').delete()
+
+        self.report(load_test)
+
+    def report(self, load_test):
+        self.stdout.write(f'Connections: {len(load_test.connect_latencies)} in {load_test.elapsed:.2f}s of traffic')
+        for label, samples in (
+            ('Connect latency', load_test.connect_latencies),
+            ('Todo round trip', load_test.round_trips),
+            ('Broadcast delivery', load_test.broadcast_latencies),
+        ):
+            if not samples:
+                self.stdout.write(f'{label}: no samples')
+                continue
+            p50, p95, p99 = (percentile(samples, fraction) * 1000 for fraction in (0.5, 0.95, 0.99))
+            self.stdout.write(
+                f'{label} (ms): p50={p50:.1f} p95={p95:.1f} p99={p99:.1f} '
+                f'max={max(samples) * 1000:.1f} n={len(samples)}'
+            )
+        rate = load_test.frames / load_test.elapsed if load_test.elapsed else 0.0
+        self.stdout.write(f'Frames received: {load_test.frames} ({rate:.0f} messages/sec)')
+        if load_test.timeouts:
+            self.stdout.write(self.style.WARNING(f'Timed out waiting for {load_test.timeouts} replies'))
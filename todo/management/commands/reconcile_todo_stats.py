@@ -0,0 +1,20 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from todo.stats import recompute
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-user todo stats from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only reconcile these users')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+        count = 0
+        for user in users.iterator():
+            recompute(user)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Reconciled stats for {count} users'))
@@ -0,0 +1,38 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.core.management.base import BaseCommand
+from todo.jobs import run_next_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued import and export jobs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2,
+                            help='Jobs run at the same time by this worker')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        concurrency = max(options['concurrency'], 1)
+        running = set()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                # Fill free slots; each slot claims one job and reports what it ran
+                while len(running) < concurrency:
+                    running.add(pool.submit(run_next_job))
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+
+                idle = False
+                for future in done:
+                    job = future.result()
+                    if job is None:
+                        idle = True
+                    else:
+                        self.stdout.write(f'{job} finished')
+                if idle:
+                    if options['once'] and not running:
+                        return
+                    time.sleep(options['poll_interval'])
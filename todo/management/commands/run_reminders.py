@@ -0,0 +1,47 @@
+import asyncio
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+from todo.reminders import REMINDER_GROUP, ReminderScheduler, send_due_reminders
+
+
+class Command(BaseCommand):
+    help = 'Send due-date reminders to connected users as todos fall due'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-sleep', type=float, default=60.0,
+                            help='Longest wait between checks, in seconds')
+        parser.add_argument('--once', action='store_true',
+                            help='Send the reminders that are due now and exit')
+
+    def handle(self, *args, **options):
+        scheduler = ReminderScheduler()
+        if options['once']:
+            scheduler.load()
+            sent = send_due_reminders(scheduler)
+            self.stdout.write(f'Sent {sent} reminders')
+            return
+        async_to_sync(self.run)(scheduler, options['max_sleep'])
+
+    async def run(self, scheduler, max_sleep):
+        layer = get_channel_layer()
+        channel = await layer.new_channel() if layer is not None else None
+        while True:
+            if channel is not None:
+                # Re-joining keeps the membership from expiring on Redis
+                await layer.group_add(REMINDER_GROUP, channel)
+            loaded = await database_sync_to_async(scheduler.load)()
+            sent = await database_sync_to_async(send_due_reminders)(scheduler)
+            if loaded or sent:
+                self.stdout.write(f'Loaded {loaded} due dates, sent {sent} reminders')
+
+            timeout = min(scheduler.seconds_until_next(), max_sleep)
+            if channel is None:
+                await asyncio.sleep(timeout)
+                continue
+            try:
+                message = await asyncio.wait_for(layer.receive(channel), timeout)
+            except asyncio.TimeoutError:
+                continue
+            scheduler.handle_message(message)
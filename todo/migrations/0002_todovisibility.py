@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:22
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_visibility(apps, schema_editor):
+    Todo = apps.get_model('todo', 'Todo')
+    TodoShare = apps.get_model('todo', 'TodoShare')
+    TodoVisibility = apps.get_model('todo', 'TodoVisibility')
+
+    rows = [
+        TodoVisibility(user_id=user_id, todo_id=todo_id)
+        for todo_id, user_id in Todo.objects.values_list('id', 'user_id').iterator()
+    ]
+    rows += [
+        TodoVisibility(user_id=user_id, todo_id=todo_id)
+        for todo_id, user_id in TodoShare.objects.values_list('todo_id', 'shared_with_id').iterator()
+    ]
+    TodoVisibility.objects.bulk_create(rows, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TodoVisibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('todo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visibility', to='todo.todo')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='todo_visibility', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'todo')},
+            },
+        ),
+        migrations.RunPython(backfill_visibility, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABLE = 'todo_todosearchdocument'
+
+CREATE_SQL = {
+    'sqlite': [
+        f"CREATE VIRTUAL TABLE {TABLE} USING fts5(title, description, tokenize='porter unicode61')",
+    ],
+    'postgresql': [
+        f"CREATE TABLE {TABLE} ("
+        f"rowid bigint PRIMARY KEY, "
+        f"title text NOT NULL, "
+        f"description text NOT NULL, "
+        f"document tsvector GENERATED ALWAYS AS ("
+        f"setweight(to_tsvector('english', title), 'A') || "
+        f"setweight(to_tsvector('english', description), 'B')) STORED)",
+        f"CREATE INDEX {TABLE}_document_gin ON {TABLE} USING GIN (document)",
+    ],
+}
+
+
+def create_search_table(apps, schema_editor):
+    statements = CREATE_SQL.get(schema_editor.connection.vendor)
+    if not statements:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+    schema_editor.execute(
+        f"INSERT INTO {TABLE} (rowid, title, description) "
+        f"SELECT id, title, description FROM todo_todo"
+    )
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE_SQL:
+        schema_editor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0002_todovisibility'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TodoSearchDocument',
+            fields=[
+                ('todo', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='todo.todo')),
+                ('title', models.TextField()),
+                ('description', models.TextField()),
+            ],
+            options={
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
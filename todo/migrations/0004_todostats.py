@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:26
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('todo', '0003_todosearchdocument'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TodoStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='todo_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('total', models.IntegerField(default=0)),
+                ('pending', models.IntegerField(default=0)),
+                ('in_progress', models.IntegerField(default=0)),
+                ('completed', models.IntegerField(default=0)),
+                ('low_priority', models.IntegerField(default=0)),
+                ('medium_priority', models.IntegerField(default=0)),
+                ('high_priority', models.IntegerField(default=0)),
+                ('shared_with_me', models.IntegerField(default=0)),
+                ('overdue', models.IntegerField(default=0)),
+                ('overdue_checked_at', models.DateTimeField(blank=True, null=True)),
+                ('next_overdue_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 06:50
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0006_notification'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='todo',
+            name='reminder_sent_for',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='todo',
+            index=models.Index(fields=['due_date'], name='todo_todo_due_dat_4529b3_idx'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:03
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_changes(apps, schema_editor):
+    Category = apps.get_model('todo', 'Category')
+    TodoVisibility = apps.get_model('todo', 'TodoVisibility')
+    SyncChange = apps.get_model('todo', 'SyncChange')
+    SyncSequence = apps.get_model('todo', 'SyncSequence')
+
+    objects = {}
+    for user_id, todo_id in TodoVisibility.objects.order_by('id').values_list('user_id', 'todo_id').iterator():
+        objects.setdefault(user_id, []).append(('todo', todo_id))
+    for user_id, category_id in Category.objects.order_by('id').values_list('user_id', 'id').iterator():
+        objects.setdefault(user_id, []).append(('category', category_id))
+
+    now = django.utils.timezone.now()
+    rows, sequences = [], []
+    for user_id, items in objects.items():
+        rows += [
+            SyncChange(user_id=user_id, kind=kind, object_id=object_id, seq=seq, changed_at=now)
+            for seq, (kind, object_id) in enumerate(items, start=1)
+        ]
+        sequences.append(SyncSequence(user_id=user_id, last_seq=len(items)))
+    SyncChange.objects.bulk_create(rows, batch_size=1000)
+    SyncSequence.objects.bulk_create(sequences, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('todo', '0008_category_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncSequence',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='sync_sequence', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('last_seq', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SyncChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('todo', 'Todo'), ('category', 'Category')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('seq', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_changes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'seq'], name='todo_syncch_user_id_938d8d_idx')],
+                'unique_together': {('user', 'kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:19
+
+import todo.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0009_sync_changes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField()),
+                ('ref_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='todoattachment',
+            name='file',
+            field=models.FileField(storage=todo.storage.DeduplicatingStorage(), upload_to='todo_attachments/'),
+        ),
+    ]
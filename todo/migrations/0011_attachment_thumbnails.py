@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:22
+
+import mimetypes
+
+from django.db import migrations, models
+
+
+def queue_existing_thumbnails(apps, schema_editor):
+    BackgroundJob = apps.get_model('todo', 'BackgroundJob')
+    TodoAttachment = apps.get_model('todo', 'TodoAttachment')
+
+    image_types = {'image/bmp', 'image/gif', 'image/jpeg', 'image/png', 'image/tiff', 'image/webp'}
+    jobs = [
+        BackgroundJob(user_id=user_id, kind='thumbnail', params={'attachment_id': attachment_id})
+        for attachment_id, user_id, file_name in TodoAttachment.objects.order_by('id').values_list(
+            'id', 'todo__user_id', 'file_name'
+        ).iterator()
+        if mimetypes.guess_type(file_name)[0] in image_types
+    ]
+    BackgroundJob.objects.bulk_create(jobs, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0010_attachment_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='todoattachment',
+            name='thumbnail',
+            field=models.FileField(blank=True, editable=False, upload_to='todo_attachments/'),
+        ),
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('import', 'Import'), ('export', 'Export'), ('thumbnail', 'Thumbnail')], max_length=20),
+        ),
+        migrations.RunPython(queue_existing_thumbnails, migrations.RunPython.noop),
+    ]
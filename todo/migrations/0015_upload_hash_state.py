@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0014_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='hash_state',
+            field=models.BinaryField(null=True),
+        ),
+    ]
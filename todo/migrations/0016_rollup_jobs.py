@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0015_upload_hash_state'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='backgroundjob',
+            name='kind',
+            field=models.CharField(choices=[('import', 'Import'), ('export', 'Export'), ('thumbnail', 'Thumbnail'), ('rollup', 'Dashboard rebuild')], max_length=20),
+        ),
+    ]
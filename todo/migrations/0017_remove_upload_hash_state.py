@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('todo', '0016_rollup_jobs'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='uploadsession',
+            name='hash_state',
+        ),
+    ]
@@ -1,6 +1,8 @@
-from django.db import models
+import uuid
+from django.db import models, router, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
+from .storage import attachment_storage, release
 
 
 class Category(models.Model):
@@ -8,11 +10,57 @@ class Category(models.Model):
     color = models.CharField(max_length=7, default='#007bff')  # Hex color
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='categories')
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
 
 
+class TodoQuerySet(models.QuerySet):
+    def visible_to(self, user):
+        """Todos owned by or shared with ``user``, resolved through TodoVisibility."""
+        return self.filter(visibility__user=user)
+
+    def saved_states(self):
+        """Map each id to its tracked and rollup field values, locking the rows.
+
+        Taken in the transaction of a set-based update, before and after it,
+        this is what the bulk hooks in ``todo.signals`` diff.
+        """
+        fields = dict.fromkeys(Todo.TRACKED_FIELDS + Todo.ROLLUP_FIELDS)
+        return {row.pop('id'): row for row in self.select_for_update().values('id', *fields)}
+
+    def toggle_status(self):
+        """Flip completed todos back to pending and everything else to completed.
+
+        The new status is computed by the database in one UPDATE, so
+        concurrent toggles of the same row never overwrite each other.
+        """
+        now = timezone.now()
+        return self.update(
+            status=models.Case(
+                models.When(status='completed', then=models.Value('pending')),
+                default=models.Value('completed'),
+            ),
+            completed_at=models.Case(
+                models.When(~models.Q(status='completed'), then=models.Value(now)),
+                default=models.Value(None),
+            ),
+            updated_at=now,
+        )
+
+
+def completed_at_for(status, completed_at):
+    """The ``completed_at`` a todo with ``status`` is saved with, given the one it has.
+
+    The rollups count completions on the day of completed_at, so it is set
+    exactly while a todo is completed. An existing completion time is kept.
+    """
+    if status != 'completed':
+        return None
+    return completed_at or timezone.now()
+
+
 class Todo(models.Model):
     PRIORITY_CHOICES = [
         ('low', 'Low'),
@@ -37,21 +85,131 @@ class Todo(models.Model):
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, blank=True, related_name='todos')
     completed_at = models.DateTimeField(null=True, blank=True)
     is_shared = models.BooleanField(default=False)
+    # Due date the last reminder was sent for, see ``todo.reminders``
+    reminder_sent_for = models.DateTimeField(null=True, blank=True, editable=False)
+
+    objects = TodoQuerySet.as_manager()
+
+    # Fields whose last saved values the post_save handlers diff against
+    TRACKED_FIELDS = ('user_id', 'status', 'priority', 'due_date')
+
+    # Fields the daily rollups are keyed on, see ``todo.rollups``
+    ROLLUP_FIELDS = ('user_id', 'status', 'priority', 'category_id', 'created_at', 'completed_at')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['due_date']),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def saved_state(self, fields=TRACKED_FIELDS):
+        """Values of ``fields`` as last read from or written to the database.
+
+        Returns None for a todo that has not been saved yet, or that was
+        loaded without some of ``fields``.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        if loaded is None or any(name not in loaded for name in fields):
+            return None
+        return {name: loaded[name] for name in fields}
+
+    def apply_changes(self, values):
+        """Set ``values`` and save only the fields whose value changed.
+
+        Returns the changed field names; nothing is written if there are none.
+        A status change also sets or clears ``completed_at``.
+        """
+        if 'status' in values or 'completed_at' in values:
+            values = dict(values, completed_at=completed_at_for(
+                values.get('status', self.status), values.get('completed_at', self.completed_at)
+            ))
+        changed = [name for name, value in values.items() if getattr(self, name) != value]
+        for name in changed:
+            setattr(self, name, values[name])
+        if changed:
+            self.save(update_fields=changed + ['updated_at'])
+        return changed
+
+    def save(self, *args, **kwargs):
+        # Keep the derived per-user tables written by the post_save handlers
+        # in the same transaction as the row itself
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+        self._loaded_values = {
+            name: getattr(self, name) for name in {*self.TRACKED_FIELDS, *self.ROLLUP_FIELDS}
+        }
+
+
+class AttachmentBlob(models.Model):
+    """One stored attachment file and how many attachments use it, see ``todo.storage``."""
+    digest = models.CharField(max_length=64, primary_key=True)
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Blob {self.digest} ({self.ref_count} references)"
+
 
 class TodoAttachment(models.Model):
     todo = models.ForeignKey(Todo, on_delete=models.CASCADE, related_name='attachments')
-    file = models.FileField(upload_to='todo_attachments/')
+    file = models.FileField(upload_to='todo_attachments/', storage=attachment_storage)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     file_name = models.CharField(max_length=255)
+    # Preview written by the thumbnail job, see ``todo.thumbnails``
+    thumbnail = models.FileField(upload_to='todo_attachments/', blank=True, editable=False)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_file = instance.__dict__.get('file')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The storage takes a blob reference while the file is written, so
+        # keep it in the same transaction as the row that holds it
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            previous = getattr(self, '_loaded_file', None)
+            if previous is not None and str(previous) != self.file.name:
+                release(str(previous), using=using)
+        self._loaded_file = self.file.name
 
     def __str__(self):
         return f"{self.todo.title} - {self.file_name}"
 
 
+class UploadSession(models.Model):
+    """A chunked attachment upload in progress, see ``todo.uploads``."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    todo = models.ForeignKey(Todo, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)
+    next_chunk = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at']),
+        ]
+
+    def __str__(self):
+        return f"Upload of {self.file_name} ({self.received}/{self.size} bytes)"
+
+
 class TodoShare(models.Model):
     todo = models.ForeignKey(Todo, on_delete=models.CASCADE, related_name='shares')
     shared_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='shared_todos')
@@ -60,4 +218,201 @@ class TodoShare(models.Model):
     can_edit = models.BooleanField(default=False)
 
     class Meta:
-        unique_together = ['todo', 'shared_with']
\ No newline at end of file
+        unique_together = ['todo', 'shared_with']
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+
+
+class TodoVisibility(models.Model):
+    """One row per (user, todo) the user may see: the owner plus every share.
+
+    Maintained by the signal handlers in ``todo.signals`` so that "my todos and
+    todos shared with me" is a single indexed lookup instead of an OR across
+    TodoShare followed by DISTINCT.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='todo_visibility')
+    todo = models.ForeignKey(Todo, on_delete=models.CASCADE, related_name='visibility')
+
+    class Meta:
+        unique_together = ['user', 'todo']
+
+
+class TodoSearchDocument(models.Model):
+    """Full-text index row for a todo, maintained by ``todo.search``.
+
+    The table is created by migration 0003 with backend-specific DDL (an FTS5
+    virtual table on SQLite, a tsvector column with a GIN index on
+    PostgreSQL), so Django does not manage it.
+    """
+    todo = models.OneToOneField(
+        Todo, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid',
+        db_constraint=False, related_name='search_document'
+    )
+    title = models.TextField()
+    description = models.TextField()
+
+    class Meta:
+        managed = False
+
+
+class TodoStats(models.Model):
+    """Per-user counters over every todo the user can see, kept by ``todo.stats``.
+
+    ``overdue`` is exact as of ``overdue_checked_at``; it is refreshed on read
+    once ``next_overdue_at`` (the earliest open due date after that moment)
+    has passed.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='todo_stats')
+    total = models.IntegerField(default=0)
+    pending = models.IntegerField(default=0)
+    in_progress = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+    low_priority = models.IntegerField(default=0)
+    medium_priority = models.IntegerField(default=0)
+    high_priority = models.IntegerField(default=0)
+    shared_with_me = models.IntegerField(default=0)
+    overdue = models.IntegerField(default=0)
+    overdue_checked_at = models.DateTimeField(null=True, blank=True)
+    next_overdue_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Stats for {self.user}"
+
+
+class TodoDailyRollup(models.Model):
+    """Todos one user created and completed on one day, see ``todo.rollups``.
+
+    There is a row per (user, day, category, priority) that saw any
+    activity. ``category_id`` is 0 for uncategorized todos and is not a
+    foreign key, so rows outlive their category.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    category_id = models.BigIntegerField(default=0)
+    priority = models.CharField(max_length=10)
+    created = models.IntegerField(default=0)
+    completed = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ['user', 'day', 'category_id', 'priority']
+
+    def __str__(self):
+        return f"Rollup for {self.user} on {self.day}"
+
+
+class TodoRollupState(models.Model):
+    """Marks a user's daily rollups as built; without it a dashboard read queues a rebuild."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='rollup_state')
+    built_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Rollup state for {self.user}"
+
+
+class BackgroundJob(models.Model):
+    """An import, export, thumbnail or rollup rebuild run off the request path by ``manage.py run_jobs``."""
+    KIND_CHOICES = [
+        ('import', 'Import'),
+        ('export', 'Export'),
+        ('thumbnail', 'Thumbnail'),
+        ('rollup', 'Dashboard rebuild'),
+    ]
+
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='jobs')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    params = models.JSONField(default=dict, blank=True)
+    input_file = models.FileField(upload_to='jobs/input/', blank=True)
+    result_file = models.FileField(upload_to='jobs/results/', blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    progress = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+            models.Index(fields=['status', 'heartbeat_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} job {self.pk} ({self.status})"
+
+
+class Notification(models.Model):
+    """A message kept for a user until they acknowledge it, see ``todo.notifications``."""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    kind = models.CharField(max_length=50, blank=True)
+    message = models.JSONField(default=dict)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['user', 'is_read', 'id']),
+        ]
+
+    def __str__(self):
+        return f"Notification {self.pk} for {self.user}"
+
+
+class NotificationCounter(models.Model):
+    """Number of unread notifications per user, so badges need no COUNT query."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='notification_counter')
+    unread = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"Unread notifications for {self.user}"
+
+
+class SyncSequence(models.Model):
+    """Last change sequence number handed out for a user, see ``todo.sync``."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='sync_sequence')
+    last_seq = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Sync sequence for {self.user}"
+
+
+class SyncChange(models.Model):
+    """Latest change to one todo or category as seen by one user.
+
+    There is one row per (user, object); each change moves it to the user's
+    next sequence number, and deletes or lost access leave it as a tombstone.
+    """
+    KIND_CHOICES = [
+        ('todo', 'Todo'),
+        ('category', 'Category'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sync_changes')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    seq = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    changed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ['user', 'kind', 'object_id']
+        indexes = [
+            models.Index(fields=['user', 'seq']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} for {self.user} at {self.seq}"
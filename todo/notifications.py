@@ -0,0 +1,89 @@
+"""Persistent notifications with cached unread counts.
+
+``notify`` stores a Notification and pushes it to the user's
+NotificationConsumer sockets once the surrounding transaction commits. Each
+user's unread total lives in a NotificationCounter row that is adjusted in
+the same transaction as every write, so reading it is a primary-key lookup.
+Like TodoStats, the row is created from a recount the first time it is read.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Notification, NotificationCounter
+from .realtime import group_send, notification_group, send_notification
+
+# Most unread notifications sent to a socket when it connects
+UNREAD_LIMIT = getattr(settings, 'TODO_UNREAD_NOTIFICATIONS_LIMIT', 100)
+
+
+def payload(notification):
+    """What a client receives for ``notification``: its message plus identifying fields."""
+    return dict(
+        notification.message,
+        notification_id=notification.pk,
+        kind=notification.kind,
+        created_at=notification.created_at.isoformat(),
+    )
+
+
+def notify(user_id, message, kind=''):
+    """Store ``message`` for ``user_id`` and deliver it after commit."""
+    with transaction.atomic():
+        notification = Notification.objects.create(user_id=user_id, kind=kind, message=message)
+        NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') + 1)
+        transaction.on_commit(lambda: send_notification(user_id, payload(notification)))
+    return notification
+
+
+def unread_count(user_id):
+    unread = NotificationCounter.objects.filter(user_id=user_id).values_list('unread', flat=True).first()
+    if unread is None:
+        return recount(user_id).unread
+    return unread
+
+
+def recount(user_id):
+    """Recount ``user_id``'s unread notifications into their counter row."""
+    unread = Notification.objects.filter(user_id=user_id, is_read=False).count()
+    counter, _ = NotificationCounter.objects.update_or_create(user_id=user_id, defaults={'unread': unread})
+    return counter
+
+
+def unread_notifications(user_id, limit=UNREAD_LIMIT):
+    """Newest unread notifications first, as client payloads."""
+    notifications = Notification.objects.filter(user_id=user_id, is_read=False).order_by('-id')[:limit]
+    return [payload(notification) for notification in notifications]
+
+
+def _read_changed(user_id):
+    # Keep the badge of every open socket of the user in step
+    unread = unread_count(user_id)
+    transaction.on_commit(lambda: group_send(notification_group(user_id), {
+        'type': 'notification.count',
+        'unread': unread,
+    }))
+    return unread
+
+
+def mark_read(user_id, notification_ids):
+    """Mark the given notifications read with one UPDATE. Returns how many changed."""
+    with transaction.atomic():
+        marked = Notification.objects.filter(
+            user_id=user_id, id__in=list(notification_ids), is_read=False
+        ).update(is_read=True, read_at=timezone.now())
+        if marked:
+            NotificationCounter.objects.filter(user_id=user_id).update(unread=F('unread') - marked)
+            _read_changed(user_id)
+    return marked
+
+
+def mark_all_read(user_id):
+    with transaction.atomic():
+        marked = Notification.objects.filter(user_id=user_id, is_read=False).update(
+            is_read=True, read_at=timezone.now()
+        )
+        NotificationCounter.objects.update_or_create(user_id=user_id, defaults={'unread': 0})
+        if marked:
+            _read_changed(user_id)
+    return marked
@@ -0,0 +1,197 @@
+import base64
+import json
+from datetime import date, datetime
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Cursor pagination over the queryset's own ``order_by``.
+
+    Pages are selected with a row-value comparison against the last (or
+    first) row of the previous page, so there is no COUNT and no OFFSET.
+    ``id`` is always appended as a tie-breaker, so ``-created_at`` pages are
+    keyed on ``(created_at, id)``. Cursors are opaque base64 tokens.
+    """
+    cursor_query_param = 'cursor'
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(queryset)
+        self.model = queryset.model
+
+        position, reverse = self.decode_cursor(request)
+        ordering = self.ordering
+        if reverse:
+            ordering = [self._flip(field) for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        # Moving forwards there is a previous page whenever we started from a
+        # cursor; moving backwards there is always a next page.
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.first = self._position(results[0]) if results else None
+        self.last = self._position(results[-1]) if results else None
+        return results
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_ordering(self, queryset):
+        ordering = [
+            field for field in queryset.query.order_by
+            if isinstance(field, str) and field not in ('?',)
+        ] or ['-pk']
+        names = [field.lstrip('-') for field in ordering]
+        if 'id' not in names and 'pk' not in names:
+            descending = ordering[-1].startswith('-')
+            ordering.append('-id' if descending else 'id')
+        return ordering
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or self.last is None:
+            return None
+        return self._link(self.last, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first is None:
+            return None
+        return self._link(self.first, reverse=True)
+
+    def _link(self, position, reverse):
+        url = self.request.build_absolute_uri()
+        token = self.encode_cursor(position, reverse)
+        return replace_query_param(url, self.cursor_query_param, token)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            padded = token + '=' * (-len(token) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+            position = payload['p']
+            if len(position) != len(self.ordering):
+                raise ValueError
+            position = [
+                self._to_python(field.lstrip('-'), value)
+                for field, value in zip(self.ordering, position)
+            ]
+            return position, bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _to_python(self, name, value):
+        try:
+            field = self.model._meta.pk if name == 'pk' else self.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations such as a search rank are plain JSON scalars
+            return value
+        return field.to_python(value)
+
+    def _position(self, obj):
+        values = []
+        for field in self.ordering:
+            value = getattr(obj, field.lstrip('-'))
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            values.append(value)
+        return values
+
+    @staticmethod
+    def _flip(field):
+        return field[1:] if field.startswith('-') else '-' + field
+
+    @staticmethod
+    def _after(ordering, position):
+        """Q selecting rows strictly after ``position`` in ``ordering``."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+
+class TodoPagination(PageNumberPagination):
+    """Page-number pagination with an opt-in keyset mode.
+
+    Passing ``?pagination=cursor`` (or an existing ``cursor``) switches to
+    KeysetPagination, which skips the COUNT and OFFSET of numbered pages.
+    """
+    page_size = 10
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    mode_query_param = 'pagination'
+    keyset_class = KeysetPagination
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.use_keyset(request):
+            self.keyset = self.keyset_class()
+            self.keyset.page_size = self.page_size
+            self.keyset.page_size_query_param = self.page_size_query_param
+            self.keyset.max_page_size = self.max_page_size
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def use_keyset(self, request):
+        return (
+            request.query_params.get(self.mode_query_param) == 'cursor'
+            or self.keyset_class.cursor_query_param in request.query_params
+        )
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
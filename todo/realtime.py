@@ -0,0 +1,200 @@
+"""Pushing events from synchronous code to the websocket consumers.
+
+Todo changes are collected per database transaction and published once it
+commits: a single ``todo.message`` for one change, otherwise ``todo.batch``
+messages of at most EVENT_BATCH_SIZE events, sent to the owner's and every
+sharee's ``todos_<user_id>`` group. Repeated changes to the same todo inside
+a transaction collapse into one event.
+"""
+import logging
+import weakref
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import connections, transaction
+from .models import Todo, TodoVisibility
+from .serializers import TodoListSerializer
+
+logger = logging.getLogger(__name__)
+
+# Events carried by one todo.batch channel message
+EVENT_BATCH_SIZE = getattr(settings, 'TODO_EVENT_BATCH_SIZE', 500)
+
+def notification_group(user_id):
+    return f"notifications_{user_id}"
+
+
+def todo_group(user_id):
+    return f"todos_{user_id}"
+
+
+def group_send(group, event):
+    """Send ``event`` to a channel layer group, logging rather than raising.
+
+    A missing or unreachable channel layer must never fail the write or job
+    that triggered the event.
+    """
+    layer = get_channel_layer()
+    if layer is None:
+        return
+    try:
+        async_to_sync(layer.group_send)(group, event)
+    except Exception:
+        logger.exception('Could not send %s to group %s', event.get('type'), group)
+
+
+def send_notification(user_id, message):
+    """Deliver ``message`` to every NotificationConsumer of ``user_id``."""
+    group_send(notification_group(user_id), {
+        'type': 'notification.message',
+        'message': message,
+    })
+
+
+def merge_actions(previous, action):
+    """Coalesce two consecutive actions on one todo; None means nothing to send."""
+    if previous is None:
+        return action
+    if previous == 'create':
+        return None if action == 'delete' else 'create'
+    if previous == 'delete':
+        return 'update' if action == 'create' else 'delete'
+    return action
+
+
+class _ChangeBatch:
+    """Changes made in one transaction, published when it commits."""
+
+    def __init__(self, using):
+        self.using = using
+        # todo id -> action, recipients resolved from TodoVisibility at flush
+        self.changes = {}
+        # todo id -> user ids captured before the visibility rows went away
+        self.deleted_recipients = {}
+        # (user id, todo id) -> action, for share grants and revocations
+        self.targeted = {}
+
+    def add(self, todo_id, action, recipients=None):
+        merged = merge_actions(self.changes.get(todo_id), action)
+        if todo_id in self.changes and merged is None:
+            del self.changes[todo_id]
+        elif merged is not None:
+            self.changes[todo_id] = merged
+        if recipients is not None:
+            self.deleted_recipients[todo_id] = set(recipients)
+
+    def add_targeted(self, user_id, todo_id, action):
+        key = (user_id, todo_id)
+        merged = merge_actions(self.targeted.get(key), action)
+        if merged is None:
+            self.targeted.pop(key, None)
+        else:
+            self.targeted[key] = merged
+
+    def __call__(self):
+        connection = connections[self.using]
+        if _batch_of(connection) is self:
+            connection.todo_change_batch = None
+        try:
+            self.publish()
+        except Exception:
+            logger.exception('Could not publish todo changes')
+
+    def publish(self):
+        upserts = {todo_id for todo_id, action in self.changes.items() if action != 'delete'}
+        upserts |= {todo_id for (_, todo_id), action in self.targeted.items() if action != 'delete'}
+        todos = {}
+        if upserts:
+            queryset = TodoListSerializer.with_related(Todo.objects.using(self.using).filter(id__in=upserts))
+            todos = {todo.id: TodoListSerializer(todo).data for todo in queryset}
+
+        recipients = {}
+        changed = [todo_id for todo_id in self.changes if todo_id in todos]
+        if changed:
+            rows = TodoVisibility.objects.using(self.using).filter(
+                todo_id__in=changed
+            ).values_list('todo_id', 'user_id')
+            for todo_id, user_id in rows:
+                recipients.setdefault(todo_id, set()).add(user_id)
+        recipients.update(self.deleted_recipients)
+
+        events = {}
+        for todo_id, action in self.changes.items():
+            for user_id in recipients.get(todo_id, ()):
+                events.setdefault(user_id, {})[todo_id] = action
+        for (user_id, todo_id), action in self.targeted.items():
+            events.setdefault(user_id, {})[todo_id] = action
+
+        for user_id, user_events in events.items():
+            payload = []
+            for todo_id, action in user_events.items():
+                if action == 'delete':
+                    payload.append({'action': 'delete', 'todo_data': {'id': todo_id}})
+                elif todo_id in todos:
+                    payload.append({'action': action, 'todo_data': todos[todo_id]})
+            _send_todo_events(user_id, payload)
+
+
+def _send_todo_events(user_id, events):
+    if len(events) == 1:
+        group_send(todo_group(user_id), dict(events[0], type='todo.message'))
+        return
+    for start in range(0, len(events), EVENT_BATCH_SIZE):
+        group_send(todo_group(user_id), {
+            'type': 'todo.batch',
+            'events': events[start:start + EVENT_BATCH_SIZE],
+        })
+
+
+def _batch_of(connection):
+    ref = getattr(connection, 'todo_change_batch', None)
+    return ref() if ref is not None else None
+
+
+def _current_batch(using):
+    """The batch for the running transaction, registered to publish on commit.
+
+    The connection only holds a weak reference: when the transaction or
+    savepoint the batch was registered in rolls back, Django drops the
+    on_commit callback and the batch with it, so the next change starts a
+    new one.
+    """
+    connection = connections[using]
+    batch = _batch_of(connection)
+    if batch is None:
+        batch = _ChangeBatch(using)
+        connection.todo_change_batch = weakref.ref(batch)
+        transaction.on_commit(batch, using=using)
+    return batch
+
+
+def _record(using, record):
+    """Apply ``record`` to the current batch, publishing at once outside a transaction."""
+    if not connections[using].in_atomic_block:
+        batch = _ChangeBatch(using)
+        record(batch)
+        batch()
+        return
+    record(_current_batch(using))
+
+
+def todo_changed(todo_id, action, using='default'):
+    """Queue a ``create`` or ``update`` event for everyone who can see the todo."""
+    _record(using, lambda batch: batch.add(todo_id, action))
+
+
+def todos_changed(todo_ids, action, using='default'):
+    def record(batch):
+        for todo_id in todo_ids:
+            batch.add(todo_id, action)
+    _record(using, record)
+
+
+def todo_deleted(todo_id, recipients, using='default'):
+    """Queue a ``delete`` event; ``recipients`` must be read before the delete."""
+    _record(using, lambda batch: batch.add(todo_id, 'delete', recipients))
+
+
+def todo_access_changed(user_id, todo_id, granted, using='default'):
+    """Queue a create (share granted) or delete (share revoked) for one user."""
+    _record(using, lambda batch: batch.add_targeted(user_id, todo_id, 'create' if granted else 'delete'))
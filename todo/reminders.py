@@ -0,0 +1,165 @@
+"""Due-date reminders pushed to ``notifications_<user_id>`` groups.
+
+``manage.py run_reminders`` keeps a ReminderScheduler: a heap of the due
+dates falling inside a sliding window, loaded a slice at a time from the
+``due_date`` index. Todo writes announce changed due dates on the
+REMINDER_GROUP channel group so the heap follows them promptly; the loaded
+window is also re-read every RESCAN_INTERVAL, so a lost message only delays
+a reminder.
+Before firing, a conditional UPDATE of ``Todo.reminder_sent_for`` checks the
+todo still has that due date and claims the reminder, so restarts and
+concurrent schedulers never send one twice.
+"""
+import heapq
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Todo, TodoVisibility
+from .notifications import notify
+from .realtime import group_send
+from .stats import as_datetime
+
+REMINDER_GROUP = 'todo_reminders'
+
+# How far ahead of now due dates are held in memory
+LOOKAHEAD = timedelta(seconds=getattr(settings, 'TODO_REMINDER_LOOKAHEAD_SECONDS', 3600))
+
+# Due dates this far in the past still get a reminder, e.g. after a restart
+GRACE = timedelta(seconds=getattr(settings, 'TODO_REMINDER_GRACE_SECONDS', 3600))
+
+# How often the whole loaded window is re-read instead of trusting the messages
+RESCAN_INTERVAL = timedelta(seconds=getattr(settings, 'TODO_REMINDER_RESCAN_SECONDS', 60))
+
+
+def reschedule(todos, using='default'):
+    """Tell running schedulers about new due dates once the transaction commits."""
+    changes = []
+    for todo in todos:
+        due = as_datetime(todo.due_date)
+        if todo.status == 'completed' or due is None:
+            changes.append([todo.pk, None])
+        else:
+            changes.append([todo.pk, due.isoformat()])
+    if changes:
+        transaction.on_commit(
+            lambda: group_send(REMINDER_GROUP, {'type': 'reminder.reschedule', 'todos': changes}),
+            using=using,
+        )
+
+
+class ReminderScheduler:
+    """Upcoming due dates in a heap, fed from the database one window at a time.
+
+    ``entries`` holds the current due date of every scheduled todo; heap
+    items that no longer match it are stale and skipped when popped.
+    """
+
+    def __init__(self, now=None):
+        now = now or timezone.now()
+        self.heap = []
+        self.entries = {}
+        self.loaded_until = now - GRACE
+        self.rescan_at = now
+
+    def schedule(self, todo_id, due):
+        self.entries[todo_id] = due
+        heapq.heappush(self.heap, (due, todo_id))
+
+    def load(self, now=None):
+        """Load due dates up to ``now + LOOKAHEAD``. Returns how many were new or moved.
+
+        Only the part not loaded yet is read, except every RESCAN_INTERVAL
+        when the whole window is, picking up changes whose message was lost.
+        """
+        now = now or timezone.now()
+        until = now + LOOKAHEAD
+        if now >= self.rescan_at:
+            since = now - GRACE
+            self.rescan_at = now + RESCAN_INTERVAL
+        elif until <= self.loaded_until:
+            return 0
+        else:
+            since = self.loaded_until
+        rows = Todo.objects.filter(
+            due_date__gt=since, due_date__lte=until
+        ).exclude(
+            status='completed'
+        ).exclude(
+            reminder_sent_for=F('due_date')
+        ).values_list('id', 'due_date')
+        loaded = 0
+        for todo_id, due in rows.iterator(chunk_size=1000):
+            if self.entries.get(todo_id) != due:
+                self.schedule(todo_id, due)
+                loaded += 1
+        self.loaded_until = until
+        return loaded
+
+    def reschedule(self, todo_id, due, now=None):
+        """Apply a due date change announced on REMINDER_GROUP."""
+        now = now or timezone.now()
+        if due is not None and now - GRACE <= due <= self.loaded_until:
+            self.schedule(todo_id, due)
+        else:
+            # Outside the window it is picked up by a later load(), if at all
+            self.entries.pop(todo_id, None)
+
+    def handle_message(self, message, now=None):
+        for todo_id, due in message.get('todos', []):
+            self.reschedule(todo_id, as_datetime(due) if due else None, now)
+
+    def pop_due(self, now=None):
+        """Remove and return ``(todo_id, due)`` for every reminder due by ``now``."""
+        now = now or timezone.now()
+        due_now = []
+        while self.heap and self.heap[0][0] <= now:
+            due, todo_id = heapq.heappop(self.heap)
+            if self.entries.get(todo_id) == due:
+                del self.entries[todo_id]
+                due_now.append((todo_id, due))
+        return due_now
+
+    def seconds_until_next(self, now=None):
+        """How long the caller may sleep before the next reminder, window load or rescan."""
+        now = now or timezone.now()
+        wake = min(self.loaded_until, self.rescan_at)
+        while self.heap and self.entries.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if self.heap:
+            wake = min(wake, self.heap[0][0])
+        return max((wake - now).total_seconds(), 0.0)
+
+
+def send_reminder(todo_id, due):
+    """Claim and deliver the reminder for ``todo_id`` due at ``due``.
+
+    Returns False when the todo changed since it was scheduled (deleted,
+    completed, moved to another date) or another scheduler already sent it.
+    """
+    with transaction.atomic():
+        claimed = Todo.objects.filter(
+            pk=todo_id, due_date=due
+        ).exclude(
+            status='completed'
+        ).exclude(
+            reminder_sent_for=due
+        ).update(reminder_sent_for=due)
+        if not claimed:
+            return False
+        todo = Todo.objects.only('id', 'title', 'due_date').get(pk=todo_id)
+        message = {
+            'event': 'todo.reminder',
+            'todo_id': todo.pk,
+            'title': todo.title,
+            'due_date': todo.due_date.isoformat(),
+        }
+        for user_id in TodoVisibility.objects.filter(todo_id=todo_id).values_list('user_id', flat=True):
+            notify(user_id, message, kind='reminder')
+    return True
+
+
+def send_due_reminders(scheduler, now=None):
+    """Fire every reminder the scheduler holds for ``now``. Returns the number sent."""
+    return sum(send_reminder(todo_id, due) for todo_id, due in scheduler.pop_due(now))
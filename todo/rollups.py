@@ -0,0 +1,297 @@
+"""Per-user daily rollups behind the dashboard.
+
+The rollups cover the todos a user owns; todos shared with them count
+towards their owner's. Every todo a user owns counts as created on the day
+of its ``created_at``.
+While its status is completed it also counts as completed on the day of its
+``completed_at``. Both counts are kept in TodoDailyRollup, one row per day,
+category and priority that saw activity. A dashboard over a date range
+therefore reads one row per active day and combination, about 365 rows for
+a year, instead of scanning the todo table.
+
+The signal handlers in ``todo.signals`` move a todo's counts from its old
+state to its new one in the same transaction as the write. Deleting a todo
+takes its counts away again, so the rows always describe the todos that
+exist and agree with a rebuild from scratch. Set-based updates pass the
+state they read before writing. Writes whose previous state is unknown drop
+the owner's TodoRollupState instead. The next dashboard read then queues a
+``rollup`` background job, which rebuilds the rows with two aggregate
+queries, and serves the rows as they were until it has run.
+``manage.py backfill_rollups`` rebuilds them ahead of time. New users start
+out with a TodoRollupState and no rows.
+
+Days are calendar days in the current time zone.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from functools import reduce
+import operator
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from .models import BackgroundJob, Category, Todo, TodoDailyRollup, TodoRollupState
+from . import stats
+
+# Longest range, in days, one dashboard request may cover
+MAX_RANGE_DAYS = getattr(settings, 'TODO_DASHBOARD_MAX_DAYS', 3660)
+
+# Range shown when a request gives no start date
+DEFAULT_RANGE_DAYS = 30
+
+PRIORITIES = [value for value, _ in Todo.PRIORITY_CHOICES]
+
+
+def current_state(todo):
+    return {name: getattr(todo, name) for name in Todo.ROLLUP_FIELDS}
+
+
+def _day(value):
+    return timezone.localdate(stats.as_datetime(value))
+
+
+def _counts(state):
+    """The (key, created, completed) counts one todo in ``state`` contributes."""
+    category_id = state['category_id'] or 0
+    yield (state['user_id'], _day(state['created_at']), category_id, state['priority']), 1, 0
+    if state['status'] == 'completed' and state['completed_at'] is not None:
+        yield (state['user_id'], _day(state['completed_at']), category_id, state['priority']), 0, 1
+
+
+def _deltas(changes):
+    """Net (created, completed) change per rollup key for ``(old, new)`` state pairs."""
+    deltas = defaultdict(lambda: [0, 0])
+    for old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            for key, created, completed in _counts(state):
+                deltas[key][0] += sign * created
+                deltas[key][1] += sign * completed
+    return {key: delta for key, delta in deltas.items() if any(delta)}
+
+
+def _apply(changes, using='default'):
+    deltas = _deltas(changes)
+    if not deltas:
+        return
+    # Users without built rows get everything from their rebuild instead
+    built = set(TodoRollupState.objects.using(using).filter(
+        user_id__in={key[0] for key in deltas}
+    ).values_list('user_id', flat=True))
+    deltas = {key: delta for key, delta in deltas.items() if key[0] in built}
+    if not deltas:
+        return
+    rows = TodoDailyRollup.objects.using(using)
+    # Missing rows start at zero; a fixed order keeps concurrent writers from deadlocking
+    rows.bulk_create([
+        TodoDailyRollup(user_id=user_id, day=day, category_id=category_id, priority=priority)
+        for user_id, day, category_id, priority in sorted(deltas)
+    ], ignore_conflicts=True)
+    # Keys that move by the same amount share one UPDATE
+    keys_by_delta = defaultdict(list)
+    for key, delta in deltas.items():
+        keys_by_delta[tuple(delta)].append(key)
+    for (created, completed), keys in sorted(keys_by_delta.items()):
+        rows.filter(reduce(operator.or_, [
+            Q(user_id=user_id, day=day, category_id=category_id, priority=priority)
+            for user_id, day, category_id, priority in sorted(keys)
+        ])).update(created=F('created') + created, completed=F('completed') + completed)
+
+
+def invalidate(user_ids, using='default'):
+    """Mark the rollups of ``user_ids`` for a rebuild on next read."""
+    TodoRollupState.objects.using(using).filter(user_id__in=list(user_ids)).delete()
+
+
+def todo_saved(todo, old_state, created=False, using='default'):
+    new_state = current_state(todo)
+    if created:
+        _apply([(None, new_state)], using)
+    elif old_state is None:
+        invalidate([todo.user_id], using)
+    elif old_state != new_state:
+        _apply([(old_state, new_state)], using)
+
+
+def todo_deleted(todo, using='default'):
+    # The instance may predate a set-based update, so the row is read back
+    state = Todo.objects.using(using).filter(pk=todo.pk).saved_states().get(todo.pk) or current_state(todo)
+    _apply([(state, None)], using)
+
+
+def todos_created(todos, using='default'):
+    _apply([(None, current_state(todo)) for todo in todos], using)
+
+
+def todos_updated(before, after, using='default'):
+    """Move the counts of todos from their ``before`` to their ``after`` state.
+
+    Both map todo ids to ``TodoQuerySet.saved_states`` taken around the update.
+    """
+    _apply([(state, after.get(todo_id)) for todo_id, state in before.items()], using)
+
+
+def rebuild(user_id, using='default', progress=None):
+    """Recount ``user_id``'s rollups from their todos with two aggregate queries.
+
+    ``progress(done, total)`` is called after each aggregate, before the
+    rows are replaced in one transaction.
+    """
+    todos = Todo.objects.using(using).filter(user_id=user_id)
+    fields = ('day', 'category_id', 'priority')
+    counts = defaultdict(lambda: [0, 0])
+    created = todos.annotate(day=TruncDate('created_at')).values(*fields).annotate(n=Count('id'))
+    for row in created:
+        counts[row['day'], row['category_id'] or 0, row['priority']][0] += row['n']
+    if progress:
+        progress(1, 3)
+    completed = todos.filter(status='completed', completed_at__isnull=False).annotate(
+        day=TruncDate('completed_at')
+    ).values(*fields).annotate(n=Count('id'))
+    for row in completed:
+        counts[row['day'], row['category_id'] or 0, row['priority']][1] += row['n']
+    if progress:
+        progress(2, 3)
+
+    with transaction.atomic(using=using):
+        TodoDailyRollup.objects.using(using).filter(user_id=user_id).delete()
+        # A concurrent rebuild writes the same rows, so conflicts are skipped
+        TodoDailyRollup.objects.using(using).bulk_create([
+            TodoDailyRollup(
+                user_id=user_id, day=day, category_id=category_id, priority=priority,
+                created=created, completed=completed,
+            )
+            for (day, category_id, priority), (created, completed) in counts.items()
+        ], batch_size=1000, ignore_conflicts=True)
+        TodoRollupState.objects.using(using).update_or_create(
+            user_id=user_id, defaults={'built_at': timezone.now()}
+        )
+    return len(counts)
+
+
+def ensure_built(user_id, using='default'):
+    if not TodoRollupState.objects.using(using).filter(user_id=user_id).exists():
+        rebuild(user_id, using)
+
+
+def user_created(user_id, using='default'):
+    """Mark a new user's rollups built; they have no todos to count yet."""
+    TodoRollupState.objects.using(using).get_or_create(user_id=user_id)
+
+
+def request_rebuild(user_id, using='default'):
+    """Queue a rebuild of ``user_id``'s rollups unless one is already pending.
+
+    Returns True if the rollups are not built.
+    """
+    if TodoRollupState.objects.using(using).filter(user_id=user_id).exists():
+        return False
+    pending = BackgroundJob.objects.using(using).filter(
+        user_id=user_id, kind='rollup', status__in=['queued', 'running']
+    )
+    if not pending.exists():
+        BackgroundJob.objects.using(using).create(user_id=user_id, kind='rollup')
+    return True
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a date in YYYY-MM-DD format.')
+
+
+def parse_range(start=None, end=None):
+    """The ``(start, end)`` dates asked for, both inclusive.
+
+    ``end`` defaults to today and ``start`` to DEFAULT_RANGE_DAYS before
+    it. Raises ValueError for malformed, reversed or oversized ranges.
+    """
+    end = _parse_date(end, 'end') if end else timezone.localdate()
+    start = _parse_date(start, 'start') if start else end - timedelta(days=DEFAULT_RANGE_DAYS - 1)
+    if start > end:
+        raise ValueError('start must not be after end.')
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise ValueError(f'A range may cover at most {MAX_RANGE_DAYS} days.')
+    return start, end
+
+
+def _week(day):
+    return day - timedelta(days=day.weekday())
+
+
+def dashboard(user, start, end):
+    """Analytics over the todos ``user`` owns from ``start`` to ``end`` inclusive.
+
+    Daily and weekly (from Monday) series are zero-filled. ``visible``
+    holds the current open and overdue counts from the user's TodoStats,
+    which unlike the rest include the todos shared with them. While the
+    rollups wait for a rebuild, ``rebuilding`` is true and the series are
+    the last ones built.
+    """
+    rebuilding = request_rebuild(user.id)
+    rows = TodoDailyRollup.objects.filter(user=user, day__range=(start, end)).values_list(
+        'day', 'category_id', 'priority', 'created', 'completed'
+    )
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    daily = {day: [0, 0] for day in days}
+    weekly = {_week(day): [0, 0] for day in days}
+    by_category = defaultdict(lambda: [0, 0])
+    by_priority = {priority: [0, 0] for priority in PRIORITIES}
+    for day, category_id, priority, created, completed in rows:
+        buckets = (daily[day], weekly[_week(day)], by_category[category_id],
+                   by_priority.setdefault(priority, [0, 0]))
+        for bucket in buckets:
+            bucket[0] += created
+            bucket[1] += completed
+
+    categories = {
+        category['id']: category
+        for category in Category.objects.filter(user=user, id__in=list(by_category)).values('id', 'name', 'color')
+    }
+    # Rows of deleted categories count as uncategorized, like their todos
+    merged = defaultdict(lambda: [0, 0])
+    for category_id, (created, completed) in by_category.items():
+        bucket = merged[category_id if category_id in categories else 0]
+        bucket[0] += created
+        bucket[1] += completed
+
+    current = stats.get_cached_stats(user)
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'rebuilding': rebuilding,
+        'totals': {
+            'created': sum(created for created, _ in daily.values()),
+            'completed': sum(completed for _, completed in daily.values()),
+        },
+        'visible': {
+            'open': current.pending + current.in_progress,
+            'overdue': current.overdue,
+        },
+        'daily': [
+            {'date': day.isoformat(), 'created': created, 'completed': completed}
+            for day, (created, completed) in daily.items()
+        ],
+        'weekly': [
+            {'week': week.isoformat(), 'created': created, 'completed': completed}
+            for week, (created, completed) in weekly.items()
+        ],
+        'by_category': [
+            {
+                'id': categories[category_id]['id'] if category_id else None,
+                'name': categories[category_id]['name'] if category_id else 'Uncategorized',
+                'color': categories[category_id]['color'] if category_id else '#6c757d',
+                'created': created,
+                'completed': completed,
+            }
+            for category_id, (created, completed) in sorted(merged.items(), key=lambda item: -sum(item[1]))
+            if created or completed
+        ],
+        'by_priority': [
+            {'priority': priority, 'created': created, 'completed': completed}
+            for priority, (created, completed) in by_priority.items()
+        ],
+    }
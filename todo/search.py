@@ -0,0 +1,162 @@
+"""Ranked full-text search over todo titles and descriptions.
+
+The index lives in TodoSearchDocument. On SQLite it is an FTS5 virtual table
+using the porter stemmer, on PostgreSQL a tsvector column with a GIN index.
+Other backends fall back to a plain ``icontains`` scan of the todo's own
+columns, with every match ranked equally; SearchMatch and SearchRank
+compile to that scan there too.
+"""
+import re
+from django.db import connections, transaction
+from django.db.models import BooleanField, Expression, FloatField, Q, Value
+from .models import Todo, TodoSearchDocument
+
+SUPPORTED_VENDORS = ('sqlite', 'postgresql')
+
+# Relative weight of a title hit over a description hit (SQLite bm25 weights)
+TITLE_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+TABLE = TodoSearchDocument._meta.db_table
+
+
+def parse_terms(query):
+    """Split free text into lowercase word terms, dropping syntax characters."""
+    return re.findall(r'\w+', query.lower())
+
+
+def _sqlite_query(terms):
+    # Every term must match, each as a prefix of an indexed (stemmed) token
+    return ' AND '.join(f'"{term}"*' for term in terms)
+
+
+def _postgres_query(terms):
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def _icontains(terms):
+    lookup = Q()
+    for term in terms:
+        lookup &= Q(title__icontains=term) | Q(description__icontains=term)
+    return lookup
+
+
+class SearchMatch(Expression):
+    """WHERE clause matching the joined search table against ``terms``."""
+    output_field = BooleanField()
+    conditional = True
+
+    def __init__(self, terms):
+        super().__init__()
+        self.terms = terms
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        match = super().resolve_expression(query, allow_joins, reuse, summarize, for_save)
+        # Compiled instead of the index match on unsupported backends
+        match.fallback = _icontains(self.terms).resolve_expression(query, allow_joins, reuse, summarize)
+        return match
+
+    def as_sql(self, compiler, connection):
+        return compiler.compile(self.fallback)
+
+    def as_sqlite(self, compiler, connection):
+        return f'{connection.ops.quote_name(TABLE)} MATCH %s', [_sqlite_query(self.terms)]
+
+    def as_postgresql(self, compiler, connection):
+        return (
+            f"{connection.ops.quote_name(TABLE)}.document @@ to_tsquery('english', %s)",
+            [_postgres_query(self.terms)],
+        )
+
+
+class SearchRank(Expression):
+    """Relevance of the joined search row, higher is better on every backend."""
+    output_field = FloatField()
+
+    def __init__(self, terms):
+        super().__init__()
+        self.terms = terms
+
+    def as_sql(self, compiler, connection):
+        # Without an index every match ranks the same
+        return compiler.compile(Value(0.0))
+
+    def as_sqlite(self, compiler, connection):
+        # bm25() returns lower-is-better scores, so flip the sign
+        return (
+            f'-bm25({connection.ops.quote_name(TABLE)}, {TITLE_WEIGHT}, {DESCRIPTION_WEIGHT})',
+            [],
+        )
+
+    def as_postgresql(self, compiler, connection):
+        return (
+            f"ts_rank_cd({connection.ops.quote_name(TABLE)}.document, to_tsquery('english', %s))",
+            [_postgres_query(self.terms)],
+        )
+
+
+def full_text_search(queryset, query):
+    """Filter a Todo queryset to ``query`` matches, ordered by relevance.
+
+    The result is annotated with ``rank`` and ordered by ``-rank, -id``.
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return queryset.none()
+
+    if not _is_supported(queryset.db):
+        # Nothing is indexed here, so the search table must not be required
+        return queryset.filter(SearchMatch(terms)).annotate(rank=SearchRank(terms)).order_by('-rank', '-id')
+
+    return queryset.filter(
+        search_document__isnull=False
+    ).filter(
+        SearchMatch(terms)
+    ).annotate(
+        rank=SearchRank(terms)
+    ).order_by('-rank', '-id')
+
+
+def _is_supported(using='default'):
+    return connections[using].vendor in SUPPORTED_VENDORS
+
+
+def index_todos(todos, using='default'):
+    """(Re)index the given todos."""
+    if not _is_supported(using):
+        return
+    todos = list(todos)
+    with transaction.atomic(using=using):
+        remove_todos([todo.id for todo in todos], using=using)
+        TodoSearchDocument.objects.using(using).bulk_create([
+            TodoSearchDocument(todo_id=todo.id, title=todo.title, description=todo.description or '')
+            for todo in todos
+        ], batch_size=500)
+
+
+def remove_todos(todo_ids, using='default'):
+    """Drop the given todo ids from the index."""
+    if not _is_supported(using) or not todo_ids:
+        return
+    TodoSearchDocument.objects.using(using).filter(pk__in=list(todo_ids)).delete()
+
+
+def rebuild_index(batch_size=1000, using='default'):
+    """Empty the index and repopulate it from every Todo. Returns the row count."""
+    if not _is_supported(using):
+        return 0
+    indexed = 0
+    with transaction.atomic(using=using):
+        TodoSearchDocument.objects.using(using).all().delete()
+        batch = []
+        rows = Todo.objects.using(using).values_list('id', 'title', 'description')
+        for todo_id, title, description in rows.iterator(chunk_size=batch_size):
+            batch.append(TodoSearchDocument(todo_id=todo_id, title=title, description=description or ''))
+            if len(batch) >= batch_size:
+                TodoSearchDocument.objects.using(using).bulk_create(batch)
+                indexed += len(batch)
+                batch = []
+        if batch:
+            TodoSearchDocument.objects.using(using).bulk_create(batch)
+            indexed += len(batch)
+    return indexed
@@ -1,5 +1,6 @@
+from django.urls import reverse
 from rest_framework import serializers
-from .models import Todo, Category, TodoAttachment
+from .models import Todo, Category, TodoAttachment, completed_at_for
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -9,10 +10,31 @@ class CategorySerializer(serializers.ModelSerializer):
         read_only_fields = ['user']
 
 
+def attachment_urls(attachment, request=None):
+    """Access-checked download and thumbnail URLs of an attachment."""
+    def absolute(url):
+        return request.build_absolute_uri(url) if request is not None else url
+
+    thumbnail_url = None
+    if attachment.thumbnail:
+        thumbnail_url = absolute(reverse('attachment_thumbnail', args=[attachment.pk]))
+    return absolute(reverse('attachment_download', args=[attachment.pk])), thumbnail_url
+
+
 class TodoAttachmentSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+    thumbnail_url = serializers.SerializerMethodField()
+
     class Meta:
         model = TodoAttachment
-        fields = ['id', 'file', 'file_name', 'uploaded_at']
+        # The stored file and thumbnail are only exposed through the access-checked views
+        fields = ['id', 'file_name', 'download_url', 'thumbnail_url', 'uploaded_at']
+
+    def get_download_url(self, attachment):
+        return attachment_urls(attachment, self.context.get('request'))[0]
+
+    def get_thumbnail_url(self, attachment):
+        return attachment_urls(attachment, self.context.get('request'))[1]
 
 
 class TodoSerializer(serializers.ModelSerializer):
@@ -29,8 +51,15 @@ class TodoSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['user']
 
+    def validate(self, attrs):
+        # Updates go through Todo.apply_changes, which does the same
+        if self.instance is None:
+            attrs['completed_at'] = completed_at_for(attrs.get('status', 'pending'), attrs.get('completed_at'))
+        return attrs
+
     def create(self, validated_data):
         category_id = validated_data.pop('category_id', None)
+        validated_data.pop('user', None)
         category = None
         if category_id:
             try:
@@ -44,14 +73,63 @@ class TodoSerializer(serializers.ModelSerializer):
     def update(self, instance, validated_data):
         category_id = validated_data.pop('category_id', None)
         if category_id is not None:
-            try:
-                category = Category.objects.get(id=category_id, user=self.context['request'].user)
-                instance.category = category
-            except Category.DoesNotExist:
-                instance.category = None
-        
-        for attr, value in validated_data.items():
-            setattr(instance, attr, value)
+            if not Category.objects.filter(id=category_id, user=self.context['request'].user).exists():
+                category_id = None
+            validated_data['category_id'] = category_id
         
-        instance.save()
-        return instance
\ No newline at end of file
+        instance.apply_changes(validated_data)
+        return instance
+
+
+class TodoListSerializer(serializers.BaseSerializer):
+    """Read-only TodoSerializer equivalent that builds plain dicts directly.
+
+    Produces the same shape as TodoSerializer without per-field serializer
+    machinery. Querysets passed in should use ``select_related('category')``
+    and ``prefetch_related('attachments')`` (see ``with_related``) so a page
+    costs a fixed number of queries.
+    """
+    _datetime = serializers.DateTimeField()
+
+    @staticmethod
+    def with_related(queryset):
+        return queryset.select_related('category').prefetch_related('attachments')
+
+    def _format_datetime(self, value):
+        return self._datetime.to_representation(value) if value else None
+
+    def _attachment(self, attachment, request):
+        download_url, thumbnail_url = attachment_urls(attachment, request)
+        return {
+            'id': attachment.id,
+            'file_name': attachment.file_name,
+            'download_url': download_url,
+            'thumbnail_url': thumbnail_url,
+            'uploaded_at': self._format_datetime(attachment.uploaded_at),
+        }
+
+    def to_representation(self, todo):
+        category = todo.category
+        request = self.context.get('request')
+        return {
+            'id': todo.id,
+            'title': todo.title,
+            'description': todo.description,
+            'created_at': self._format_datetime(todo.created_at),
+            'updated_at': self._format_datetime(todo.updated_at),
+            'due_date': self._format_datetime(todo.due_date),
+            'priority': todo.priority,
+            'status': todo.status,
+            'completed_at': self._format_datetime(todo.completed_at),
+            'category': {
+                'id': category.id,
+                'name': category.name,
+                'color': category.color,
+                'created_at': self._format_datetime(category.created_at),
+            } if category is not None else None,
+            'attachments': [
+                self._attachment(attachment, request)
+                for attachment in todo.attachments.all()
+            ],
+            'is_shared': todo.is_shared,
+        }
@@ -0,0 +1,377 @@
+from collections import defaultdict
+from django.contrib.auth.models import User
+from django.db.models import QuerySet
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from .models import Category, Todo, TodoAttachment, TodoShare, TodoVisibility
+from . import cache, realtime, reminders, rollups, search, stats, storage, sync, thumbnails
+
+# Saves that only touch these fields leave the search index untouched
+SEARCH_FIELDS = {'title', 'description'}
+
+
+@receiver(post_save, sender=Todo)
+def add_owner_visibility(sender, instance, created, **kwargs):
+    if created:
+        TodoVisibility.objects.bulk_create(
+            [TodoVisibility(user_id=instance.user_id, todo=instance)],
+            ignore_conflicts=True
+        )
+
+
+@receiver(post_save, sender=Todo)
+def index_todo_search(sender, instance, created, update_fields=None, using='default', **kwargs):
+    if update_fields is not None and not SEARCH_FIELDS.intersection(update_fields):
+        return
+    search.index_todos([instance], using=using)
+
+
+@receiver(post_delete, sender=Todo)
+def remove_todo_search(sender, instance, using='default', **kwargs):
+    search.remove_todos([instance.pk], using=using)
+
+
+@receiver(post_save, sender=TodoShare)
+def add_share_visibility(sender, instance, created, **kwargs):
+    if created:
+        TodoVisibility.objects.bulk_create(
+            [TodoVisibility(user_id=instance.shared_with_id, todo_id=instance.todo_id)],
+            ignore_conflicts=True
+        )
+
+
+@receiver(post_delete, sender=TodoShare)
+def remove_share_visibility(sender, instance, **kwargs):
+    # The owner keeps their own row even if they somehow shared with themselves
+    TodoVisibility.objects.filter(
+        user_id=instance.shared_with_id, todo_id=instance.todo_id
+    ).exclude(todo__user_id=instance.shared_with_id).delete()
+
+
+def _deleted_directly(origin, model):
+    """Whether a delete started from ``model`` itself rather than a cascade.
+
+    Cascades from Todo or User deletes are covered by the Todo handlers (or
+    by the user's own rows disappearing).
+    """
+    if isinstance(origin, QuerySet):
+        return origin.model is model
+    return isinstance(origin, model)
+
+
+@receiver(post_save, sender=Todo)
+def update_todo_stats(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not set(Todo.TRACKED_FIELDS).intersection(
+        Todo._meta.get_field(name).attname for name in update_fields
+    ):
+        return
+    stats.todo_saved(instance, instance.saved_state(), created=created)
+
+
+@receiver(pre_delete, sender=Todo)
+def remove_todo_stats(sender, instance, **kwargs):
+    stats.todo_deleted(instance)
+
+
+@receiver(post_save, sender=Todo)
+def update_todo_rollups(sender, instance, created, update_fields=None, using='default', **kwargs):
+    if update_fields is not None and not set(Todo.ROLLUP_FIELDS).intersection(
+        Todo._meta.get_field(name).attname for name in update_fields
+    ):
+        return
+    rollups.todo_saved(instance, instance.saved_state(Todo.ROLLUP_FIELDS), created=created, using=using)
+
+
+@receiver(pre_delete, sender=Todo)
+def remove_todo_rollups(sender, instance, using='default', **kwargs):
+    rollups.todo_deleted(instance, using=using)
+
+
+@receiver(post_save, sender=User)
+def build_new_user_rollups(sender, instance, created, using='default', **kwargs):
+    if created:
+        rollups.user_created(instance.pk, using=using)
+
+
+@receiver(post_save, sender=TodoShare)
+def add_share_stats(sender, instance, created, **kwargs):
+    if created:
+        stats.share_added(instance)
+
+
+@receiver(post_delete, sender=TodoShare)
+def remove_share_stats(sender, instance, origin=None, **kwargs):
+    if _deleted_directly(origin, TodoShare):
+        stats.share_removed(instance)
+
+
+@receiver(post_save, sender=Todo)
+def publish_todo_saved(sender, instance, created, using='default', **kwargs):
+    realtime.todo_changed(instance.pk, 'create' if created else 'update', using=using)
+
+
+@receiver(pre_delete, sender=Todo)
+def publish_todo_deleted(sender, instance, using='default', **kwargs):
+    recipients = TodoVisibility.objects.using(using).filter(
+        todo_id=instance.pk
+    ).values_list('user_id', flat=True)
+    realtime.todo_deleted(instance.pk, list(recipients), using=using)
+
+
+@receiver(post_save, sender=TodoShare)
+def publish_share_granted(sender, instance, created, using='default', **kwargs):
+    if created:
+        realtime.todo_access_changed(instance.shared_with_id, instance.todo_id, True, using=using)
+
+
+@receiver(post_delete, sender=TodoShare)
+def publish_share_revoked(sender, instance, origin=None, using='default', **kwargs):
+    if _deleted_directly(origin, TodoShare):
+        realtime.todo_access_changed(instance.shared_with_id, instance.todo_id, False, using=using)
+
+
+@receiver(post_save, sender=TodoAttachment)
+def publish_attachment_saved(sender, instance, using='default', **kwargs):
+    realtime.todo_changed(instance.todo_id, 'update', using=using)
+
+
+@receiver(post_delete, sender=TodoAttachment)
+def publish_attachment_deleted(sender, instance, origin=None, using='default', **kwargs):
+    if _deleted_directly(origin, TodoAttachment):
+        realtime.todo_changed(instance.todo_id, 'update', using=using)
+
+
+@receiver(post_save, sender=TodoAttachment)
+def queue_attachment_thumbnail(sender, instance, created, **kwargs):
+    if created:
+        thumbnails.enqueue(instance)
+
+
+@receiver(post_delete, sender=TodoAttachment)
+def release_attachment_blob(sender, instance, using='default', **kwargs):
+    # Cascades included: every deleted attachment gives up its reference
+    storage.release(instance.file.name, using=using)
+
+
+@receiver(post_save, sender=Todo)
+def reschedule_todo_reminder(sender, instance, created, using='default', **kwargs):
+    old_state = None if created else instance.saved_state()
+    if created:
+        changed = instance.due_date is not None
+    elif old_state is None:
+        changed = True
+    else:
+        changed = (
+            old_state['due_date'] != instance.due_date
+            or (old_state['status'] == 'completed') != (instance.status == 'completed')
+        )
+    if changed:
+        reminders.reschedule([instance], using=using)
+
+
+@receiver(post_save, sender=TodoAttachment)
+@receiver(post_delete, sender=TodoAttachment)
+def touch_attachment_todo(sender, instance, origin=None, using='default', **kwargs):
+    # Attachments are part of a todo's API representation, so bump its
+    # updated_at to change the ETag; cascades from a Todo delete need nothing
+    if origin is not None and not _deleted_directly(origin, TodoAttachment):
+        return
+    Todo.objects.using(using).filter(pk=instance.todo_id).update(updated_at=timezone.now())
+
+
+@receiver(pre_delete, sender=Category)
+def touch_category_todos(sender, instance, using='default', **kwargs):
+    # The todos lose their category through SET_NULL, which sends no signals
+    Todo.objects.using(using).filter(category_id=instance.pk).update(updated_at=timezone.now())
+
+
+def _todo_audience(todo_ids, using='default'):
+    """Users who can currently see any of ``todo_ids``."""
+    return set(TodoVisibility.objects.using(using).filter(
+        todo_id__in=todo_ids
+    ).values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=Todo)
+def invalidate_todo_cache(sender, instance, using='default', **kwargs):
+    users = _todo_audience([instance.pk], using) | {instance.user_id}
+    old_state = instance.saved_state()
+    if old_state is not None:
+        users.add(old_state['user_id'])
+    cache.invalidate(users, using=using)
+
+
+@receiver(pre_delete, sender=Todo)
+def invalidate_deleted_todo_cache(sender, instance, using='default', **kwargs):
+    cache.invalidate(_todo_audience([instance.pk], using) | {instance.user_id}, using=using)
+
+
+@receiver(post_save, sender=TodoShare)
+@receiver(post_delete, sender=TodoShare)
+def invalidate_share_cache(sender, instance, using='default', **kwargs):
+    users = _todo_audience([instance.todo_id], using) | {instance.shared_with_id}
+    cache.invalidate(users, using=using)
+
+
+@receiver(post_save, sender=TodoAttachment)
+@receiver(post_delete, sender=TodoAttachment)
+def invalidate_attachment_cache(sender, instance, using='default', **kwargs):
+    cache.invalidate(_todo_audience([instance.todo_id], using), using=using)
+
+
+@receiver(post_save, sender=Category)
+@receiver(pre_delete, sender=Category)
+def invalidate_category_cache(sender, instance, using='default', **kwargs):
+    # Sharees see the category name on the owner's todos
+    todo_ids = Todo.objects.using(using).filter(category_id=instance.pk).values_list('id', flat=True)
+    cache.invalidate(_todo_audience(todo_ids, using) | {instance.user_id}, using=using)
+
+
+@receiver(post_save, sender=User)
+def invalidate_new_user_cache(sender, instance, created, using='default', **kwargs):
+    # A reused primary key must not inherit a deleted user's cached responses
+    if created:
+        cache.invalidate([instance.pk], using=using)
+
+
+@receiver(post_save, sender=Todo)
+def record_todo_sync(sender, instance, using='default', **kwargs):
+    sync.todos_changed([instance.pk], using=using)
+
+
+@receiver(pre_delete, sender=Todo)
+def record_deleted_todo_sync(sender, instance, using='default', **kwargs):
+    sync.todo_removed(instance.pk, _todo_audience([instance.pk], using), using=using)
+
+
+@receiver(post_save, sender=TodoShare)
+def record_share_sync(sender, instance, created, using='default', **kwargs):
+    if created:
+        sync.record([(instance.shared_with_id, 'todo', instance.todo_id, False)], using=using)
+
+
+@receiver(post_delete, sender=TodoShare)
+def record_revoked_share_sync(sender, instance, origin=None, using='default', **kwargs):
+    if not _deleted_directly(origin, TodoShare):
+        return
+    if instance.shared_with_id not in _todo_audience([instance.todo_id], using):
+        sync.todo_removed(instance.todo_id, [instance.shared_with_id], using=using)
+
+
+@receiver(post_save, sender=TodoAttachment)
+@receiver(post_delete, sender=TodoAttachment)
+def record_attachment_sync(sender, instance, origin=None, using='default', **kwargs):
+    if origin is not None and not _deleted_directly(origin, TodoAttachment):
+        return
+    sync.todos_changed([instance.todo_id], using=using)
+
+
+@receiver(post_save, sender=Category)
+def record_category_sync(sender, instance, created, using='default', **kwargs):
+    sync.categories_changed([instance], using=using)
+    if not created:
+        # Todo payloads embed the category
+        sync.todos_changed(Todo.objects.using(using).filter(category_id=instance.pk).values('id'), using=using)
+
+
+@receiver(pre_delete, sender=Category)
+def record_deleted_category_sync(sender, instance, using='default', **kwargs):
+    sync.categories_changed([instance], deleted=True, using=using)
+    sync.todos_changed(Todo.objects.using(using).filter(category_id=instance.pk).values('id'), using=using)
+
+
+def categories_bulk_created(categories):
+    """Bulk-path counterpart of the Category post_save handlers."""
+    categories = [category for category in categories if category.pk is not None]
+    cache.invalidate({category.user_id for category in categories})
+    sync.categories_changed(categories)
+
+
+def todos_bulk_created(todos):
+    """Bring the derived tables up to date for todos inserted with bulk_create.
+
+    bulk_create sends no signals, so bulk paths call this explicitly.
+    """
+    todos = [todo for todo in todos if todo.pk is not None]
+    if not todos:
+        return
+    TodoVisibility.objects.bulk_create(
+        [TodoVisibility(user_id=todo.user_id, todo_id=todo.pk) for todo in todos],
+        ignore_conflicts=True
+    )
+    search.index_todos(todos)
+    stats.invalidate({todo.user_id for todo in todos})
+    rollups.todos_created(todos)
+    realtime.todos_changed([todo.pk for todo in todos], 'create')
+    reminders.reschedule([todo for todo in todos if todo.due_date is not None])
+    cache.invalidate({todo.user_id for todo in todos})
+    # Only the owners can see todos that were just inserted
+    sync.record([(todo.user_id, 'todo', todo.pk, False) for todo in todos])
+
+
+def todos_bulk_updated(todo_ids, fields, using='default', before=None):
+    """Bring the derived tables up to date after a set-based Todo update.
+
+    QuerySet.update() sends no signals, so paths that use it call this with
+    the changed todo ids and the names of the fields they set. ``before`` is
+    ``TodoQuerySet.saved_states`` taken ahead of the update, if any. With it
+    the stats and rollups are moved by deltas; without it they are recounted
+    on next read.
+    """
+    todo_ids = list(todo_ids)
+    if not todo_ids:
+        return
+    fields = {Todo._meta.get_field(name).attname for name in fields}
+    todos = Todo.objects.using(using).filter(id__in=todo_ids)
+    audience = _todo_audience(todo_ids, using)
+    after = todos.saved_states() if before is not None else None
+    if SEARCH_FIELDS & fields:
+        search.index_todos(todos.only('id', 'title', 'description'), using=using)
+    if fields.intersection(Todo.TRACKED_FIELDS):
+        if before is not None:
+            stats.todos_updated(before, after, using=using)
+        else:
+            stats.invalidate(audience)
+    if fields.intersection(Todo.ROLLUP_FIELDS):
+        if before is not None:
+            rollups.todos_updated(before, after, using=using)
+        else:
+            rollups.invalidate(set(todos.values_list('user_id', flat=True)), using=using)
+    if fields & {'status', 'due_date'}:
+        reminders.reschedule(todos.only('id', 'status', 'due_date'), using=using)
+    cache.invalidate(audience, using=using)
+    sync.todos_changed(todo_ids, using=using)
+    realtime.todos_changed(todo_ids, 'update', using=using)
+
+
+def todos_bulk_deleted(todo_ids, using='default'):
+    """Bring the derived tables up to date for a set-based Todo delete.
+
+    Call it in the delete's transaction while the rows, and the visibility
+    rows saying who can see them, still exist.
+    """
+    todo_ids = list(todo_ids)
+    if not todo_ids:
+        return
+    before = Todo.objects.using(using).filter(id__in=todo_ids).saved_states()
+    audiences = defaultdict(set)
+    for todo_id, user_id in TodoVisibility.objects.using(using).filter(
+        todo_id__in=todo_ids
+    ).values_list('todo_id', 'user_id'):
+        audiences[todo_id].add(user_id)
+
+    stats.todos_updated(before, {}, audiences, using=using)
+    rollups.todos_updated(before, {}, using=using)
+    storage.release_many(
+        TodoAttachment.objects.using(using).filter(todo_id__in=todo_ids).values_list('file', flat=True),
+        using=using,
+    )
+    search.remove_todos(todo_ids, using=using)
+    users = set().union(*audiences.values()) | {state['user_id'] for state in before.values()}
+    cache.invalidate(users, using=using)
+    sync.record([
+        (user_id, 'todo', todo_id, True) for todo_id, user_ids in audiences.items() for user_id in user_ids
+    ], using=using)
+    for todo_id in before:
+        realtime.todo_deleted(todo_id, list(audiences[todo_id]), using=using)
@@ -0,0 +1,270 @@
+"""Incrementally maintained per-user todo counters.
+
+Every todo a user can see (their own plus those shared with them) counts
+towards their TodoStats row. The signal handlers in ``todo.signals`` call the
+functions below inside the same transaction as the write, so reading the
+stats is a single primary-key lookup. Rows are created lazily from a full
+recount the first time they are read; paths that cannot describe a change
+precisely (bulk writes, unknown previous state) drop the affected rows so they
+are recounted on next read.
+"""
+from collections import defaultdict
+from datetime import datetime
+from functools import reduce
+import operator
+from django.db.models import Case, Count, F, Min, Q, Value, When
+from django.utils import timezone
+from .models import Todo, TodoShare, TodoStats, TodoVisibility
+from . import cache
+
+STATUS_FIELDS = {
+    'pending': 'pending',
+    'in_progress': 'in_progress',
+    'completed': 'completed',
+}
+
+PRIORITY_FIELDS = {
+    'low': 'low_priority',
+    'medium': 'medium_priority',
+    'high': 'high_priority',
+}
+
+
+def as_datetime(value):
+    """Coerce a due date that may still be a form string into an aware datetime."""
+    if value is None or isinstance(value, datetime):
+        if value is not None and timezone.is_naive(value):
+            return timezone.make_aware(value)
+        return value
+    if not value:
+        return None
+    return as_datetime(Todo._meta.get_field('due_date').to_python(value))
+
+
+def current_state(todo):
+    return {name: getattr(todo, name) for name in Todo.TRACKED_FIELDS}
+
+
+def _tracked(state):
+    """The tracked part of a state that may hold other fields too."""
+    return {name: state[name] for name in Todo.TRACKED_FIELDS}
+
+
+def _updates(changes):
+    """Column updates moving todos from ``old`` to ``new`` state (either may be None).
+
+    ``changes`` holds ``(owner_id, old, new)`` for each todo.
+    """
+    deltas = defaultdict(int)
+    overdue_terms = []
+    shared_terms = []
+    next_dues = set()
+
+    for owner_id, old, new in changes:
+        for state, sign in ((old, -1), (new, 1)):
+            if state is None:
+                continue
+            deltas['total'] += sign
+            if state['status'] in STATUS_FIELDS:
+                deltas[STATUS_FIELDS[state['status']]] += sign
+            if state['priority'] in PRIORITY_FIELDS:
+                deltas[PRIORITY_FIELDS[state['priority']]] += sign
+            due = as_datetime(state['due_date'])
+            if due is not None and state['status'] != 'completed':
+                # Only counts as overdue if it already was at the last overdue check
+                overdue_terms.append(
+                    Case(When(overdue_checked_at__gt=due, then=Value(sign)), default=Value(0))
+                )
+                if sign > 0:
+                    next_dues.add(due)
+        if (old is None) != (new is None):
+            sign = 1 if old is None else -1
+            shared_terms.append(Case(When(user_id=owner_id, then=Value(0)), default=Value(sign)))
+
+    updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+    if shared_terms:
+        updates['shared_with_me'] = reduce(operator.add, shared_terms, F('shared_with_me'))
+    if overdue_terms:
+        updates['overdue'] = reduce(operator.add, overdue_terms, F('overdue'))
+    if next_dues:
+        # The earliest new due date that was not yet overdue at the last check
+        updates['next_overdue_at'] = Case(
+            *[
+                When(~Q(overdue_checked_at__gt=due), then=Case(
+                    When(next_overdue_at__lte=due, then=F('next_overdue_at')),
+                    default=Value(due),
+                ))
+                for due in sorted(next_dues)
+            ],
+            default=F('next_overdue_at'),
+        )
+    return updates
+
+
+def _apply(user_ids, owner_id, old, new):
+    updates = _updates([(owner_id, old, new)])
+    if user_ids and updates:
+        TodoStats.objects.filter(user_id__in=user_ids).update(**updates)
+
+
+def _recipients(todo):
+    return [todo.user_id] + list(
+        TodoShare.objects.filter(todo_id=todo.pk).exclude(
+            shared_with_id=todo.user_id
+        ).values_list('shared_with_id', flat=True)
+    )
+
+
+def invalidate(user_ids):
+    """Drop the stats rows of ``user_ids`` so they are recounted on next read."""
+    TodoStats.objects.filter(user_id__in=list(user_ids)).delete()
+
+
+def todo_saved(todo, old_state, created=False):
+    new_state = current_state(todo)
+    if created:
+        _apply([todo.user_id], todo.user_id, None, new_state)
+        return
+    if old_state is None or old_state['user_id'] != new_state['user_id']:
+        users = set(_recipients(todo))
+        if old_state is not None:
+            users.add(old_state['user_id'])
+        invalidate(users)
+        return
+    if old_state == new_state:
+        return
+    _apply(_recipients(todo), todo.user_id, old_state, new_state)
+
+
+def todos_updated(before, after, audiences=None, using='default'):
+    """Apply a set-based update or delete to the stats of everyone who can see the todos.
+
+    ``before`` and ``after`` map todo ids to their states around the write,
+    as returned by ``TodoQuerySet.saved_states``; ids missing from ``after``
+    were deleted. ``audiences`` maps ids to the users who can see them and
+    is read here if not given. Users who see the same todos share one UPDATE.
+    """
+    changed = {
+        todo_id: (state, after.get(todo_id))
+        for todo_id, state in before.items()
+        if todo_id not in after or _tracked(state) != _tracked(after[todo_id])
+    }
+    if not changed:
+        return
+    if audiences is None:
+        audiences = defaultdict(set)
+        for todo_id, user_id in TodoVisibility.objects.using(using).filter(
+            todo_id__in=list(changed)
+        ).values_list('todo_id', 'user_id'):
+            audiences[todo_id].add(user_id)
+
+    moved = {
+        todo_id for todo_id, (old, new) in changed.items()
+        if new is not None and old['user_id'] != new['user_id']
+    }
+    if moved:
+        # Ownership changes move todos between users' totals; recount them
+        users = set()
+        for todo_id in moved:
+            users |= audiences.get(todo_id, set()) | {changed[todo_id][0]['user_id']}
+        invalidate(users)
+
+    todos_by_user = defaultdict(set)
+    for todo_id in set(changed) - moved:
+        for user_id in audiences.get(todo_id, ()):
+            todos_by_user[user_id].add(todo_id)
+    users_by_todos = defaultdict(list)
+    for user_id, todo_ids in todos_by_user.items():
+        users_by_todos[frozenset(todo_ids)].append(user_id)
+    for todo_ids, user_ids in users_by_todos.items():
+        updates = _updates([
+            (changed[todo_id][0]['user_id'], *changed[todo_id]) for todo_id in sorted(todo_ids)
+        ])
+        if updates:
+            TodoStats.objects.using(using).filter(user_id__in=sorted(user_ids)).update(**updates)
+
+
+def todo_deleted(todo):
+    state = todo.saved_state() or current_state(todo)
+    _apply(_recipients(todo), todo.user_id, state, None)
+
+
+def share_added(share):
+    todo = share.todo
+    if share.shared_with_id != todo.user_id:
+        _apply([share.shared_with_id], todo.user_id, None, current_state(todo))
+
+
+def share_removed(share):
+    todo = share.todo
+    if share.shared_with_id != todo.user_id:
+        _apply([share.shared_with_id], todo.user_id, current_state(todo), None)
+
+
+def recompute(user):
+    """Recount ``user``'s stats from scratch with a single aggregate query."""
+    now = timezone.now()
+    open_due = Q(due_date__isnull=False) & ~Q(status='completed')
+    counts = Todo.objects.visible_to(user).aggregate(
+        total=Count('id'),
+        pending=Count('id', filter=Q(status='pending')),
+        in_progress=Count('id', filter=Q(status='in_progress')),
+        completed=Count('id', filter=Q(status='completed')),
+        low_priority=Count('id', filter=Q(priority='low')),
+        medium_priority=Count('id', filter=Q(priority='medium')),
+        high_priority=Count('id', filter=Q(priority='high')),
+        shared_with_me=Count('id', filter=~Q(user=user)),
+        overdue=Count('id', filter=open_due & Q(due_date__lt=now)),
+        next_overdue_at=Min('due_date', filter=open_due & Q(due_date__gte=now)),
+    )
+    stats, _ = TodoStats.objects.update_or_create(
+        user=user, defaults=dict(counts, overdue_checked_at=now)
+    )
+    return stats
+
+
+def refresh_overdue(stats, now=None):
+    now = now or timezone.now()
+    open_due = Todo.objects.visible_to(stats.user_id).filter(due_date__isnull=False).exclude(status='completed')
+    result = open_due.aggregate(
+        overdue=Count('id', filter=Q(due_date__lt=now)),
+        next_overdue_at=Min('due_date', filter=Q(due_date__gte=now)),
+    )
+    stats.overdue = result['overdue']
+    stats.next_overdue_at = result['next_overdue_at']
+    stats.overdue_checked_at = now
+    stats.save(update_fields=['overdue', 'next_overdue_at', 'overdue_checked_at'])
+    return stats
+
+
+def get_stats(user):
+    """Return ``user``'s TodoStats, creating or refreshing it only when needed."""
+    stats = TodoStats.objects.filter(user=user).first()
+    if stats is None:
+        return recompute(user)
+    now = timezone.now()
+    if stats.overdue_checked_at is None or (stats.next_overdue_at and stats.next_overdue_at <= now):
+        refresh_overdue(stats, now)
+    return stats
+
+
+def get_cached_stats(user):
+    """get_stats through the per-user cache, expiring when the next todo falls overdue."""
+    def compute():
+        stats = get_stats(user)
+        return stats, stats.next_overdue_at
+    return cache.get_or_set_until(user.id, 'stats', None, compute)
+
+
+def as_dict(stats):
+    return {
+        'total': stats.total,
+        'completed': stats.completed,
+        'pending': stats.pending,
+        'in_progress': stats.in_progress,
+        'high_priority': stats.high_priority,
+        'medium_priority': stats.medium_priority,
+        'low_priority': stats.low_priority,
+        'overdue': stats.overdue,
+        'shared_with_me': stats.shared_with_me,
+    }
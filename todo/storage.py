@@ -0,0 +1,161 @@
+"""Content-addressed storage for todo attachments.
+
+Uploads are hashed with SHA-256 while they stream to a temporary file, then
+kept once under their digest, however many attachments point at them. Each
+AttachmentBlob row counts the TodoAttachment rows using its file, and the
+file, along with its thumbnail, is removed once the last of them is
+deleted.
+
+Attaching takes the blob row before the file is moved into place, and
+freeing deletes the file in the same transaction that deletes the row. A
+blob that is being freed while the same content is uploaded again is
+therefore either kept or written back, never lost.
+"""
+import hashlib
+import os
+import re
+import tempfile
+from collections import Counter, defaultdict
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+from django.utils.deconstruct import deconstructible
+
+BLOB_PREFIX = 'todo_attachments/blobs'
+
+_BLOB_NAME = re.compile(r'^todo_attachments/blobs/[0-9a-f]{2}/([0-9a-f]{64})$')
+
+
+def blob_name(digest):
+    return f'{BLOB_PREFIX}/{digest[:2]}/{digest}'
+
+
+def blob_digest(name):
+    """The digest stored under ``name``, or None for files outside the blob store."""
+    match = _BLOB_NAME.match(name or '')
+    return match.group(1) if match else None
+
+
+def acquire(digest, size, using='default'):
+    """Add a reference to the blob ``digest``, creating its row if needed."""
+    from .models import AttachmentBlob
+
+    blobs = AttachmentBlob.objects.using(using).filter(digest=digest)
+    if not blobs.update(ref_count=F('ref_count') + 1):
+        AttachmentBlob.objects.using(using).bulk_create(
+            [AttachmentBlob(digest=digest, size=size)], ignore_conflicts=True
+        )
+        blobs.update(ref_count=F('ref_count') + 1)
+
+
+def release(name, using='default'):
+    """Drop a reference to the blob stored under ``name``.
+
+    The blob is freed once the current transaction commits if nothing else
+    refers to it by then. Names outside the blob store are ignored.
+    """
+    from .models import AttachmentBlob
+
+    digest = blob_digest(name)
+    if digest is None:
+        return
+    AttachmentBlob.objects.using(using).filter(digest=digest).update(ref_count=F('ref_count') - 1)
+    transaction.on_commit(lambda: free(digest, using), using=using)
+
+
+def release_many(names, using='default'):
+    """``release`` each of ``names``, one UPDATE per distinct reference count."""
+    from .models import AttachmentBlob
+
+    counts = Counter(digest for digest in map(blob_digest, names) if digest is not None)
+    by_count = defaultdict(list)
+    for digest, count in counts.items():
+        by_count[count].append(digest)
+    for count, digests in by_count.items():
+        AttachmentBlob.objects.using(using).filter(digest__in=digests).update(ref_count=F('ref_count') - count)
+    for digest in counts:
+        transaction.on_commit(lambda digest=digest: free(digest, using), using=using)
+
+
+def free(digest, using='default'):
+    """Delete the blob ``digest`` and its file if it has no references left."""
+    from .models import AttachmentBlob
+
+    with transaction.atomic(using=using):
+        deleted, _ = AttachmentBlob.objects.using(using).filter(digest=digest, ref_count__lte=0).delete()
+        if deleted:
+            # The blob and files derived from it, such as its thumbnail
+            directory = os.path.dirname(blob_name(digest))
+            for file_name in attachment_storage.listdir(directory)[1]:
+                if file_name.startswith(digest):
+                    attachment_storage.delete(f'{directory}/{file_name}')
+    return bool(deleted)
+
+
+@deconstructible
+class DeduplicatingStorage(FileSystemStorage):
+    """FileSystemStorage that stores each distinct file once, by digest.
+
+    The name passed to ``save`` is ignored; the original file name is kept
+    on the attachment row instead.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def get_available_name(self, name, max_length=None):
+        # Equal names mean equal content, so an existing file is reused
+        return name
+
+    def _save(self, name, content):
+        temp_dir = self.path(f'{BLOB_PREFIX}/tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        try:
+            hasher = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks():
+                    hasher.update(chunk)
+                    temp.write(chunk)
+                    size += len(chunk)
+            return self._store(temp_path, hasher.hexdigest(), size)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def store_file(self, path):
+        """Move the local file at ``path`` into the store and return its name.
+
+        ``path`` must be on the same filesystem as the store, so the file is
+        renamed rather than copied.
+        """
+        hasher = hashlib.sha256()
+        size = 0
+        with open(path, 'rb') as source:
+            for chunk in iter(lambda: source.read(self.CHUNK_SIZE), b''):
+                hasher.update(chunk)
+                size += len(chunk)
+        return self._store(path, hasher.hexdigest(), size)
+
+    def _store(self, temp_path, digest, size):
+        # Reference the blob first, then make sure its file exists
+        acquire(digest, size)
+        return self.place(temp_path, digest)
+
+    def place(self, temp_path, digest):
+        """Move the local file at ``temp_path`` into place as blob ``digest``.
+
+        The caller must hold a reference to the blob, see ``acquire``.
+        """
+        name = blob_name(digest)
+        path = self.path(name)
+        if os.path.exists(path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, path)
+        return name
+
+
+attachment_storage = DeduplicatingStorage()
@@ -0,0 +1,134 @@
+"""Per-user change ledger behind ``/api/todos/changes/``.
+
+Every write that changes what a user can see moves the matching SyncChange
+row (one per user and object) to that user's next sequence number. Deletes
+and revoked shares leave the row as a tombstone. A client keeps the highest
+sequence it has seen as its cursor, and each poll reads only the rows after
+it from the ``(user, seq)`` index.
+
+Sequence numbers come from an UPDATE of the user's SyncSequence row. The row
+stays locked until the writing transaction commits, so a user's changes
+commit in sequence order and a cursor never skips a change that commits
+late.
+"""
+from django.db.models import F
+from django.utils import timezone
+from .models import Category, SyncChange, SyncSequence, Todo, TodoVisibility
+from .serializers import CategorySerializer, TodoListSerializer
+
+# Most changes returned by one poll
+CHANGES_PAGE_SIZE = 500
+MAX_CHANGES_PAGE_SIZE = 1000
+
+
+def _allocate(counts, using='default'):
+    """Reserve ``counts[user_id]`` sequence numbers per user; returns the first of each."""
+    first = {}
+    # Sorted, one row at a time, so concurrent writers lock users in the same order
+    for user_id in sorted(counts):
+        count = counts[user_id]
+        sequence = SyncSequence.objects.using(using).filter(user_id=user_id)
+        if not sequence.update(last_seq=F('last_seq') + count):
+            SyncSequence.objects.using(using).bulk_create([SyncSequence(user_id=user_id)], ignore_conflicts=True)
+            sequence.update(last_seq=F('last_seq') + count)
+        first[user_id] = sequence.values_list('last_seq', flat=True).get() - count + 1
+    return first
+
+
+def record(changes, using='default'):
+    """Record ``(user_id, kind, object_id, deleted)`` changes in the ledger."""
+    changes = list(dict.fromkeys(changes))
+    if not changes:
+        return
+    counts = {}
+    for user_id, _, _, _ in changes:
+        counts[user_id] = counts.get(user_id, 0) + 1
+    next_seq = _allocate(counts, using)
+
+    now = timezone.now()
+    rows = []
+    for user_id, kind, object_id, deleted in changes:
+        rows.append(SyncChange(
+            user_id=user_id, kind=kind, object_id=object_id,
+            seq=next_seq[user_id], deleted=deleted, changed_at=now,
+        ))
+        next_seq[user_id] += 1
+    SyncChange.objects.using(using).bulk_create(
+        rows,
+        batch_size=1000,
+        update_conflicts=True,
+        unique_fields=['user', 'kind', 'object_id'],
+        update_fields=['seq', 'deleted', 'changed_at'],
+    )
+
+
+def todos_changed(todo_ids, using='default'):
+    """Record the given todos as changed for everyone who can see them."""
+    rows = TodoVisibility.objects.using(using).filter(todo_id__in=todo_ids).values_list('user_id', 'todo_id')
+    record([(user_id, 'todo', todo_id, False) for user_id, todo_id in rows], using)
+
+
+def todo_removed(todo_id, user_ids, using='default'):
+    """Leave tombstones for ``user_ids``, who can no longer see the todo."""
+    record([(user_id, 'todo', todo_id, True) for user_id in user_ids], using)
+
+
+def categories_changed(categories, deleted=False, using='default'):
+    record([(category.user_id, 'category', category.pk, deleted) for category in categories], using)
+
+
+def _parse_cursor(value):
+    if value in (None, ''):
+        return 0
+    cursor = int(value)
+    if cursor < 0:
+        raise ValueError(value)
+    return cursor
+
+
+def changes_since(user, cursor, limit=CHANGES_PAGE_SIZE, request=None):
+    """Everything that changed for ``user`` after ``cursor``, as an API payload.
+
+    Raises ValueError for a malformed cursor.
+    """
+    since = _parse_cursor(cursor)
+    limit = max(1, min(limit, MAX_CHANGES_PAGE_SIZE))
+    rows = list(
+        SyncChange.objects.filter(user=user, seq__gt=since).order_by('seq').values_list(
+            'seq', 'kind', 'object_id', 'deleted'
+        )[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    upserts = {'todo': [], 'category': []}
+    deleted = {'todo': [], 'category': []}
+    for _, kind, object_id, is_deleted in rows:
+        (deleted if is_deleted else upserts)[kind].append(object_id)
+
+    todos = TodoListSerializer.with_related(
+        Todo.objects.visible_to(user).filter(id__in=upserts['todo'])
+    ).order_by('id')
+    todo_data = TodoListSerializer(todos, many=True, context={'request': request}).data
+    categories = Category.objects.filter(user=user, id__in=upserts['category']).order_by('id')
+    category_data = CategorySerializer(categories, many=True).data
+
+    # Anything gone since its row was written is reported as deleted; its
+    # tombstone will follow with a later sequence number
+    found_todos = {todo['id'] for todo in todo_data}
+    found_categories = {category['id'] for category in category_data}
+    deleted['todo'] += [todo_id for todo_id in upserts['todo'] if todo_id not in found_todos]
+    deleted['category'] += [
+        category_id for category_id in upserts['category'] if category_id not in found_categories
+    ]
+
+    return {
+        'todos': todo_data,
+        'categories': category_data,
+        'deleted': {
+            'todos': sorted(deleted['todo']),
+            'categories': sorted(deleted['category']),
+        },
+        'cursor': str(rows[-1][0] if rows else since),
+        'has_more': has_more,
+    }
@@ -1,8 +1,37 @@
-from django.test import TestCase, Client
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from django.urls import reverse
 from django.utils import timezone
-from .models import Todo, Category, TodoAttachment, TodoShare
+from PIL import Image
+from . import bulk, cache, jobs, permissions, reminders, rollups
+from .jobs import claim_next_job, run_pending_jobs
+from .models import (
+    AttachmentBlob, BackgroundJob, Todo, Category, Notification, TodoAttachment, TodoDailyRollup, TodoRollupState,
+    SyncChange, TodoShare, TodoStats, UploadSession,
+)
+from .notifications import mark_read, notify, unread_count
+from .reminders import REMINDER_GROUP, ReminderScheduler, send_due_reminders, send_reminder
+from .search import SearchMatch, SearchRank
+from .serializers import TodoListSerializer, TodoSerializer
+from .stats import as_dict, get_stats, recompute
+from .storage import attachment_storage, blob_digest, blob_name
+from .thumbnails import THUMBNAIL_FORMAT, THUMBNAIL_SIZE
+from .uploads import cleanup_expired, temp_path
+from .utils import import_todos_from_csv, import_todos_from_json
 
 
 class TodoModelTest(TestCase):
@@ -211,6 +240,100 @@ class ExportImportTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'text/csv')
 
+    def test_export_streams_every_format(self):
+        """Test that JSON, NDJSON and CSV exports stream every todo with its category"""
+        category = Category.objects.create(name='Work', user=self.user)
+        for i in range(3):
+            Todo.objects.create(title=f'Export Todo {i}', user=self.user, category=category)
+
+        response = self.client.get(reverse('export_todos') + '?format=json')
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual([item['category'] for item in data], ['Work'] * 3)
+        self.assertEqual(b''.join(self.client.get(reverse('export_todos')).streaming_content).decode(),
+                         json.dumps(data, indent=2))
+
+        response = self.client.get(reverse('export_todos') + '?format=ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['title'] for line in lines], [item['title'] for item in data])
+
+        response = self.client.get(reverse('export_todos') + '?format=csv')
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 4)
+        self.assertTrue(rows[1].startswith('Export Todo 0,'))
+
+    def test_import_json_report(self):
+        """Test that a JSON import inserts, skips duplicate titles and rejects bad rows"""
+        Todo.objects.create(title='Existing', user=self.user)
+        payload = json.dumps([
+            {'title': 'Existing'},
+            {'title': 'New 1', 'category': 'Home', 'due_date': '2030-01-01T09:00:00+00:00'},
+            {'title': 'New 2', 'category': 'Home', 'priority': 'high'},
+            {'title': 'New 1'},
+            {'title': ''},
+            {'title': 'Bad priority', 'priority': 'urgent'},
+            {'title': 'Bad date', 'due_date': 'tomorrow'},
+            {'title': 'Done', 'status': 'completed'},
+        ])
+        report = import_todos_from_json(self.user, payload)
+        self.assertEqual(report.inserted, 3)
+        self.assertIsNotNone(Todo.objects.get(title='Done').completed_at)
+        self.assertEqual([item['row'] for item in report.skipped], [1, 4])
+        self.assertEqual([item['row'] for item in report.rejected], [5, 6, 7])
+        self.assertEqual(Category.objects.filter(user=self.user, name='Home').count(), 1)
+        self.assertEqual(Todo.objects.visible_to(self.user).count(), 4)
+        self.assertEqual(get_stats(self.user).high_priority, 1)
+
+    def test_import_rejects_mistyped_fields(self):
+        """Test that non-string fields reject their row and is_shared strings are parsed"""
+        payload = json.dumps([
+            {'title': 5},
+            {'title': 'Listed category', 'category': ['x']},
+            {'title': 'Dict priority', 'priority': {'level': 'high'}},
+            {'title': 'Numeric date', 'due_date': 20300101},
+            {'title': 'Odd flag', 'is_shared': 'maybe'},
+            {'title': 'Not shared', 'is_shared': 'false'},
+            {'title': 'Shared', 'is_shared': 'True'},
+        ])
+        report = import_todos_from_json(self.user, payload)
+        self.assertEqual(report.inserted, 2)
+        self.assertEqual([item['row'] for item in report.rejected], [1, 2, 3, 4, 5])
+        self.assertFalse(Todo.objects.get(user=self.user, title='Not shared').is_shared)
+        self.assertTrue(Todo.objects.get(user=self.user, title='Shared').is_shared)
+
+    def test_import_query_count_is_batched(self):
+        """Test that import round trips do not grow with the number of rows"""
+        rows = [{'title': f'Row {i}', 'category': f'Cat {i % 3}'} for i in range(300)]
+        with CaptureQueriesContext(connection) as queries:
+            report = import_todos_from_json(self.user, json.dumps(rows))
+        self.assertEqual(report.inserted, 300)
+        self.assertLess(len(queries.captured_queries), 30)
+
+    def test_csv_export_round_trip(self):
+        """Test that a CSV export imports back into another account"""
+        category = Category.objects.create(name='Work', user=self.user)
+        Todo.objects.create(title='Round trip', user=self.user, category=category,
+                            due_date=timezone.now())
+        exported = b''.join(self.client.get(reverse('export_todos') + '?format=csv').streaming_content)
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        report = import_todos_from_csv(other, SimpleUploadedFile('todos.csv', exported))
+        self.assertEqual(report.inserted, 1)
+        self.assertEqual(Todo.objects.get(user=other).category.name, 'Work')
+
+    def test_import_view_redirects(self):
+        """Test that the import view reports back and redirects"""
+        upload = SimpleUploadedFile('todos.json', json.dumps([{'title': 'Imported'}]).encode())
+        response = self.client.post(reverse('import_todos'), {'file': upload})
+        self.assertRedirects(response, reverse('todo_list'), fetch_redirect_response=False)
+        self.assertTrue(Todo.objects.filter(user=self.user, title='Imported').exists())
+
+    def test_export_empty_json(self):
+        """Test that an empty JSON export is still a valid array"""
+        response = self.client.get(reverse('export_todos') + '?format=json')
+        self.assertEqual(b''.join(response.streaming_content), b'[]')
+
 
 class TodoModelTest(TestCase):
     def setUp(self):
@@ -271,4 +394,1511 @@ class TodoViewTest(TestCase):
         self.client.login(username='testuser', password='testpass123')
         response = self.client.get(reverse('todo_create'))
         self.assertEqual(response.status_code, 200)
-        self.assertContains(response, 'Create Todo')
\ No newline at end of file
+        self.assertContains(response, 'Create Todo')
+
+class TodoVisibilityTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.todo = Todo.objects.create(title='Shared Todo', user=self.owner)
+
+    def test_owner_sees_own_todo(self):
+        """Test that a new todo is visible to its owner only"""
+        self.assertEqual(list(Todo.objects.visible_to(self.owner)), [self.todo])
+        self.assertFalse(Todo.objects.visible_to(self.friend).exists())
+
+    def test_share_grants_and_revokes_visibility(self):
+        """Test that sharing adds the todo once and unsharing removes it"""
+        share = TodoShare.objects.create(todo=self.todo, shared_by=self.owner, shared_with=self.friend)
+        TodoShare.objects.create(todo=self.todo, shared_by=self.owner, shared_with=self.other)
+        self.assertEqual(list(Todo.objects.visible_to(self.friend)), [self.todo])
+        self.assertEqual(Todo.objects.visible_to(self.owner).count(), 1)
+
+        share.delete()
+        self.assertFalse(Todo.objects.visible_to(self.friend).exists())
+        self.assertTrue(Todo.objects.visible_to(self.other).exists())
+
+    def test_visible_to_query_has_no_distinct(self):
+        """Test that the visibility lookup does not need DISTINCT"""
+        query = str(Todo.objects.visible_to(self.owner).query)
+        self.assertNotIn('DISTINCT', query)
+
+
+class TodoSearchTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.other = User.objects.create_user(username='other', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+
+    def test_search_ranks_and_stems(self):
+        """Test that title hits outrank description hits and stems match"""
+        in_description = Todo.objects.create(title='Errands', description='go running after work', user=self.user)
+        in_title = Todo.objects.create(title='Running shoes', description='', user=self.user)
+        Todo.objects.create(title='Unrelated', user=self.user)
+        Todo.objects.create(title='Running club', user=self.other)
+
+        response = self.client.get(reverse('api-todo-search') + '?q=runs')
+        ids = [item['id'] for item in response.json()['results']]
+        self.assertEqual(ids, [in_title.id, in_description.id])
+
+    def test_search_prefix_and_index_maintenance(self):
+        """Test prefix matching and that the index follows saves and deletes"""
+        todo = Todo.objects.create(title='Quarterly report', user=self.user)
+        response = self.client.get(reverse('todo_search') + '?q=quar')
+        self.assertEqual([r['id'] for r in response.json()['results']], [todo.id])
+
+        todo.title = 'Annual summary'
+        todo.save()
+        response = self.client.get(reverse('todo_search') + '?q=quar')
+        self.assertEqual(response.json()['results'], [])
+
+        todo.delete()
+        response = self.client.get(reverse('todo_search') + '?q=annual')
+        self.assertEqual(response.json()['results'], [])
+
+    def test_unsupported_backend_falls_back_to_icontains(self):
+        """Test that the search expressions compile to a substring scan on other databases"""
+        todo = Todo.objects.create(title='Buy milk', description='and bread', user=self.user)
+        Todo.objects.create(title='Buy eggs', user=self.user)
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            matches = Todo.objects.filter(SearchMatch(['milk', 'BREAD'])).annotate(rank=SearchRank(['milk']))
+            self.assertEqual([(t.id, t.rank) for t in matches], [(todo.id, 0.0)])
+            response = self.client.get(reverse('api-todo-search') + '?q=bread')
+        self.assertEqual([item['id'] for item in response.json()['results']], [todo.id])
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        # Identical created_at values exercise the id tie-breaker
+        created = timezone.now()
+        self.todos = [Todo.objects.create(title=f'Todo {i}', user=self.user) for i in range(7)]
+        Todo.objects.filter(id__in=[t.id for t in self.todos[2:5]]).update(created_at=created)
+
+    def test_cursor_pages_walk_forwards_and_backwards(self):
+        """Test that cursor pages cover every todo once, in order, without a count"""
+        expected = list(
+            Todo.objects.filter(user=self.user).order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        url = reverse('api-todo-list-create') + '?pagination=cursor&page_size=3'
+        seen, pages = [], []
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            seen += [item['id'] for item in data['results']]
+            pages.append(data)
+            url = data['next']
+        self.assertEqual(seen, expected)
+
+        previous = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual([item['id'] for item in previous['results']], expected[3:6])
+
+    def test_page_number_pagination_is_still_the_default(self):
+        """Test that clients that do not opt in keep numbered pages"""
+        data = self.client.get(reverse('api-todo-list-create')).json()
+        self.assertEqual(data['count'], 7)
+
+    def test_invalid_cursor(self):
+        """Test that a garbled cursor is rejected"""
+        response = self.client.get(reverse('api-todo-list-create') + '?cursor=garbage')
+        self.assertEqual(response.status_code, 404)
+
+    def test_search_cursor_follows_rank(self):
+        """Test that search results can be walked with cursors in rank order"""
+        for i in range(3):
+            Todo.objects.create(title=f'Report {i}', description='report ' * i, user=self.user)
+        url = reverse('api-todo-search') + '?q=report&pagination=cursor&page_size=2'
+        first = self.client.get(url).json()
+        second = self.client.get(first['next']).json()
+        ids = [item['id'] for item in first['results'] + second['results']]
+        self.assertEqual(len(set(ids)), 3)
+        self.assertIsNone(second['next'])
+
+
+class TodoStatsTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+
+    def assertStatsMatchRecount(self, user):
+        incremental = as_dict(get_stats(user))
+        self.assertEqual(incremental, as_dict(recompute(user)))
+        return incremental
+
+    def test_counters_follow_writes(self):
+        """Test that incremental counters agree with a full recount after writes"""
+        get_stats(self.owner)
+        get_stats(self.friend)
+
+        past = timezone.now() - timezone.timedelta(days=1)
+        first = Todo.objects.create(title='First', priority='high', due_date=past, user=self.owner)
+        second = Todo.objects.create(title='Second', user=self.owner)
+        share = TodoShare.objects.create(todo=first, shared_by=self.owner, shared_with=self.friend)
+
+        first.status = 'completed'
+        first.save()
+        second.priority = 'low'
+        second.due_date = past
+        second.save()
+
+        owner_stats = self.assertStatsMatchRecount(self.owner)
+        self.assertEqual(owner_stats['total'], 2)
+        self.assertEqual(owner_stats['overdue'], 1)
+        friend_stats = self.assertStatsMatchRecount(self.friend)
+        self.assertEqual(friend_stats['shared_with_me'], 1)
+        self.assertEqual(friend_stats['completed'], 1)
+
+        share.delete()
+        second.delete()
+        self.assertEqual(self.assertStatsMatchRecount(self.friend)['total'], 0)
+        self.assertEqual(self.assertStatsMatchRecount(self.owner)['total'], 1)
+
+    def test_overdue_refreshes_when_due_date_passes(self):
+        """Test that a todo becomes overdue once its due date has passed"""
+        todo = Todo.objects.create(title='Soon', due_date=timezone.now() + timezone.timedelta(hours=1), user=self.owner)
+        self.assertEqual(get_stats(self.owner).overdue, 0)
+        Todo.objects.filter(id=todo.id).update(due_date=timezone.now() - timezone.timedelta(hours=1))
+        TodoStats.objects.filter(user=self.owner).update(next_overdue_at=timezone.now() - timezone.timedelta(minutes=1))
+        self.assertEqual(get_stats(self.owner).overdue, 1)
+
+    def test_stats_read_is_a_single_query(self):
+        """Test that reading warm stats costs one query"""
+        Todo.objects.create(title='Todo', user=self.owner)
+        get_stats(self.owner)
+        with self.assertNumQueries(1):
+            get_stats(self.owner)
+
+        self.client.login(username='owner', password='testpass123')
+        response = self.client.get(reverse('api-todo-stats'))
+        self.assertEqual(response.json()['total'], 1)
+
+
+class TodoListSerializerTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.category = Category.objects.create(name='Work', user=self.user)
+
+    def add_todos(self, count):
+        for i in range(count):
+            todo = Todo.objects.create(title=f'Todo {i}', user=self.user, category=self.category,
+                                       due_date=timezone.now())
+            TodoAttachment.objects.create(todo=todo, file='todo_attachments/man.png', file_name='man.png')
+
+    def test_matches_model_serializer_output(self):
+        """Test that the fast serializer produces the same data as TodoSerializer"""
+        self.add_todos(2)
+        todos = TodoListSerializer.with_related(Todo.objects.order_by('id'))
+        self.assertEqual(
+            TodoListSerializer(todos, many=True).data,
+            TodoSerializer(todos, many=True).data
+        )
+
+    def test_list_query_count_is_constant(self):
+        """Test that a list page costs the same number of queries for 1 or 20 todos"""
+        url = reverse('api-todo-list-create') + '?page_size=50'
+        self.add_todos(1)
+        self.client.get(url)
+        cache.bump([self.user.id])
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+        self.add_todos(19)
+        with CaptureQueriesContext(connection) as large:
+            response = self.client.get(url)
+        self.assertEqual(len(response.json()['results']), 20)
+        self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+class TodoListPaginationTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        category = Category.objects.create(name='Work', user=self.user)
+        for i in range(30):
+            todo = Todo.objects.create(title=f'Todo {i:02d}', user=self.user, category=category)
+            TodoAttachment.objects.create(todo=todo, file='todo_attachments/man.png', file_name='man.png')
+
+    def test_first_page_and_fragment(self):
+        """Test that the list renders one page and the fragment serves the rest"""
+        response = self.client.get(reverse('todo_list'))
+        self.assertEqual(len(response.context['todos']), 25)
+        self.assertContains(response, 'Todo 29')
+        self.assertNotContains(response, 'Todo 04')
+        next_url = response.context['next_page_url']
+        self.assertTrue(next_url.startswith(reverse('todo_list_more')))
+
+        fragment = self.client.get(next_url)
+        self.assertEqual(len(fragment.context['todos']), 5)
+        self.assertContains(fragment, 'Todo 00')
+        self.assertIsNone(fragment.context['next_page_url'])
+
+    def test_list_queries_do_not_grow_per_card(self):
+        """Test that rendering cards does not query per todo"""
+        self.client.get(reverse('todo_list'))
+        cache.bump([self.user.id])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('todo_list'))
+        # session, user, todos page, thumbnails, stats, categories
+        self.assertEqual(len(queries.captured_queries), 6)
+
+    def test_unchanged_list_is_served_from_cache(self):
+        """Test that re-reading an unchanged list skips the todo queries"""
+        self.client.get(reverse('todo_list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('todo_list'))
+        # session, user
+        self.assertEqual(len(queries.captured_queries), 2)
+
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS, MEDIA_ROOT=tempfile.mkdtemp())
+class BackgroundJobTest(TransactionTestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.layer = get_channel_layer()
+        async_to_sync(self.layer.group_add)(f'notifications_{self.user.id}', 'test-listener')
+
+    def received_events(self):
+        events = []
+        while True:
+            try:
+                message = async_to_sync(asyncio.wait_for)(self.layer.receive('test-listener'), 0.05)
+            except asyncio.TimeoutError:
+                return events
+            events.append(message['message']['event'])
+
+    def test_large_import_runs_in_worker(self):
+        """Test that an oversized upload is queued and imported by the worker"""
+        upload = SimpleUploadedFile('todos.json', json.dumps([{'title': 'Queued'}]).encode())
+        with mock.patch('todo.jobs.INLINE_IMPORT_MAX_BYTES', 0):
+            self.client.post(reverse('import_todos'), {'file': upload})
+        self.assertFalse(Todo.objects.filter(title='Queued').exists())
+
+        finished = run_pending_jobs()
+        self.assertEqual([job.status for job in finished], ['completed'])
+        self.assertEqual(finished[0].result['inserted'], 1)
+        self.assertTrue(Todo.objects.filter(user=self.user, title='Queued').exists())
+        events = self.received_events()
+        self.assertEqual(events[0], 'job.started')
+        self.assertEqual(events[-1], 'job.finished')
+
+    def test_background_export_is_downloadable(self):
+        """Test that a queued export produces a file at its download URL"""
+        Todo.objects.create(title='Exported', user=self.user)
+        response = self.client.get(reverse('export_todos') + '?format=ndjson&background=true')
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['id']
+
+        call_command('run_jobs', once=True, concurrency=1, poll_interval=0, stdout=io.StringIO())
+        status = self.client.get(reverse('job_status', args=[job_id])).json()
+        self.assertEqual(status['status'], 'completed')
+
+        download = self.client.get(status['download_url'])
+        self.assertEqual(json.loads(b''.join(download.streaming_content))['title'], 'Exported')
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(status['download_url']).status_code, 404)
+
+    def test_export_progress_counts_rows_written(self):
+        """Test that the CSV header is not reported as a chunk of exported rows"""
+        Todo.objects.bulk_create([Todo(title=f'Row {i}', user=self.user) for i in range(3)])
+        job = BackgroundJob.objects.create(user=self.user, kind='export', params={'format': 'csv'})
+        reported = []
+        with mock.patch('todo.utils.EXPORT_CHUNK_SIZE', 2):
+            jobs._run_export(job, lambda done, total: reported.append((done, total)))
+        self.assertEqual(reported, [(2, 3), (3, 3)])
+
+    def test_stale_running_job_is_requeued(self):
+        """Test that a job left running by a dead worker is claimed again, then failed"""
+        stale = timezone.now() - timezone.timedelta(hours=1)
+        job = BackgroundJob.objects.create(user=self.user, kind='export', status='running',
+                                           started_at=stale, heartbeat_at=stale, attempts=1)
+        claimed = claim_next_job()
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual(claimed.attempts, 2)
+        self.assertIsNone(claim_next_job())
+
+        with mock.patch('todo.jobs.MAX_JOB_ATTEMPTS', 2):
+            BackgroundJob.objects.filter(pk=job.pk).update(heartbeat_at=stale)
+            self.assertIsNone(claim_next_job())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertTrue(job.error)
+
+    def test_lease_is_renewed_while_the_job_runs(self):
+        """Test that a job running past its lease without reporting progress is not reaped"""
+        BackgroundJob.objects.create(user=self.user, kind='rollup')
+        reaped = []
+
+        def slow(job, progress):
+            time.sleep(0.5)
+            reaped.append(jobs.requeue_stale_jobs())
+            return {}
+
+        with mock.patch('todo.jobs.JOB_LEASE_SECONDS', 0.3), mock.patch.dict('todo.jobs.RUNNERS', {'rollup': slow}):
+            finished = run_pending_jobs()
+        self.assertEqual([job.status for job in finished], ['completed'])
+        self.assertEqual(reaped, [(0, 0)])
+
+    def test_claim_checks_running_limit(self):
+        """Test that the claim itself enforces the per-user running limit"""
+        BackgroundJob.objects.create(user=self.user, kind='export', status='running',
+                                     heartbeat_at=timezone.now())
+        queued = BackgroundJob.objects.create(user=self.user, kind='export')
+        # As if another worker's claim landed after the candidates were read
+        self.assertFalse(jobs._claim(queued.pk, self.user.id, 'export'))
+        self.assertEqual(BackgroundJob.objects.filter(status='running').count(), 1)
+
+    def test_thumbnails_do_not_wait_for_imports(self):
+        """Test that thumbnail jobs have their own running limit"""
+        BackgroundJob.objects.create(user=self.user, kind='import', status='running',
+                                     heartbeat_at=timezone.now())
+        BackgroundJob.objects.create(user=self.user, kind='export')
+        thumbnail = BackgroundJob.objects.create(user=self.user, kind='thumbnail')
+        self.assertEqual(claim_next_job().pk, thumbnail.pk)
+        self.assertIsNone(claim_next_job())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class TodoRealtimeTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+        self.layer = get_channel_layer()
+        for user in (self.owner, self.friend):
+            async_to_sync(self.layer.group_add)(f'todos_{user.id}', f'listener-{user.id}')
+
+    def received(self, user):
+        messages = []
+        while True:
+            try:
+                message = async_to_sync(asyncio.wait_for)(self.layer.receive(f'listener-{user.id}'), 0.05)
+            except asyncio.TimeoutError:
+                return messages
+            messages.append(message)
+
+    def test_changes_reach_owner_and_sharees_after_commit(self):
+        """Test that one transaction's changes are coalesced and sent on commit"""
+        with self.captureOnCommitCallbacks(execute=True):
+            todo = Todo.objects.create(title='Shared', user=self.owner)
+            TodoShare.objects.create(todo=todo, shared_with=self.friend, shared_by=self.owner)
+            todo.title = 'Renamed'
+            todo.save()
+            self.assertEqual(self.received(self.owner), [])
+
+        owner_messages = self.received(self.owner)
+        self.assertEqual(len(owner_messages), 1)
+        self.assertEqual(owner_messages[0]['type'], 'todo.message')
+        self.assertEqual(owner_messages[0]['action'], 'create')
+        self.assertEqual(owner_messages[0]['todo_data']['title'], 'Renamed')
+        friend_messages = self.received(self.friend)
+        self.assertEqual([m['action'] for m in friend_messages], ['create'])
+
+        todo_id = todo.id
+        with self.captureOnCommitCallbacks(execute=True):
+            todo.delete()
+        self.assertEqual(self.received(self.friend)[0]['todo_data'], {'id': todo_id})
+
+    def test_rolled_back_savepoint_does_not_swallow_later_changes(self):
+        """Test that changes after a rolled back savepoint still publish on commit"""
+        self.received(self.owner)
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Todo.objects.create(title='Rolled back', user=self.owner)
+                raise RuntimeError
+            Todo.objects.create(title='Kept', user=self.owner)
+        messages = self.received(self.owner)
+        self.assertEqual([m['todo_data']['title'] for m in messages], ['Kept'])
+
+    def test_bulk_import_sends_batches(self):
+        """Test that a bulk import publishes batch messages instead of one per todo"""
+        rows = [{'title': f'Imported {i}'} for i in range(5)]
+        with mock.patch('todo.realtime.EVENT_BATCH_SIZE', 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                import_todos_from_json(self.owner, json.dumps(rows))
+        messages = self.received(self.owner)
+        self.assertEqual([m['type'] for m in messages], ['todo.batch'] * 3)
+        self.assertEqual(sum(len(m['events']) for m in messages), 5)
+
+    def test_consumer_coalesces_events_into_one_frame(self):
+        """Test that TodoConsumer forwards a burst of group events as one frame"""
+        from asgiref.testing import ApplicationCommunicator
+        from .consumers import TodoConsumer
+
+        async def scenario():
+            scope = {'type': 'websocket', 'path': '/ws/todos/', 'user': self.owner}
+            communicator = ApplicationCommunicator(TodoConsumer.as_asgi(), scope)
+            await communicator.send_input({'type': 'websocket.connect'})
+            self.assertEqual((await communicator.receive_output(1))['type'], 'websocket.accept')
+            group = f'todos_{self.owner.id}'
+            await self.layer.group_send(group, {'type': 'todo.message', 'action': 'create', 'todo_data': {'id': 1}})
+            await self.layer.group_send(group, {'type': 'todo.message', 'action': 'update', 'todo_data': {'id': 1, 'title': 'x'}})
+            await self.layer.group_send(group, {'type': 'todo.message', 'action': 'update', 'todo_data': {'id': 2}})
+            frame = json.loads((await communicator.receive_output(1))['text'])
+            silent = await communicator.receive_nothing(0.1)
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+            return frame, silent
+
+        frame, silent = async_to_sync(scenario)()
+        self.assertTrue(silent)
+        self.assertEqual(frame['type'], 'todo.batch')
+        self.assertEqual(frame['events'], [
+            {'action': 'create', 'todo': {'id': 1, 'title': 'x'}},
+            {'action': 'update', 'todo': {'id': 2}},
+        ])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class TodoConsumerBatchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.todo = Todo.objects.create(title='Existing', user=self.user)
+
+    def send_batch(self, operations):
+        from asgiref.testing import ApplicationCommunicator
+        from .consumers import TodoConsumer
+
+        async def scenario():
+            scope = {'type': 'websocket', 'path': '/ws/todos/', 'user': self.user}
+            communicator = ApplicationCommunicator(TodoConsumer.as_asgi(), scope)
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(1)
+            await communicator.send_input({
+                'type': 'websocket.receive',
+                'text': json.dumps({'type': 'todo.batch', 'operations': operations}),
+            })
+            reply = json.loads((await communicator.receive_output(1))['text'])
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+            return reply
+
+        return async_to_sync(scenario)()
+
+    def test_batch_reports_per_operation_results(self):
+        """Test that a batch applies valid operations and reports failures per item"""
+        with CaptureQueriesContext(connection) as queries:
+            reply = self.send_batch([
+                {'type': 'todo.create', 'ref': 'a', 'todo': {'title': 'Offline'}},
+                {'type': 'todo.update', 'todo_id': self.todo.id, 'todo': {'status': 'completed'}},
+                {'type': 'todo.delete', 'todo_id': 999999},
+                {'type': 'todo.rename'},
+            ])
+        self.assertEqual(reply['type'], 'todo.batch.result')
+        created, updated, missing, unknown = reply['results']
+        self.assertTrue(created['ok'])
+        self.assertEqual(created['ref'], 'a')
+        self.assertEqual(Todo.objects.get(id=created['id']).title, 'Offline')
+        self.assertTrue(updated['ok'])
+        self.todo.refresh_from_db()
+        self.assertEqual(self.todo.status, 'completed')
+        self.assertEqual(missing, {'index': 2, 'ok': False, 'error': 'Todo not found.'})
+        self.assertFalse(unknown['ok'])
+        self.assertFalse(any('auth_user' in q['sql'] for q in queries.captured_queries))
+
+    def test_status_updates_set_and_clear_completed_at(self):
+        """Test that socket updates keep completed_at in step with the status"""
+        self.send_batch([{'type': 'todo.update', 'todo_id': self.todo.id, 'todo': {'status': 'completed'}}])
+        self.todo.refresh_from_db()
+        self.assertIsNotNone(self.todo.completed_at)
+        today = timezone.localdate()
+        self.assertEqual(rollups.dashboard(self.user, today, today)['totals'], {'created': 1, 'completed': 1})
+
+        self.send_batch([{'type': 'todo.update', 'todo_id': self.todo.id, 'todo': {'status': 'pending'}}])
+        self.todo.refresh_from_db()
+        self.assertIsNone(self.todo.completed_at)
+        self.assertEqual(rollups.dashboard(self.user, today, today)['totals'], {'created': 1, 'completed': 0})
+
+    def test_batch_size_is_limited(self):
+        """Test that oversized batches are rejected without touching the database"""
+        with mock.patch('todo.consumers.MAX_BATCH_OPERATIONS', 1):
+            reply = self.send_batch([{'type': 'todo.create', 'todo': {'title': 'One'}}] * 2)
+        self.assertIn('error', reply)
+        self.assertEqual(Todo.objects.filter(title='One').count(), 0)
+
+
+class ConsumerLoadTestCommandTest(TransactionTestCase):
+    def test_loadtest_reports_latencies(self):
+        """Test that the load harness drives both consumers and cleans up after itself"""
+        out = io.StringIO()
+        call_command('loadtest_consumers', connections=3, operations=4, broadcasts=2, stdout=out)
+        report = out.getvalue()
+        self.assertIn('Todo round trip (ms): p50=', report)
+        self.assertIn('Broadcast delivery (ms): p50=', report)
+        self.assertNotIn('Timed out', report)
+        self.assertFalse(User.objects.filter(username__startswith='loadtest-').exists())
+        self.assertFalse(Todo.objects.exists())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class NotificationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+
+    def test_unread_counter_is_kept_without_counting(self):
+        """Test that the unread counter follows notify and batched read-acks"""
+        self.assertEqual(unread_count(self.user.id), 0)
+        sent = [notify(self.user.id, {'text': f'Hello {i}'}) for i in range(3)]
+        with self.assertNumQueries(1):
+            self.assertEqual(unread_count(self.user.id), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            marked = mark_read(self.user.id, [sent[0].id, sent[1].id, 999999])
+        self.assertEqual(marked, 2)
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "todo_notification"')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(unread_count(self.user.id), 1)
+        self.assertEqual(mark_read(self.user.id, [sent[0].id]), 0)
+        self.assertEqual(unread_count(self.user.id), 1)
+
+    def test_consumer_sends_unread_on_connect_and_accepts_batched_acks(self):
+        """Test that NotificationConsumer replays unread notifications and marks batches read"""
+        from asgiref.testing import ApplicationCommunicator
+        from .consumers import NotificationConsumer
+
+        sent = [notify(self.user.id, {'text': f'Hello {i}'}) for i in range(2)]
+
+        async def scenario():
+            scope = {'type': 'websocket', 'path': '/ws/notifications/', 'user': self.user}
+            communicator = ApplicationCommunicator(NotificationConsumer.as_asgi(), scope)
+            await communicator.send_input({'type': 'websocket.connect'})
+            await communicator.receive_output(1)
+            snapshot = json.loads((await communicator.receive_output(1))['text'])
+            await communicator.send_input({
+                'type': 'websocket.receive',
+                'text': json.dumps({'type': 'notification.read', 'notification_ids': [n.id for n in sent]}),
+            })
+            await communicator.receive_nothing(0.2)
+            await communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+            await communicator.wait(1)
+            return snapshot
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            snapshot = async_to_sync(scenario)()
+        self.assertEqual(snapshot['type'], 'notification.unread')
+        self.assertEqual(snapshot['unread'], 2)
+        self.assertEqual([n['text'] for n in snapshot['notifications']], ['Hello 1', 'Hello 0'])
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(unread_count(self.user.id), 0)
+        self.assertFalse(Notification.objects.filter(user=self.user, is_read=False).exists())
+
+    def test_api_marks_notifications_read(self):
+        """Test the notification API endpoints"""
+        notify(self.user.id, {'text': 'Hello'})
+        self.client.login(username='testuser', password='testpass123')
+        listing = self.client.get(reverse('api-notification-list')).json()
+        self.assertEqual(listing['unread'], 1)
+        response = self.client.post(reverse('api-notification-read'), {'all': True}, content_type='application/json')
+        self.assertEqual(response.json(), {'marked': 1, 'unread': 0})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ReminderSchedulerTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+        self.now = timezone.now()
+
+    def test_window_load_and_single_delivery(self):
+        """Test that due reminders reach owner and sharees exactly once"""
+        due = Todo.objects.create(title='Due', user=self.user, due_date=self.now - timezone.timedelta(minutes=1))
+        TodoShare.objects.create(todo=due, shared_with=self.friend, shared_by=self.user)
+        Todo.objects.create(title='Later', user=self.user, due_date=self.now + timezone.timedelta(days=2))
+        Todo.objects.create(title='Done', user=self.user, due_date=self.now, status='completed')
+
+        scheduler = ReminderScheduler(self.now)
+        self.assertEqual(scheduler.load(self.now), 1)
+        self.assertEqual(send_due_reminders(scheduler, self.now), 1)
+        reminders = Notification.objects.filter(kind='reminder')
+        self.assertEqual(sorted(reminders.values_list('user_id', flat=True)), sorted([self.user.id, self.friend.id]))
+
+        # A restarted scheduler does not send it again
+        restarted = ReminderScheduler(self.now)
+        self.assertEqual(restarted.load(self.now), 0)
+        self.assertFalse(send_reminder(due.id, due.due_date))
+
+    def test_scheduler_follows_due_date_changes(self):
+        """Test that due date changes reach the scheduler through the channel layer"""
+        layer = get_channel_layer()
+        async_to_sync(layer.group_add)(REMINDER_GROUP, 'scheduler')
+        todo = Todo.objects.create(title='Moved', user=self.user, due_date=self.now + timezone.timedelta(minutes=30))
+        scheduler = ReminderScheduler(self.now)
+        # No rescans, so only the message can move the reminder
+        with mock.patch('todo.reminders.RESCAN_INTERVAL', timezone.timedelta(days=1)):
+            scheduler.load(self.now)
+
+        soon = self.now + timezone.timedelta(minutes=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            todo.due_date = soon
+            todo.save()
+        scheduler.handle_message(async_to_sync(layer.receive)('scheduler'), self.now)
+
+        self.assertEqual(scheduler.seconds_until_next(self.now), 300)
+        self.assertEqual(scheduler.pop_due(self.now + timezone.timedelta(minutes=10)), [(todo.id, soon)])
+        self.assertEqual(scheduler.pop_due(self.now + timezone.timedelta(hours=1)), [])
+
+    def test_rescan_finds_changes_without_a_message(self):
+        """Test that a due date added inside the loaded window is found by the next rescan"""
+        scheduler = ReminderScheduler(self.now)
+        scheduler.load(self.now)
+        # Created without running on_commit, as if the reschedule message were lost
+        soon = self.now + timezone.timedelta(minutes=5)
+        todo = Todo.objects.create(title='Unannounced', user=self.user, due_date=soon)
+
+        self.assertEqual(scheduler.load(self.now + timezone.timedelta(seconds=1)), 0)
+        self.assertEqual(scheduler.seconds_until_next(self.now), reminders.RESCAN_INTERVAL.total_seconds())
+        self.assertEqual(scheduler.load(self.now + reminders.RESCAN_INTERVAL), 1)
+        self.assertEqual(scheduler.pop_due(soon), [(todo.id, soon)])
+
+
+class ResponseCacheTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+        self.category = Category.objects.create(name='Work', user=self.owner)
+        self.todo = Todo.objects.create(title='Shared', user=self.owner, category=self.category)
+        TodoShare.objects.create(todo=self.todo, shared_with=self.friend, shared_by=self.owner)
+
+    def list_titles(self, user):
+        self.client.force_login(user)
+        response = self.client.get(reverse('api-todo-list-create'))
+        return [(todo['title'], todo['category']['name']) for todo in response.json()['results']]
+
+    def test_writes_invalidate_owner_and_sharees(self):
+        """Test that cached lists follow todo, category and share writes"""
+        self.assertEqual(self.list_titles(self.friend), [('Shared', 'Work')])
+        self.todo.title = 'Renamed'
+        self.todo.save()
+        self.assertEqual(self.list_titles(self.friend), [('Renamed', 'Work')])
+
+        self.category.name = 'Home'
+        self.category.save()
+        self.assertEqual(self.list_titles(self.friend), [('Renamed', 'Home')])
+
+        TodoShare.objects.filter(todo=self.todo).delete()
+        self.assertEqual(self.list_titles(self.friend), [])
+        self.assertEqual(self.list_titles(self.owner), [('Renamed', 'Home')])
+
+    def test_unchanged_stats_are_served_from_cache(self):
+        """Test that stats are cached until the next write"""
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(reverse('api-todo-stats')).json()['total'], 1)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('api-todo-stats'))
+        Todo.objects.create(title='Another', user=self.owner)
+        self.assertEqual(self.client.get(reverse('api-todo-stats')).json()['total'], 2)
+
+    def test_process_local_backend_is_bypassed(self):
+        """Test that nothing is cached when other processes could not see a bump"""
+        calls = []
+        with mock.patch('todo.cache.ALLOW_LOCAL', False):
+            for _ in range(2):
+                cache.get_or_set(self.owner.id, 'test', None, lambda: calls.append(1) or len(calls))
+        self.assertEqual(len(calls), 2)
+
+    def test_local_tier_is_bounded(self):
+        """Test that the in-process tier evicts the least recently used entry"""
+        lru = cache.LocalLRU(2)
+        lru.set('a', 1, 60)
+        lru.set('b', 2, 60)
+        lru.get('a')
+        lru.set('c', 3, 60)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+
+class ConditionalRequestTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.todo = Todo.objects.create(title='Tagged', user=self.user)
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_list_returns_304_until_something_changes(self):
+        """Test that list ETags match until a todo, share or delete changes the page"""
+        url = reverse('api-todo-list-create')
+        etag = self.client.get(url)['ETag']
+        with CaptureQueriesContext(connection) as queries:
+            response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 304)
+        # session, user, validator
+        self.assertEqual(len(queries.captured_queries), 3)
+
+        other = Todo.objects.create(title='Shared with me', user=self.friend)
+        TodoShare.objects.create(todo=other, shared_with=self.user, shared_by=self.friend)
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+        etag = self.client.get(url)['ETag']
+        other.delete()
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_detail_supports_etag_and_last_modified(self):
+        """Test conditional GETs on a single todo, including attachment changes"""
+        url = reverse('api-todo-detail', args=[self.todo.id])
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+        TodoAttachment.objects.create(todo=self.todo, file='todo_attachments/man.png', file_name='man.png')
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_categories_and_stats_revalidate(self):
+        """Test that category and stats ETags change with the data"""
+        categories_url = reverse('api-category-list-create')
+        stats_url = reverse('api-todo-stats')
+        categories_etag = self.client.get(categories_url)['ETag']
+        stats_etag = self.client.get(stats_url)['ETag']
+        self.assertEqual(self.revalidate(categories_url, categories_etag).status_code, 304)
+        self.assertEqual(self.revalidate(stats_url, stats_etag).status_code, 304)
+
+        Category.objects.create(name='Work', user=self.user)
+        self.todo.status = 'completed'
+        self.todo.save()
+        self.assertEqual(self.revalidate(categories_url, categories_etag).status_code, 200)
+        self.assertEqual(self.revalidate(stats_url, stats_etag).status_code, 200)
+
+    def test_cached_body_matches_its_etag(self):
+        """Test that a change the cache missed gives a new tag and a fresh body together"""
+        url = reverse('api-todo-list-create')
+        etag = self.client.get(url)['ETag']
+        # No signals, so the cache version stays the same
+        Todo.objects.filter(id=self.todo.id).update(title='Renamed', updated_at=timezone.now())
+        response = self.revalidate(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['results'][0]['title'], 'Renamed')
+
+
+class DeltaSyncTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+
+    def changes(self, user, cursor=''):
+        self.client.force_login(user)
+        return self.client.get(reverse('api-todo-changes'), {'since': cursor}).json()
+
+    def test_changes_since_cursor_with_tombstones(self):
+        """Test that a poll returns only later changes, deletes and revoked shares"""
+        category = Category.objects.create(name='Work', user=self.owner)
+        kept = Todo.objects.create(title='Kept', user=self.owner, category=category)
+        doomed = Todo.objects.create(title='Doomed', user=self.owner)
+        share = TodoShare.objects.create(todo=kept, shared_with=self.friend, shared_by=self.owner)
+
+        first = self.changes(self.owner)
+        self.assertEqual([todo['title'] for todo in first['todos']], ['Kept', 'Doomed'])
+        self.assertEqual([c['name'] for c in first['categories']], ['Work'])
+        friend_cursor = self.changes(self.friend)['cursor']
+
+        self.assertEqual(self.changes(self.owner, first['cursor'])['todos'], [])
+        kept.title = 'Kept and edited'
+        kept.save()
+        doomed_id = doomed.id
+        doomed.delete()
+        share.delete()
+
+        second = self.changes(self.owner, first['cursor'])
+        self.assertEqual([todo['title'] for todo in second['todos']], ['Kept and edited'])
+        self.assertEqual(second['deleted'], {'todos': [doomed_id], 'categories': []})
+        friend = self.changes(self.friend, friend_cursor)
+        self.assertEqual(friend['todos'], [])
+        self.assertEqual(friend['deleted']['todos'], [kept.id])
+
+    def test_poll_is_paginated_and_rejects_bad_cursors(self):
+        """Test limit/has_more paging over the ledger"""
+        for i in range(3):
+            Todo.objects.create(title=f'Todo {i}', user=self.owner)
+        self.client.force_login(self.owner)
+        page = self.client.get(reverse('api-todo-changes'), {'limit': 2}).json()
+        self.assertTrue(page['has_more'])
+        rest = self.client.get(reverse('api-todo-changes'), {'since': page['cursor'], 'limit': 2}).json()
+        self.assertFalse(rest['has_more'])
+        self.assertEqual(len(page['todos']) + len(rest['todos']), 3)
+        self.assertEqual(self.client.get(reverse('api-todo-changes'), {'since': 'x'}).status_code, 400)
+
+    def test_bulk_import_is_recorded(self):
+        """Test that bulk-imported todos and categories show up in the feed"""
+        import_todos_from_json(self.owner, json.dumps([{'title': 'Imported', 'category': 'Inbox'}]))
+        feed = self.changes(self.owner)
+        self.assertEqual([todo['title'] for todo in feed['todos']], ['Imported'])
+        self.assertEqual([c['name'] for c in feed['categories']], ['Inbox'])
+
+
+class BulkTodoAPITest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.client.login(username='testuser', password='testpass123')
+        self.mine = [Todo.objects.create(title=f'Mine {i}', user=self.user) for i in range(3)]
+        self.editable = Todo.objects.create(title='Editable', user=self.owner)
+        self.readonly = Todo.objects.create(title='Read only', user=self.owner)
+        TodoShare.objects.create(todo=self.editable, shared_with=self.user, shared_by=self.owner, can_edit=True)
+        TodoShare.objects.create(todo=self.readonly, shared_with=self.user, shared_by=self.owner)
+
+    def post(self, operations):
+        return self.client.post(reverse('api-todo-bulk'), {'operations': operations}, content_type='application/json')
+
+    def test_bulk_operations_report_per_item_status(self):
+        """Test create, update, toggle and delete with mixed permissions"""
+        category = Category.objects.create(name='Work', user=self.user)
+        ids = [todo.id for todo in self.mine]
+        response = self.post([
+            {'op': 'create', 'todo': {'title': 'Bulk created', 'priority': 'high'}},
+            {'op': 'create', 'todo': {'title': ''}},
+            {'op': 'update', 'ids': ids + [self.editable.id, self.readonly.id], 'changes': {'category_id': category.id}},
+            {'op': 'toggle', 'ids': ids[:2]},
+            {'op': 'delete', 'ids': [ids[2], 999999]},
+        ])
+        self.assertEqual(response.status_code, 200)
+        created, invalid, update, toggle, delete = response.json()['results']
+        self.assertTrue(created['ok'])
+        self.assertEqual(Todo.objects.get(id=created['id']).title, 'Bulk created')
+        self.assertFalse(invalid['ok'])
+        self.assertEqual(update['ids'], ids + [self.editable.id])
+        self.assertEqual(update['errors'], {str(self.readonly.id): 'Permission denied.'})
+        self.assertEqual(toggle['errors'], {})
+        self.assertEqual(delete['errors'], {'999999': 'Todo not found.'})
+
+        self.assertEqual(Todo.objects.filter(category=category).count(), 3)
+        self.assertEqual(Todo.objects.filter(id__in=ids[:2], status='completed').count(), 2)
+        self.assertFalse(Todo.objects.filter(id=ids[2]).exists())
+        stats = get_stats(self.user)
+        self.assertEqual((stats.total, stats.completed), (5, 2))
+
+    def test_update_keeps_existing_completion_times(self):
+        """Test that completing todos in bulk leaves already completed ones untouched"""
+        done, open_ = self.mine[:2]
+        finished = timezone.now() - timezone.timedelta(days=5)
+        Todo.objects.filter(id=done.id).update(status='completed', completed_at=finished)
+        self.post([{'op': 'update', 'ids': [done.id, open_.id], 'changes': {'status': 'completed'}}])
+        done.refresh_from_db()
+        open_.refresh_from_db()
+        self.assertEqual(done.completed_at, finished)
+        self.assertGreater(open_.completed_at, finished)
+
+    @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+    def test_delete_is_set_based(self):
+        """Test that bulk deletes update the derived tables without per-todo queries"""
+        for user in (self.user, self.owner):
+            get_stats(user)
+            rollups.ensure_built(user.id)
+        extra = [Todo.objects.create(title=f'Extra {i}', user=self.user).id for i in range(10)]
+        TodoAttachment.objects.create(todo_id=extra[0], file=SimpleUploadedFile('a.txt', b'same'), file_name='a.txt')
+        TodoAttachment.objects.create(todo_id=extra[1], file=SimpleUploadedFile('b.txt', b'same'), file_name='b.txt')
+        TodoAttachment.objects.create(todo=self.mine[0], file=SimpleUploadedFile('c.txt', b'same'), file_name='c.txt')
+        with CaptureQueriesContext(connection) as few:
+            self.post([{'op': 'delete', 'ids': [self.mine[0].id]}])
+        with CaptureQueriesContext(connection) as many:
+            self.post([{'op': 'delete', 'ids': extra}])
+        # Statements grow with the users and rollup rows touched, not the todos
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+        self.post([{'op': 'delete', 'ids': [self.editable.id]}])
+
+        self.assertFalse(Todo.objects.filter(id__in=extra + [self.editable.id]).exists())
+        self.assertFalse(TodoShare.objects.filter(todo_id=self.editable.id).exists())
+        self.assertFalse(TodoAttachment.objects.filter(todo_id__in=extra).exists())
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 0)
+        for user in (self.user, self.owner):
+            self.assertEqual(as_dict(get_stats(user)), as_dict(recompute(user)))
+            self.assertTrue(TodoRollupState.objects.filter(user=user).exists())
+        self.assertEqual(get_stats(self.user).total, 3)
+        self.assertTrue(SyncChange.objects.filter(user=self.user, object_id=self.editable.id, deleted=True).exists())
+
+    def test_permissions_are_checked_in_one_query(self):
+        """Test that permission checks do not grow with the number of ids"""
+        extra = [Todo.objects.create(title=f'Extra {i}', user=self.user).id for i in range(20)]
+        with CaptureQueriesContext(connection) as few:
+            self.post([{'op': 'toggle', 'ids': [self.mine[0].id]}])
+        with CaptureQueriesContext(connection) as many:
+            self.post([{'op': 'toggle', 'ids': extra}])
+        self.assertEqual(len(few.captured_queries), len(many.captured_queries))
+
+    def test_malformed_request_is_rejected(self):
+        """Test that malformed bulk requests write nothing"""
+        response = self.post([{'op': 'create', 'todo': {'title': 'Not written'}}, {'op': 'explode'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Todo.objects.filter(title='Not written').exists())
+
+
+class TodoPermissionTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.editor = User.objects.create_user(username='editor', password='testpass123')
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.stranger = User.objects.create_user(username='stranger', password='testpass123')
+        self.todo = Todo.objects.create(title='Shared', user=self.owner)
+        TodoShare.objects.create(todo=self.todo, shared_with=self.editor, shared_by=self.owner, can_edit=True)
+        TodoShare.objects.create(todo=self.todo, shared_with=self.viewer, shared_by=self.owner)
+
+    def test_resolve_returns_effective_permission_in_one_query(self):
+        """Test that the todo and the caller's permission come from a single query"""
+        expected = {
+            self.owner: permissions.OWNER,
+            self.editor: permissions.EDIT,
+            self.viewer: permissions.VIEW,
+            self.stranger: permissions.NONE,
+        }
+        for user, permission in expected.items():
+            with self.assertNumQueries(1):
+                todo, resolved = permissions.resolve(user, self.todo.id)
+            self.assertEqual((todo, resolved), (self.todo, permission))
+        self.assertEqual(permissions.resolve(self.owner, 999999), (None, permissions.NONE))
+
+    def test_resolve_is_memoized_per_request(self):
+        """Test that a request resolves each todo only once"""
+        request = mock.Mock(spec=[])
+        permissions.resolve(self.owner, self.todo.id, request)
+        with self.assertNumQueries(0):
+            todo, permission = permissions.resolve(self.owner, self.todo.id, request)
+        self.assertEqual(permission, permissions.OWNER)
+
+    def test_toggle_honours_share_permissions(self):
+        """Test that the HTML and API toggles follow share permissions"""
+        client = Client()
+        client.login(username='viewer', password='testpass123')
+        response = client.post(reverse('todo_toggle_complete', args=[self.todo.id]))
+        self.assertEqual(response.status_code, 403)
+
+        client.login(username='editor', password='testpass123')
+        response = client.post(reverse('api-todo-toggle-status', args=[self.todo.id]))
+        self.assertEqual(response.status_code, 200)
+        self.todo.refresh_from_db()
+        self.assertEqual(self.todo.status, 'completed')
+
+    def apply_batch(self, user, operations):
+        from .consumers import TodoConsumer
+
+        consumer = TodoConsumer()
+        consumer.user = user
+        return async_to_sync(consumer.apply_batch)(operations)
+
+    def test_consumer_writes_respect_shares(self):
+        """Test that websocket updates and deletes follow the same share rules"""
+        update = {'type': 'todo.update', 'todo_id': self.todo.id, 'todo': {'title': 'Edited'}}
+        results = self.apply_batch(self.editor, [update])
+        self.assertTrue(results[0]['ok'])
+        self.todo.refresh_from_db()
+        self.assertEqual(self.todo.title, 'Edited')
+
+        viewer_update, = self.apply_batch(self.viewer, [update])
+        self.assertEqual(viewer_update['error'], 'Permission denied.')
+        viewer_delete, = self.apply_batch(self.viewer, [{'type': 'todo.delete', 'todo_id': self.todo.id}])
+        self.assertEqual(viewer_delete['error'], 'Permission denied.')
+        self.assertTrue(Todo.objects.filter(id=self.todo.id).exists())
+        stranger_delete, = self.apply_batch(self.stranger, [{'type': 'todo.delete', 'todo_id': self.todo.id}])
+        self.assertEqual(stranger_delete['error'], 'Permission denied.')
+        escalate, = self.apply_batch(self.editor, [
+            {'type': 'todo.update', 'todo_id': self.todo.id, 'todo': {'user_id': self.editor.id}},
+        ])
+        self.assertFalse(escalate['ok'])
+        self.assertTrue(Todo.objects.filter(id=self.todo.id, user=self.owner).exists())
+
+
+class TodoToggleTest(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.editor = User.objects.create_user(username='editor', password='testpass123')
+        self.todo = Todo.objects.create(title='Contended', user=self.owner)
+        TodoShare.objects.create(todo=self.todo, shared_with=self.editor, shared_by=self.owner, can_edit=True)
+
+    def test_concurrent_toggles_are_not_lost(self):
+        """Test that a toggle landing between another toggle's read and write still counts"""
+        owner, editor = Client(), Client()
+        owner.login(username='owner', password='testpass123')
+        editor.login(username='editor', password='testpass123')
+        url = reverse('todo_toggle_complete', args=[self.todo.id])
+        resolve = permissions.resolve
+        interleaved = []
+
+        def resolve_then_interleave(user, todo_id, request=None):
+            result = resolve(user, todo_id, request)
+            if not interleaved:
+                # The editor's whole toggle runs after the owner's read
+                interleaved.append(None)
+                interleaved[0] = editor.post(url).json()
+            return result
+
+        with mock.patch('todo.permissions.resolve', side_effect=resolve_then_interleave):
+            response = owner.post(url)
+        self.assertEqual(interleaved[0]['status'], 'completed')
+        self.assertEqual(response.json(), {'status': 'pending', 'completed_at': None})
+        self.todo.refresh_from_db()
+        self.assertEqual(self.todo.status, 'pending')
+        self.assertIsNone(self.todo.completed_at)
+        self.assertEqual(get_stats(self.owner).completed, 0)
+
+    def test_api_toggle_returns_new_state(self):
+        """Test that the API toggle reports the state written by the database"""
+        client = Client()
+        client.login(username='editor', password='testpass123')
+        response = client.post(reverse('api-todo-toggle-status', args=[self.todo.id]))
+        self.assertEqual(response.json()['status'], 'completed')
+        self.assertIsNotNone(response.json()['completed_at'])
+        self.assertEqual(get_stats(self.owner).completed, 1)
+
+    def test_toggle_moves_stats_without_recount(self):
+        """Test that toggles keep everyone's stats rows and agree with a recount"""
+        past = timezone.now() - timezone.timedelta(hours=1)
+        other = Todo.objects.create(title='Overdue', user=self.owner, due_date=past)
+        get_stats(self.owner)
+        get_stats(self.editor)
+        bulk.toggle([self.todo.id, other.id])
+        self.assertTrue(TodoStats.objects.filter(user=self.owner).exists())
+        self.assertTrue(TodoStats.objects.filter(user=self.editor).exists())
+        for user in (self.owner, self.editor):
+            self.assertEqual(as_dict(get_stats(user)), as_dict(recompute(user)))
+        self.assertEqual(get_stats(self.owner).completed, 2)
+
+        bulk.toggle([other.id])
+        self.assertEqual(as_dict(get_stats(self.owner)), as_dict(recompute(self.owner)))
+        self.assertEqual(get_stats(self.owner).overdue, 1)
+
+    def test_partial_update_writes_only_changed_fields(self):
+        """Test that a PATCH updates only the columns it changed"""
+        client = Client()
+        client.login(username='owner', password='testpass123')
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(
+                reverse('api-todo-detail', args=[self.todo.id]),
+                data=json.dumps({'title': 'Renamed', 'priority': 'medium'}),
+                content_type='application/json',
+            )
+        self.assertEqual(response.status_code, 200)
+        update, = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('UPDATE "todo_todo"')]
+        self.assertIn('"title"', update)
+        self.assertNotIn('"priority"', update)
+        self.assertNotIn('"description"', update)
+        self.todo.refresh_from_db()
+        self.assertEqual(self.todo.title, 'Renamed')
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AttachmentStorageTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpass123')
+
+    def create_todo(self, title, *files):
+        self.client.post(reverse('todo_create'), {'title': title, 'attachments': list(files)})
+        return Todo.objects.get(title=title)
+
+    def test_identical_uploads_are_stored_once(self):
+        """Test that the same content attached twice shares one blob"""
+        first = self.create_todo('First', SimpleUploadedFile('logo.png', b'same bytes'))
+        second = self.create_todo('Second', SimpleUploadedFile('copy.png', b'same bytes'))
+        a, b = first.attachments.get(), second.attachments.get()
+        self.assertEqual(a.file.name, b.file.name)
+        self.assertEqual((a.file_name, b.file_name), ('logo.png', 'copy.png'))
+        blob = AttachmentBlob.objects.get()
+        self.assertEqual(blob.digest, blob_digest(a.file.name))
+        self.assertEqual((blob.size, blob.ref_count), (10, 2))
+        with attachment_storage.open(a.file.name) as stored:
+            self.assertEqual(stored.read(), b'same bytes')
+        data = TodoSerializer(first, context={'request': None}).data
+        self.assertEqual(data['attachments'][0]['download_url'], reverse('attachment_download', args=[a.pk]))
+        self.assertNotIn('file', data['attachments'][0])
+
+    def test_blob_is_freed_with_its_last_reference(self):
+        """Test that deleting attachments, directly or by cascade, frees unused blobs"""
+        first = self.create_todo('First', SimpleUploadedFile('a.txt', b'shared'))
+        second = self.create_todo('Second', SimpleUploadedFile('b.txt', b'shared'))
+        name = first.attachments.get().file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.attachments.get().delete()
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 1)
+        self.assertTrue(attachment_storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(AttachmentBlob.objects.exists())
+        self.assertFalse(attachment_storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AttachmentThumbnailTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client = Client()
+        self.client.login(username='testuser', password='testpass123')
+
+    def image_upload(self, name='photo.png', size=(800, 600)):
+        output = io.BytesIO()
+        Image.new('RGB', size, 'teal').save(output, 'PNG')
+        return SimpleUploadedFile(name, output.getvalue(), content_type='image/png')
+
+    def test_image_attachments_get_thumbnails_off_the_request_path(self):
+        """Test that uploads queue a thumbnail job that writes a fixed-size preview"""
+        self.client.post(reverse('todo_create'), {
+            'title': 'With photo',
+            'attachments': [self.image_upload(), SimpleUploadedFile('notes.txt', b'text')],
+        })
+        photo = TodoAttachment.objects.get(file_name='photo.png')
+        self.assertFalse(photo.thumbnail)
+        self.assertEqual(list(BackgroundJob.objects.values_list('kind', 'params')), [
+            ('thumbnail', {'attachment_id': photo.id}),
+        ])
+
+        finished = run_pending_jobs()
+        self.assertEqual([job.status for job in finished], ['completed'])
+        self.assertFalse(Notification.objects.exists())
+        photo.refresh_from_db()
+        self.assertTrue(photo.thumbnail.name.startswith(photo.file.name))
+        with photo.thumbnail.open('rb') as thumbnail, Image.open(thumbnail) as image:
+            self.assertEqual((image.format, image.size), (THUMBNAIL_FORMAT, THUMBNAIL_SIZE))
+
+        todo = self.client.get(reverse('api-todo-detail', args=[photo.todo_id])).json()
+        urls = {a['file_name']: a['thumbnail_url'] for a in todo['attachments']}
+        self.assertTrue(urls['photo.png'].endswith(reverse('attachment_thumbnail', args=[photo.id])))
+        self.assertNotIn('thumbnail', todo['attachments'][0])
+        self.assertIsNone(urls['notes.txt'])
+        self.assertContains(self.client.get(reverse('todo_list')), reverse('attachment_thumbnail', args=[photo.id]))
+
+    def test_thumbnail_is_freed_with_its_blob(self):
+        """Test that deleting the last attachment of an image removes its thumbnail"""
+        self.client.post(reverse('todo_create'), {'title': 'With photo', 'attachments': [self.image_upload()]})
+        run_pending_jobs()
+        photo = TodoAttachment.objects.get()
+        thumbnail = photo.thumbnail.name
+        with self.captureOnCommitCallbacks(execute=True):
+            photo.todo.delete()
+        self.assertFalse(attachment_storage.exists(thumbnail))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class AttachmentDownloadTest(TestCase):
+    content = b'0123456789abcdefghij'
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.stranger = User.objects.create_user(username='stranger', password='testpass123')
+        todo = Todo.objects.create(title='With file', user=self.owner)
+        TodoShare.objects.create(todo=todo, shared_with=self.viewer, shared_by=self.owner)
+        self.attachment = TodoAttachment.objects.create(
+            todo=todo, file=SimpleUploadedFile('report.pdf', self.content), file_name='report.pdf'
+        )
+        self.url = reverse('attachment_download', args=[self.attachment.id])
+        self.client.login(username='viewer', password='testpass123')
+
+    def test_download_checks_visibility(self):
+        """Test that owners and sharees can download while others get a 404"""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="report.pdf"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['ETag'], f'"{blob_digest(self.attachment.file.name)}"')
+        self.assertIn('private', response['Cache-Control'])
+
+        self.client.login(username='stranger', password='testpass123')
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+    def test_range_requests(self):
+        """Test that single ranges return partial content and bad ones 416"""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/20')
+        self.assertEqual(response['Content-Length'], '4')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'hij')
+        response = self.client.get(self.url, HTTP_RANGE='bytes=18-')
+        self.assertEqual(b''.join(response.streaming_content), b'ij')
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-30')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */20')
+
+    def test_if_range_and_conditional_requests(self):
+        """Test that a changed file ignores Range and an unchanged one answers 304"""
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-1', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_sendfile_offload(self):
+        """Test that a configured front proxy is handed the file instead of the bytes"""
+        with mock.patch('todo.downloads.SENDFILE_BACKEND', 'x-accel-redirect'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.attachment.file.name}')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="report.pdf"')
+
+        with mock.patch('todo.downloads.SENDFILE_BACKEND', 'x-sendfile'):
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Sendfile'], self.attachment.file.path)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ChunkedUploadTest(TestCase):
+    content = b'chunked upload payload ' * 10
+
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', password='testpass123')
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.todo = Todo.objects.create(title='Big file', user=self.owner)
+        TodoShare.objects.create(todo=self.todo, shared_with=self.viewer, shared_by=self.owner)
+        self.client.login(username='owner', password='testpass123')
+
+    def start(self, **data):
+        data = dict({'todo_id': self.todo.id, 'file_name': 'video.mp4', 'size': len(self.content)}, **data)
+        return self.client.post(reverse('api-upload-create'), data, content_type='application/json')
+
+    def put_chunk(self, session_id, index, data, checksum=None):
+        return self.client.put(
+            reverse('api-upload-chunk', args=[session_id, index]), data,
+            content_type='application/octet-stream',
+            headers={'X-Chunk-SHA256': checksum} if checksum else None,
+        )
+
+    def test_upload_can_resume_and_commit(self):
+        """Test that chunks append in order, retries are harmless and commit attaches the file"""
+        session = self.start().json()
+        session_id = session['id']
+        chunks = [self.content[i:i + 100] for i in range(0, len(self.content), 100)]
+
+        self.assertEqual(self.put_chunk(session_id, 0, chunks[0]).json()['next_chunk'], 1)
+        self.assertEqual(self.put_chunk(session_id, 2, chunks[2]).status_code, 409)
+        # A retry of chunk 0 after a lost response changes nothing
+        self.assertEqual(self.put_chunk(session_id, 0, chunks[0]).json()['received'], 100)
+
+        resumed = self.client.get(reverse('api-upload-detail', args=[session_id])).json()
+        for index in range(resumed['next_chunk'], len(chunks)):
+            response = self.put_chunk(session_id, index, chunks[index])
+        self.assertTrue(response.json()['complete'])
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.post(reverse('api-upload-commit', args=[session_id]))
+        self.assertEqual(response.status_code, 201)
+        attachment = TodoAttachment.objects.get(id=response.json()['id'])
+        # The file is only moved once the attachment is committed
+        self.assertTrue(os.path.exists(temp_path(session_id)))
+        self.assertFalse(os.path.exists(attachment.file.path))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(attachment.file.name, blob_name(hashlib.sha256(self.content).hexdigest()))
+        self.assertEqual((attachment.todo, attachment.file_name), (self.todo, 'video.mp4'))
+        with attachment.file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.content)
+        self.assertEqual(AttachmentBlob.objects.get().ref_count, 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(temp_path(session_id)))
+
+    def test_bad_chunks_are_rejected(self):
+        """Test that checksum mismatches, oversized chunks and early commits fail"""
+        session_id = self.start().json()['id']
+        response = self.put_chunk(session_id, 0, b'abc', checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.put_chunk(session_id, 0, b'abc', checksum=hashlib.sha256(b'abc').hexdigest())
+        self.assertEqual(self.put_chunk(session_id, 1, self.content).status_code, 400)
+        self.assertEqual(os.path.getsize(temp_path(session_id)), 3)
+        self.assertEqual(self.client.post(reverse('api-upload-commit', args=[session_id])).status_code, 400)
+
+    def test_sessions_need_edit_permission_and_ownership(self):
+        """Test that read-only sharees cannot upload and sessions are private"""
+        session_id = self.start().json()['id']
+        self.client.login(username='viewer', password='testpass123')
+        self.assertEqual(self.start().status_code, 403)
+        self.assertEqual(self.client.get(reverse('api-upload-detail', args=[session_id])).status_code, 404)
+
+    def test_abandoned_sessions_are_cleaned_up(self):
+        """Test that expired sessions and their partial files are removed"""
+        session_id = self.start().json()['id']
+        self.put_chunk(session_id, 0, self.content[:10])
+        self.assertEqual(cleanup_expired(), 0)
+        self.assertEqual(cleanup_expired(timezone.now() + timezone.timedelta(days=2)), 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(temp_path(session_id)))
+
+
+class DashboardRollupTest(TestCase):
+    def setUp(self):
+        self.client = Client()
+        self.user = User.objects.create_user(username='owner', password='testpass123')
+        self.category = Category.objects.create(name='Work', user=self.user)
+        self.client.login(username='owner', password='testpass123')
+
+    def rollup_rows(self):
+        return set(TodoDailyRollup.objects.filter(user=self.user).exclude(created=0, completed=0).values_list(
+            'day', 'category_id', 'priority', 'created', 'completed'
+        ))
+
+    def assertRollupsMatchRebuild(self):
+        incremental = self.rollup_rows()
+        rollups.rebuild(self.user.id)
+        self.assertEqual(incremental, self.rollup_rows())
+
+    def test_rollups_follow_writes(self):
+        """Test that incrementally kept rollups agree with a rebuild after writes"""
+        rollups.ensure_built(self.user.id)
+        first = Todo.objects.create(title='First', priority='high', category=self.category, user=self.user)
+        second = Todo.objects.create(title='Second', user=self.user)
+        third = Todo.objects.create(title='Third', status='completed', completed_at=timezone.now(), user=self.user)
+        self.assertRollupsMatchRebuild()
+
+        first.status = 'completed'
+        first.completed_at = timezone.now()
+        first.save()
+        second.category = self.category
+        second.priority = 'low'
+        second.save()
+        bulk.toggle([first.id, third.id])
+        self.assertRollupsMatchRebuild()
+
+        response = self.client.post(reverse('api-todo-bulk'), {'operations': [
+            {'op': 'update', 'ids': [first.id, second.id], 'changes': {'status': 'completed', 'category_id': None}},
+            {'op': 'create', 'todo': {'title': 'Fourth', 'status': 'completed'}},
+        ]}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertRollupsMatchRebuild()
+
+        second.delete()
+        self.category.delete()
+        self.assertRollupsMatchRebuild()
+        self.assertTrue(TodoRollupState.objects.filter(user=self.user).exists())
+
+    def test_unknown_previous_state_rebuilds_in_background(self):
+        """Test that a save without the loaded state queues a rebuild and the last rows are served"""
+        todo = Todo.objects.create(title='Todo', user=self.user)
+        todo = Todo.objects.only('id', 'title', 'user_id').get(id=todo.id)
+        todo.status = 'completed'
+        todo.completed_at = timezone.now()
+        todo.save()
+        self.assertFalse(TodoRollupState.objects.filter(user=self.user).exists())
+
+        today = timezone.localdate()
+        for _ in range(2):
+            data = rollups.dashboard(self.user, today, today)
+            self.assertTrue(data['rebuilding'])
+            self.assertEqual(data['totals'], {'created': 1, 'completed': 0})
+        self.assertEqual(BackgroundJob.objects.filter(user=self.user, kind='rollup').count(), 1)
+
+        self.assertEqual([job.status for job in run_pending_jobs()], ['completed'])
+        data = rollups.dashboard(self.user, today, today)
+        self.assertFalse(data['rebuilding'])
+        self.assertEqual(data['totals'], {'created': 1, 'completed': 1})
+
+    def test_dashboard_breakdowns(self):
+        """Test the dashboard API series and breakdowns over a date range"""
+        today = timezone.localdate()
+        now = timezone.now()
+        old = Todo.objects.create(title='Old', priority='high', category=self.category, user=self.user)
+        Todo.objects.filter(id=old.id).update(
+            created_at=now - timezone.timedelta(days=10), status='completed',
+            completed_at=now - timezone.timedelta(days=3),
+        )
+        Todo.objects.create(title='New', user=self.user, due_date=now - timezone.timedelta(hours=1))
+        out = io.StringIO()
+        call_command('backfill_rollups', stdout=out)
+        self.assertIn('for 1 users', out.getvalue())
+
+        start = today - timezone.timedelta(days=13)
+        response = self.client.get(reverse('api-todo-dashboard'), {'start': start.isoformat(), 'end': today.isoformat()})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data['daily']), 14)
+        self.assertEqual(data['totals'], {'created': 2, 'completed': 1})
+        self.assertEqual(sum(week['created'] for week in data['weekly']), 2)
+        self.assertEqual(data['visible'], {'open': 1, 'overdue': 1})
+        daily = {point['date']: point for point in data['daily']}
+        self.assertEqual(daily[(today - timezone.timedelta(days=3)).isoformat()]['completed'], 1)
+        self.assertEqual(
+            [(row['name'], row['created'], row['completed']) for row in data['by_category']],
+            [('Work', 1, 1), ('Uncategorized', 1, 0)],
+        )
+        priorities = {row['priority']: row for row in data['by_priority']}
+        self.assertEqual(priorities['high']['completed'], 1)
+        self.assertEqual(priorities['medium']['created'], 1)
+
+        # Only the last week: the old todo's creation drops out
+        response = self.client.get(reverse('api-todo-dashboard'), {'start': (today - timezone.timedelta(days=6)).isoformat()})
+        self.assertEqual(response.json()['totals'], {'created': 1, 'completed': 1})
+
+        for params in ({'start': 'yesterday'}, {'start': today.isoformat(), 'end': start.isoformat()},
+                       {'start': '2000-01-01', 'end': '2020-01-01'}):
+            response = self.client.get(reverse('api-todo-dashboard'), params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_shared_todos_count_only_as_visible(self):
+        """Test that shared todos reach the visible counts but not the owned series"""
+        friend = User.objects.create_user(username='friend', password='testpass123')
+        shared = Todo.objects.create(title='Shared', user=friend, due_date=timezone.now() - timezone.timedelta(hours=1))
+        TodoShare.objects.create(todo=shared, shared_with=self.user, shared_by=friend)
+        Todo.objects.create(title='Mine', user=self.user)
+
+        today = timezone.localdate()
+        data = rollups.dashboard(self.user, today, today)
+        self.assertEqual(data['totals'], {'created': 1, 'completed': 0})
+        self.assertEqual(data['visible'], {'open': 2, 'overdue': 1})
+
+    def test_form_and_api_keep_completed_at(self):
+        """Test that the form and serializer set completed_at with the status"""
+        todo = Todo.objects.create(title='Todo', user=self.user)
+        self.client.post(reverse('todo_update', args=[todo.id]), {'title': 'Todo', 'status': 'completed'})
+        todo.refresh_from_db()
+        completed_at = todo.completed_at
+        self.assertIsNotNone(completed_at)
+
+        url = reverse('api-todo-detail', args=[todo.id])
+        self.client.patch(url, {'title': 'Renamed', 'status': 'completed'}, content_type='application/json')
+        todo.refresh_from_db()
+        self.assertEqual(todo.completed_at, completed_at)
+        self.client.patch(url, {'status': 'pending'}, content_type='application/json')
+        todo.refresh_from_db()
+        self.assertIsNone(todo.completed_at)
+
+        # Other writes save exactly what they are given
+        todo.status = 'completed'
+        todo.save(update_fields=['status'])
+        todo.refresh_from_db()
+        self.assertIsNone(todo.completed_at)
+
+    def test_year_trend_reads_rollups_only(self):
+        """Test that a year of dashboard data is read from the rollup table alone"""
+        for index in range(3):
+            Todo.objects.create(title=f'Todo {index}', user=self.user)
+        today = timezone.localdate()
+        rollups.dashboard(self.user, today - timezone.timedelta(days=364), today)
+        with CaptureQueriesContext(connection) as queries:
+            data = rollups.dashboard(self.user, today - timezone.timedelta(days=364), today)
+        self.assertEqual(len(data['daily']), 365)
+        self.assertEqual(data['totals']['created'], 3)
+        self.assertFalse([query for query in queries if '"todo_todo"' in query['sql']])
+
+    def test_dashboard_page(self):
+        """Test that the dashboard page shows the user's real numbers"""
+        Todo.objects.create(title='Write the report', user=self.user)
+        response = self.client.get(reverse('dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Write the report')
+        self.assertEqual(response.context['analytics']['totals']['created'], 1)
+        self.assertContains(response, 'id="dashboard-data"')
+
+        response = self.client.get(reverse('dashboard'), {'start': 'bogus'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['analytics']['daily']), rollups.DEFAULT_RANGE_DAYS)
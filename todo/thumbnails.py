@@ -0,0 +1,84 @@
+"""Fixed-size previews of image attachments.
+
+New image attachments queue a ``thumbnail`` BackgroundJob, so the upload
+request never decodes the image. ``manage.py run_jobs`` then writes a
+THUMBNAIL_SIZE WebP (JPEG where Pillow lacks WebP support) next to the
+original and records it on ``TodoAttachment.thumbnail``. Attachments that
+share a stored blob share its thumbnail, which is freed with the blob.
+"""
+import mimetypes
+import os
+from io import BytesIO
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps, features
+from .models import BackgroundJob, TodoAttachment
+
+# Width and height of every thumbnail; images are cropped to fit
+THUMBNAIL_SIZE = tuple(getattr(settings, 'TODO_THUMBNAIL_SIZE', (256, 256)))
+
+THUMBNAIL_FORMAT = 'WEBP' if features.check('webp') else 'JPEG'
+THUMBNAIL_QUALITY = 80
+
+# Upload types Pillow can decode
+IMAGE_TYPES = {'image/bmp', 'image/gif', 'image/jpeg', 'image/png', 'image/tiff', 'image/webp'}
+
+
+def wants_thumbnail(file_name):
+    return mimetypes.guess_type(file_name or '')[0] in IMAGE_TYPES
+
+
+def thumbnail_name(name):
+    extension = 'webp' if THUMBNAIL_FORMAT == 'WEBP' else 'jpg'
+    return f'{os.path.splitext(name)[0]}.thumb.{extension}'
+
+
+def enqueue(attachment):
+    """Queue a thumbnail job for ``attachment`` if it is an image."""
+    if not wants_thumbnail(attachment.file_name) or attachment.thumbnail:
+        return None
+    return BackgroundJob.objects.create(
+        user_id=attachment.todo.user_id,
+        kind='thumbnail',
+        params={'attachment_id': attachment.pk},
+    )
+
+
+def render(source):
+    """Encode a THUMBNAIL_SIZE preview of the image file ``source``."""
+    with Image.open(source) as image:
+        # JPEG can decode straight to a smaller scale, which saves most of the work
+        image.draft('RGB', (THUMBNAIL_SIZE[0] * 2, THUMBNAIL_SIZE[1] * 2))
+        image = ImageOps.exif_transpose(image)
+        thumbnail = ImageOps.fit(image, THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+
+    has_alpha = thumbnail.mode in ('RGBA', 'LA') or 'transparency' in thumbnail.info
+    mode = 'RGBA' if has_alpha and THUMBNAIL_FORMAT == 'WEBP' else 'RGB'
+    if thumbnail.mode != mode:
+        thumbnail = thumbnail.convert(mode)
+    output = BytesIO()
+    thumbnail.save(output, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY)
+    return output.getvalue()
+
+
+def generate(attachment_id, progress=None):
+    """Create and record the thumbnail of an attachment; returns its name or None.
+
+    ``progress(done, total)`` is called as the image is decoded and written.
+    """
+    attachment = TodoAttachment.objects.filter(pk=attachment_id).first()
+    if attachment is None or not attachment.file:
+        return None
+    storage = attachment.thumbnail.storage
+    name = thumbnail_name(attachment.file.name)
+    if not storage.exists(name):
+        if progress:
+            progress(0, 2)
+        with attachment.file.open('rb') as source:
+            data = render(source)
+        if progress:
+            progress(1, 2)
+        name = storage.save(name, ContentFile(data))
+    attachment.thumbnail.name = name
+    attachment.save(update_fields=['thumbnail'])
+    return name
@@ -0,0 +1,236 @@
+"""Chunked, resumable attachment uploads behind ``/api/uploads/``.
+
+A client creates a session for a todo it may edit, giving the file name
+and total size. It then PUTs the chunks in order, numbered from 0, each at
+most CHUNK_SIZE bytes. Every chunk is streamed onto the end of the
+session's temporary file, so no worker holds more than one chunk's worth
+of the upload.
+
+The session's status reports the next chunk and byte count. After a
+network failure the client asks for it and carries on from there;
+re-sending a chunk that was already stored is harmless. A chunk is read
+from the client into a file of its own, and the session row is locked only
+to append that file and record it, so a slow client does not hold up
+anyone else. Committing creates the TodoAttachment and, once that
+transaction commits, renames the finished file into the attachment store.
+
+A chunk may carry an ``X-Chunk-SHA256`` header. It is checked against the
+digest computed while the chunk is read, and a chunk that does not match
+is discarded. hashlib state cannot be kept between requests that may reach
+different workers, so the SHA-256 of the whole file is computed at commit,
+block by block and before the session is locked; a complete upload no
+longer changes.
+
+Sessions that see no chunk for UPLOAD_SESSION_TTL expire.
+``manage.py cleanup_uploads`` deletes them along with their files.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.db import transaction
+from django.utils import timezone
+from .models import TodoAttachment, UploadSession
+from .permissions import EDIT_PERMISSIONS, resolve
+from .storage import acquire, attachment_storage, blob_name
+
+# Largest chunk accepted by one PUT
+CHUNK_SIZE = getattr(settings, 'TODO_UPLOAD_CHUNK_SIZE', 5 * 1024 * 1024)
+
+# Largest file that can be uploaded through a session
+MAX_UPLOAD_SIZE = getattr(settings, 'TODO_MAX_UPLOAD_SIZE', 2 * 1024 ** 3)
+
+# How long a session may go without a chunk before it is abandoned
+UPLOAD_SESSION_TTL = timedelta(seconds=getattr(settings, 'TODO_UPLOAD_SESSION_TTL', 24 * 60 * 60))
+
+UPLOAD_DIR = 'todo_attachments/uploads'
+
+_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(ValueError):
+    """The request cannot be applied to the session."""
+
+
+class ChunkOutOfOrder(UploadError):
+    """A chunk arrived before the ones preceding it."""
+
+
+def temp_path(session_id):
+    return attachment_storage.path(f'{UPLOAD_DIR}/{session_id}.part')
+
+
+def status(session):
+    return {
+        'id': str(session.pk),
+        'todo_id': session.todo_id,
+        'file_name': session.file_name,
+        'size': session.size,
+        'received': session.received,
+        'next_chunk': session.next_chunk,
+        'chunk_size': CHUNK_SIZE,
+        'complete': session.received == session.size,
+        'expires_at': session.expires_at.isoformat(),
+    }
+
+
+def get_session(user, session_id, for_update=False):
+    """The live session ``session_id`` of ``user``; raises UploadSession.DoesNotExist."""
+    sessions = UploadSession.objects.filter(pk=session_id, user=user, expires_at__gt=timezone.now())
+    if for_update:
+        sessions = sessions.select_for_update()
+    return sessions.get()
+
+
+def create_session(user, todo_id, file_name, size):
+    """Start an upload of ``size`` bytes to be attached to ``todo_id``.
+
+    Raises PermissionDenied if ``user`` may not edit the todo.
+    """
+    file_name = os.path.basename(str(file_name or '')).strip()
+    if not file_name:
+        raise UploadError('file_name is required.')
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('size must be an integer.')
+    if not 0 < size <= MAX_UPLOAD_SIZE:
+        raise UploadError(f'size must be between 1 and {MAX_UPLOAD_SIZE} bytes.')
+    todo, permission = resolve(user, todo_id)
+    if todo is None or permission not in EDIT_PERMISSIONS:
+        raise PermissionDenied('Permission denied.')
+
+    session = UploadSession.objects.create(
+        user=user, todo=todo, file_name=file_name[:255], size=size,
+        expires_at=timezone.now() + UPLOAD_SESSION_TTL,
+    )
+    os.makedirs(os.path.dirname(temp_path(session.pk)), exist_ok=True)
+    open(temp_path(session.pk), 'wb').close()
+    return session
+
+
+def write_chunk(user, session_id, index, stream, length, checksum=None):
+    """Append chunk ``index`` of ``length`` bytes read from ``stream``."""
+    if length is None or not 0 < length <= CHUNK_SIZE:
+        raise UploadError(f'Chunks must be between 1 and {CHUNK_SIZE} bytes.')
+    session = get_session(user, session_id)
+    if index < session.next_chunk:
+        # A retry of a chunk that was already stored
+        return session
+    if index > session.next_chunk:
+        raise ChunkOutOfOrder(f'Expected chunk {session.next_chunk}.')
+    if session.received + length > session.size:
+        raise UploadError('Chunk runs past the declared size.')
+
+    hasher = hashlib.sha256()
+    fd, chunk_path = tempfile.mkstemp(dir=os.path.dirname(temp_path(session.pk)), prefix=f'{session.pk}.')
+    try:
+        written = 0
+        with os.fdopen(fd, 'wb') as chunk:
+            while written < length:
+                block = stream.read(min(_BLOCK_SIZE, length - written))
+                if not block:
+                    break
+                hasher.update(block)
+                chunk.write(block)
+                written += len(block)
+        if written != length:
+            raise UploadError('Chunk ended early.')
+        if checksum and checksum.lower() != hasher.hexdigest():
+            raise UploadError('Chunk checksum does not match.')
+
+        with transaction.atomic():
+            # The row lock keeps concurrent PUTs of one session in order
+            session = get_session(user, session_id, for_update=True)
+            if session.next_chunk != index:
+                # Another PUT of the same chunk was stored first
+                return session
+            with open(temp_path(session.pk), 'r+b') as part, open(chunk_path, 'rb') as chunk:
+                # Drop whatever a failed earlier attempt left after the last good chunk
+                part.seek(session.received)
+                part.truncate()
+                shutil.copyfileobj(chunk, part, _BLOCK_SIZE)
+            session.received += length
+            session.next_chunk += 1
+            session.expires_at = timezone.now() + UPLOAD_SESSION_TTL
+            session.save(update_fields=['received', 'next_chunk', 'expires_at'])
+        return session
+    finally:
+        os.remove(chunk_path)
+
+
+def _digest(session):
+    """The SHA-256 of the session's file."""
+    hasher = hashlib.sha256()
+    with open(temp_path(session.pk), 'rb') as part:
+        for block in iter(lambda: part.read(_BLOCK_SIZE), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def commit(user, session_id):
+    """Turn a complete upload into a TodoAttachment and end the session.
+
+    The file stays with the session until the transaction commits, so a
+    rollback leaves the upload ready to be committed again.
+    """
+    session = get_session(user, session_id)
+    if session.received != session.size:
+        raise UploadError(f'Upload is incomplete: {session.received} of {session.size} bytes received.')
+    # Hashed without the lock: write_chunk refuses anything past the declared size
+    digest = _digest(session)
+
+    with transaction.atomic():
+        session = get_session(user, session_id, for_update=True)
+        todo, permission = resolve(user, session.todo_id)
+        if todo is None or permission not in EDIT_PERMISSIONS:
+            raise PermissionDenied('Permission denied.')
+
+        path = temp_path(session.pk)
+        acquire(digest, session.size)
+        # Registered first so the file is in place before other callbacks, such as thumbnailing, run
+        transaction.on_commit(lambda: attachment_storage.place(path, digest))
+        attachment = TodoAttachment.objects.create(todo=todo, file=blob_name(digest), file_name=session.file_name)
+        session.delete()
+    return attachment
+
+
+def abort(user, session_id):
+    """Cancel a session and delete what it received."""
+    session = get_session(user, session_id)
+    _discard(session.pk)
+    session.delete()
+
+
+def _discard(session_id):
+    try:
+        os.remove(temp_path(session_id))
+    except FileNotFoundError:
+        pass
+
+
+def cleanup_expired(now=None):
+    """Delete expired sessions and orphaned partial files; returns how many sessions went."""
+    now = now or timezone.now()
+    removed = 0
+    expired = list(UploadSession.objects.filter(expires_at__lte=now).values_list('pk', flat=True))
+    for session_id in expired:
+        with transaction.atomic():
+            # A chunk may have renewed the session since it was listed
+            if UploadSession.objects.filter(pk=session_id, expires_at__lte=now).delete()[0]:
+                _discard(session_id)
+                removed += 1
+
+    # Files left by sessions removed in other ways, such as a todo deletion
+    directory = attachment_storage.path(UPLOAD_DIR)
+    if os.path.isdir(directory):
+        cutoff = (now - UPLOAD_SESSION_TTL).timestamp()
+        live = {str(pk) for pk in UploadSession.objects.values_list('pk', flat=True)}
+        for entry in os.scandir(directory):
+            session_id = entry.name.removesuffix('.part')
+            if session_id not in live and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+    return removed
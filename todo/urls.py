@@ -3,6 +3,8 @@ from . import views
 
 urlpatterns = [
     path('', views.todo_list, name='todo_list'),
+    path('list/more/', views.todo_list_more, name='todo_list_more'),
+    path('dashboard/', views.dashboard, name='dashboard'),
     path('create/', views.todo_create, name='todo_create'),
     path('update/<int:todo_id>/', views.todo_update, name='todo_update'),
     path('delete/<int:todo_id>/', views.todo_delete, name='todo_delete'),
@@ -12,5 +14,9 @@ urlpatterns = [
     path('category/create/', views.category_create, name='category_create'),
     path('export/', views.export_todos, name='export_todos'),
     path('import/', views.import_todos, name='import_todos'),
+    path('jobs/<int:job_id>/', views.job_status, name='job_status'),
+    path('jobs/<int:job_id>/download/', views.job_download, name='job_download'),
+    path('attachments/<int:attachment_id>/', views.attachment_download, name='attachment_download'),
+    path('attachments/<int:attachment_id>/thumbnail/', views.attachment_thumbnail, name='attachment_thumbnail'),
     path('register/', views.register_view, name='register'),
 ]
\ No newline at end of file
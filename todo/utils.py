@@ -1,140 +1,375 @@
 import json
 import csv
+import textwrap
 from datetime import datetime
-from django.http import HttpResponse
-from django.contrib.auth.models import User
-from .models import Todo, Category
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from .models import Todo, Category, completed_at_for
+from .signals import categories_bulk_created, todos_bulk_created
 
 
-def export_todos_to_json(user, include_completed=True):
-    """Export user's todos to JSON format"""
+# Rows fetched per database round trip and encoded per yielded chunk
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_COLUMNS = [
+    'title', 'description', 'created_at', 'updated_at', 'due_date',
+    'priority', 'status', 'completed_at', 'category__name', 'is_shared',
+]
+
+CSV_HEADER = [
+    'Title', 'Description', 'Created At', 'Updated At', 'Due Date',
+    'Priority', 'Status', 'Completed At', 'Category', 'Is Shared'
+]
+
+
+def _export_rows(user, include_completed=True):
+    """Stream the user's todos as value tuples, with categories joined"""
     todos = Todo.objects.filter(user=user)
     if not include_completed:
         todos = todos.exclude(status='completed')
-    
-    data = []
-    for todo in todos:
-        todo_data = {
-            'title': todo.title,
-            'description': todo.description,
-            'created_at': todo.created_at.isoformat() if todo.created_at else None,
-            'updated_at': todo.updated_at.isoformat() if todo.updated_at else None,
-            'due_date': todo.due_date.isoformat() if todo.due_date else None,
-            'priority': todo.priority,
-            'status': todo.status,
-            'completed_at': todo.completed_at.isoformat() if todo.completed_at else None,
-            'category': todo.category.name if todo.category else None,
-            'is_shared': todo.is_shared,
-        }
-        data.append(todo_data)
-    
-    return json.dumps(data, indent=2)
+    return todos.order_by('id').values_list(*EXPORT_COLUMNS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+def _chunked(rows, size=None, progress=None):
+    """Group ``rows`` into lists, calling ``progress(rows_so_far)`` after each one is used."""
+    size = size or EXPORT_CHUNK_SIZE
+    chunk = []
+    done = 0
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            done += len(chunk)
+            if progress is not None:
+                progress(done)
+            chunk = []
+    if chunk:
+        yield chunk
+        if progress is not None:
+            progress(done + len(chunk))
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def _strftime(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S') if value else ''
+
+
+def _json_item(row):
+    (title, description, created_at, updated_at, due_date,
+     priority, status, completed_at, category, is_shared) = row
+    return {
+        'title': title,
+        'description': description,
+        'created_at': _isoformat(created_at),
+        'updated_at': _isoformat(updated_at),
+        'due_date': _isoformat(due_date),
+        'priority': priority,
+        'status': status,
+        'completed_at': _isoformat(completed_at),
+        'category': category,
+        'is_shared': is_shared,
+    }
+
+
+def iter_todos_json(user, include_completed=True, progress=None):
+    """Yield the user's todos as an indented JSON array, one encoded chunk at a time"""
+    first = True
+    for chunk in _chunked(_export_rows(user, include_completed), progress=progress):
+        items = ',\n'.join(
+            textwrap.indent(json.dumps(_json_item(row), indent=2), '  ') for row in chunk
+        )
+        yield (('[\n' if first else ',\n') + items).encode('utf-8')
+        first = False
+    yield b'[]' if first else b'\n]'
+
+
+def iter_todos_ndjson(user, include_completed=True, progress=None):
+    """Yield the user's todos as newline-delimited JSON, one object per line"""
+    for chunk in _chunked(_export_rows(user, include_completed), progress=progress):
+        yield ''.join(json.dumps(_json_item(row)) + '\n' for row in chunk).encode('utf-8')
+
+
+class _Echo:
+    """File-like object whose write() hands the value back to the csv writer"""
+    def write(self, value):
+        return value
+
+
+def iter_todos_csv(user, include_completed=True, progress=None):
+    """Yield the user's todos as CSV, one encoded chunk at a time"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER).encode('utf-8')
+    for chunk in _chunked(_export_rows(user, include_completed), progress=progress):
+        yield ''.join(
+            writer.writerow([
+                title,
+                description,
+                _strftime(created_at),
+                _strftime(updated_at),
+                _strftime(due_date),
+                priority,
+                status,
+                _strftime(completed_at),
+                category or '',
+                is_shared,
+            ])
+            for (title, description, created_at, updated_at, due_date,
+                 priority, status, completed_at, category, is_shared) in chunk
+        ).encode('utf-8')
+
+
+EXPORT_FORMATS = {
+    'json': (iter_todos_json, 'application/json'),
+    'csv': (iter_todos_csv, 'text/csv'),
+    'ndjson': (iter_todos_ndjson, 'application/x-ndjson'),
+}
+
+
+def export_filename(user, export_format):
+    return f'todos_{user.username}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{export_format}'
+
+
+def export_todos_response(user, export_format='json', include_completed=True):
+    """Streaming download of the user's todos in one of EXPORT_FORMATS"""
+    if export_format not in EXPORT_FORMATS:
+        export_format = 'json'
+    iterator, content_type = EXPORT_FORMATS[export_format]
+    response = StreamingHttpResponse(iterator(user, include_completed), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{export_filename(user, export_format)}"'
+    return response
+
+
+def export_todos_to_json(user, include_completed=True):
+    """Export user's todos to JSON format"""
+    return b''.join(iter_todos_json(user, include_completed)).decode('utf-8')
 
 
 def export_todos_to_csv(user, include_completed=True):
     """Export user's todos to CSV format"""
-    todos = Todo.objects.filter(user=user)
-    if not include_completed:
-        todos = todos.exclude(status='completed')
-    
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="todos_{user.username}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-    
-    writer = csv.writer(response)
-    writer.writerow([
-        'Title', 'Description', 'Created At', 'Updated At', 'Due Date', 
-        'Priority', 'Status', 'Completed At', 'Category', 'Is Shared'
-    ])
-    
-    for todo in todos:
-        writer.writerow([
-            todo.title,
-            todo.description,
-            todo.created_at.strftime('%Y-%m-%d %H:%M:%S') if todo.created_at else '',
-            todo.updated_at.strftime('%Y-%m-%d %H:%M:%S') if todo.updated_at else '',
-            todo.due_date.strftime('%Y-%m-%d %H:%M:%S') if todo.due_date else '',
-            todo.priority,
-            todo.status,
-            todo.completed_at.strftime('%Y-%m-%d %H:%M:%S') if todo.completed_at else '',
-            todo.category.name if todo.category else '',
-            todo.is_shared
+    return export_todos_response(user, 'csv', include_completed)
+
+
+# Rows checked for duplicates and inserted per bulk_create
+IMPORT_BATCH_SIZE = 1000
+
+DEFAULT_CATEGORY_COLOR = '#007bff'
+
+
+class ImportReport:
+    """Outcome of an import: inserted count plus skipped and rejected rows with reasons"""
+
+    def __init__(self):
+        self.inserted = 0
+        self.skipped = []
+        self.rejected = []
+
+    def skip(self, row_number, title, reason):
+        self.skipped.append({'row': row_number, 'title': title, 'reason': reason})
+
+    def reject(self, row_number, reason):
+        self.rejected.append({'row': row_number, 'reason': reason})
+
+    def as_dict(self):
+        return {
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'rejected': self.rejected,
+        }
+
+    def __str__(self):
+        return (
+            f'{self.inserted} imported, {len(self.skipped)} skipped, '
+            f'{len(self.rejected)} rejected'
+        )
+
+
+_PRIORITIES = {value for value, _ in Todo.PRIORITY_CHOICES}
+_STATUSES = {value for value, _ in Todo.STATUS_CHOICES}
+_TITLE_MAX_LENGTH = Todo._meta.get_field('title').max_length
+_CATEGORY_MAX_LENGTH = Category._meta.get_field('name').max_length
+
+
+def _text(raw, key, label):
+    """``raw[key]`` as a string, '' if missing; other JSON types are rejected."""
+    value = raw.get(key)
+    if value is None:
+        return ''
+    if not isinstance(value, str):
+        raise ValueError(f'{label} must be text, got {type(value).__name__}')
+    return value
+
+
+def _parse_bool(value, label):
+    # The export writes booleans; CSV and hand-written JSON may use strings
+    if value is None or isinstance(value, bool):
+        return bool(value)
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false', ''):
+        return value.strip().lower() == 'true'
+    raise ValueError(f'Invalid {label}: {value!r}')
+
+
+def _parse_datetime(value, label):
+    if value in (None, ''):
+        return None
+    if not isinstance(value, str):
+        raise ValueError(f'Invalid {label}: {value!r}')
+    try:
+        parsed = Todo._meta.get_field('due_date').to_python(value)
+    except ValidationError:
+        raise ValueError(f'Invalid {label}: {value!r}')
+    if parsed is not None and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _clean_row(raw):
+    """Validate one normalized row, raising ValueError with the rejection reason"""
+    title = _text(raw, 'title', 'Title').strip()
+    if not title:
+        raise ValueError('Missing title')
+    if len(title) > _TITLE_MAX_LENGTH:
+        raise ValueError(f'Title longer than {_TITLE_MAX_LENGTH} characters')
+
+    priority = _text(raw, 'priority', 'Priority') or 'medium'
+    if priority not in _PRIORITIES:
+        raise ValueError(f'Unknown priority: {priority!r}')
+    status = _text(raw, 'status', 'Status') or 'pending'
+    if status not in _STATUSES:
+        raise ValueError(f'Unknown status: {status!r}')
+
+    category = _text(raw, 'category', 'Category').strip() or None
+    if category and len(category) > _CATEGORY_MAX_LENGTH:
+        raise ValueError(f'Category longer than {_CATEGORY_MAX_LENGTH} characters')
+
+    return {
+        'title': title,
+        'description': _text(raw, 'description', 'Description'),
+        'due_date': _parse_datetime(raw.get('due_date'), 'due date'),
+        'priority': priority,
+        'status': status,
+        'completed_at': completed_at_for(status, _parse_datetime(raw.get('completed_at'), 'completed at')),
+        'category': category,
+        'is_shared': _parse_bool(raw.get('is_shared'), 'is_shared'),
+    }
+
+
+def _resolve_categories(user, names):
+    """Map every category name to a Category, bulk-creating the missing ones"""
+    categories = {}
+    for category in Category.objects.filter(user=user, name__in=names).order_by('id'):
+        categories.setdefault(category.name, category)
+    missing = [name for name in names if name not in categories]
+    if missing:
+        Category.objects.bulk_create([
+            Category(name=name, user=user, color=DEFAULT_CATEGORY_COLOR) for name in missing
         ])
-    
-    return response
+        created = list(Category.objects.filter(user=user, name__in=missing).order_by('id'))
+        for category in created:
+            categories.setdefault(category.name, category)
+        categories_bulk_created(created)
+    return categories
+
+
+def import_todos(user, rows, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """Insert normalized todo rows for ``user`` in batches inside one transaction.
+
+    ``rows`` yields ``(row_number, dict)`` pairs using the export's JSON keys.
+    Rows whose title already exists for the user (or appeared earlier in the
+    same import) are skipped, matching the old get_or_create behaviour.
+    ``progress``, if given, is called as ``progress(done, total)`` after each
+    batch. Returns an ImportReport.
+    """
+    report = ImportReport()
+    cleaned = []
+    for row_number, raw in rows:
+        try:
+            cleaned.append((row_number, _clean_row(raw)))
+        except ValueError as exc:
+            report.reject(row_number, str(exc))
+
+    with transaction.atomic():
+        categories = _resolve_categories(
+            user, sorted({row['category'] for _, row in cleaned if row['category']})
+        )
+        seen_titles = set()
+        for start in range(0, len(cleaned), batch_size):
+            batch = cleaned[start:start + batch_size]
+            existing = set(Todo.objects.filter(
+                user=user, title__in={row['title'] for _, row in batch}
+            ).values_list('title', flat=True))
+
+            todos = []
+            for row_number, row in batch:
+                if row['title'] in existing:
+                    report.skip(row_number, row['title'], 'A todo with this title already exists')
+                    continue
+                if row['title'] in seen_titles:
+                    report.skip(row_number, row['title'], 'Duplicate title earlier in the file')
+                    continue
+                seen_titles.add(row['title'])
+                todos.append(Todo(
+                    user=user,
+                    category=categories.get(row['category']),
+                    **{key: value for key, value in row.items() if key != 'category'}
+                ))
 
+            created = Todo.objects.bulk_create(todos)
+            todos_bulk_created(created)
+            report.inserted += len(created)
+            if progress is not None:
+                progress(start + len(batch), len(cleaned))
+    return report
 
-def import_todos_from_json(user, json_data):
+
+def _json_rows(items):
+    for row_number, item in enumerate(items, start=1):
+        if not isinstance(item, dict):
+            yield row_number, {}
+        else:
+            yield row_number, item
+
+
+def _csv_rows(reader):
+    # Row 1 is the header
+    for row_number, row in enumerate(reader, start=2):
+        yield row_number, {
+            'title': row.get('Title'),
+            'description': row.get('Description'),
+            'due_date': row.get('Due Date'),
+            'priority': row.get('Priority'),
+            'status': row.get('Status'),
+            'completed_at': row.get('Completed At'),
+            'category': row.get('Category'),
+            'is_shared': row.get('Is Shared'),
+        }
+
+
+def import_todos_from_json(user, json_data, progress=None):
     """Import todos from JSON data"""
     try:
         data = json.loads(json_data)
-        imported_count = 0
-        
-        for item in data:
-            # Find or create category
-            category = None
-            if item.get('category'):
-                category, created = Category.objects.get_or_create(
-                    name=item['category'],
-                    user=user,
-                    defaults={'color': '#007bff'}  # default color
-                )
-            
-            # Create the todo
-            Todo.objects.get_or_create(
-                title=item['title'],
-                user=user,
-                defaults={
-                    'description': item.get('description', ''),
-                    'due_date': item.get('due_date'),
-                    'priority': item.get('priority', 'medium'),
-                    'status': item.get('status', 'pending'),
-                    'completed_at': item.get('completed_at'),
-                    'category': category,
-                    'is_shared': item.get('is_shared', False),
-                }
-            )
-            imported_count += 1
-        
-        return imported_count
-    except json.JSONDecodeError:
-        return 0
-    except Exception:
-        return 0
-
-
-def import_todos_from_csv(user, csv_file):
+    except json.JSONDecodeError as exc:
+        report = ImportReport()
+        report.reject(None, f'Invalid JSON: {exc}')
+        return report
+    if not isinstance(data, list):
+        report = ImportReport()
+        report.reject(None, 'Expected a JSON array of todos')
+        return report
+    return import_todos(user, _json_rows(data), progress=progress)
+
+
+def import_todos_from_csv(user, csv_file, progress=None):
     """Import todos from CSV file"""
     try:
         decoded_file = csv_file.read().decode('utf-8').splitlines()
-        reader = csv.DictReader(decoded_file)
-        
-        imported_count = 0
-        for row in reader:
-            # Find or create category
-            category = None
-            if row.get('Category'):
-                category, created = Category.objects.get_or_create(
-                    name=row['Category'],
-                    user=user,
-                    defaults={'color': '#007bff'}  # default color
-                )
-            
-            # Create the todo
-            Todo.objects.get_or_create(
-                title=row['Title'],
-                user=user,
-                defaults={
-                    'description': row.get('Description', ''),
-                    'due_date': row.get('Due Date'),
-                    'priority': row.get('Priority', 'medium'),
-                    'status': row.get('Status', 'pending'),
-                    'completed_at': row.get('Completed At') or None,
-                    'category': category,
-                    'is_shared': row.get('Is Shared', 'False').lower() == 'true',
-                }
-            )
-            imported_count += 1
-        
-        return imported_count
-    except Exception:
-        return 0
\ No newline at end of file
+    except UnicodeDecodeError as exc:
+        report = ImportReport()
+        report.reject(None, f'File is not UTF-8 encoded: {exc}')
+        return report
+    return import_todos(user, _csv_rows(csv.DictReader(decoded_file)), progress=progress)
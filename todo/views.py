@@ -1,17 +1,22 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponse
+from django.http import FileResponse, Http404, JsonResponse
 from django.views.decorators.http import require_http_methods
-from django.db.models import Q
+from django.db.models import Count, Prefetch, Q
 from django.core.serializers import serialize
 from django.forms.models import model_to_dict
-from .models import Todo, Category, TodoAttachment, TodoShare
-from .utils import export_todos_to_json, export_todos_to_csv, import_todos_from_json, import_todos_from_csv
+from .models import Todo, Category, TodoAttachment, TodoShare, BackgroundJob, completed_at_for
+from . import bulk, cache, downloads, jobs, rollups
+from .permissions import DELETE_PERMISSIONS, EDIT_PERMISSIONS, OWNER, get_todo_or_404
+from .search import full_text_search
+from .stats import get_cached_stats
+from .utils import export_todos_response, import_todos_from_json, import_todos_from_csv
 from django.contrib.auth.models import User
-from django.utils import timezone
 import json
+import os
 
 
 def register_view(request):
@@ -36,20 +41,22 @@ def register_view(request):
     return render(request, 'todo/register.html')
 
 
-@login_required
-def todo_list(request):
-    todos = Todo.objects.filter(
-        Q(user=request.user) | Q(shares__shared_with=request.user)
-    ).distinct().order_by('-created_at')
-    
-    categories = Category.objects.filter(user=request.user)
+TODO_LIST_PAGE_SIZE = 25
+
+
+def _todo_list_queryset(request):
+    """Visible todos for the list page with the request's filters applied."""
+    thumbnails = TodoAttachment.objects.exclude(thumbnail='').only('todo_id', 'file_name', 'thumbnail')
+    todos = Todo.objects.visible_to(request.user).select_related('category').annotate(
+        attachment_count=Count('attachments')
+    ).prefetch_related(
+        Prefetch('attachments', queryset=thumbnails.order_by('id'), to_attr='thumbnails')
+    ).order_by('-created_at', '-id')
     
-    # Get query parameters for filtering
     status_filter = request.GET.get('status', '')
     category_filter = request.GET.get('category', '')
     search_query = request.GET.get('search', '')
     
-    # Apply filters
     if status_filter:
         todos = todos.filter(status=status_filter)
     
@@ -62,16 +69,63 @@ def todo_list(request):
             Q(description__icontains=search_query)
         )
     
+    return todos
+
+
+def _todo_list_page(request, todos):
+    """Slice one page of cards, fetching one extra row instead of a COUNT."""
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+    offset = (page - 1) * TODO_LIST_PAGE_SIZE
+    rows = list(todos[offset:offset + TODO_LIST_PAGE_SIZE + 1])
+    
+    next_page_url = None
+    if len(rows) > TODO_LIST_PAGE_SIZE:
+        params = request.GET.copy()
+        params['page'] = page + 1
+        next_page_url = f"{reverse('todo_list_more')}?{params.urlencode()}"
+    return rows[:TODO_LIST_PAGE_SIZE], next_page_url
+
+
+def _cached_todo_list_page(request):
+    return cache.get_or_set(
+        request.user.id, 'todo-list-page', request.GET.urlencode(),
+        lambda: _todo_list_page(request, _todo_list_queryset(request))
+    )
+
+
+@login_required
+def todo_list(request):
+    todos, next_page_url = _cached_todo_list_page(request)
+    
     context = {
         'todos': todos,
-        'categories': categories,
-        'status_filter': status_filter,
-        'category_filter': category_filter,
-        'search_query': search_query,
+        'next_page_url': next_page_url,
+        'stats': get_cached_stats(request.user),
+        'categories': cache.get_or_set(
+            request.user.id, 'categories', None,
+            lambda: list(Category.objects.filter(user=request.user))
+        ),
+        'status_filter': request.GET.get('status', ''),
+        'category_filter': request.GET.get('category', ''),
+        'search_query': request.GET.get('search', ''),
     }
     return render(request, 'todo/todo_list.html', context)
 
 
+@login_required
+@require_http_methods(["GET"])
+def todo_list_more(request):
+    """HTML fragment with the next page of todo cards for incremental loading"""
+    todos, next_page_url = _cached_todo_list_page(request)
+    return render(request, 'todo/_todo_cards.html', {
+        'todos': todos,
+        'next_page_url': next_page_url,
+    })
+
+
 @login_required
 def todo_create(request):
     if request.method == 'POST':
@@ -115,10 +169,10 @@ def todo_create(request):
 
 @login_required
 def todo_update(request, todo_id):
-    todo = get_object_or_404(Todo, id=todo_id)
+    todo, permission = get_todo_or_404(request, todo_id)
     
     # Check if user has permission to edit this todo
-    if todo.user != request.user and not todo.shares.filter(shared_with=request.user, can_edit=True).exists():
+    if permission not in EDIT_PERMISSIONS:
         messages.error(request, 'You do not have permission to edit this todo.')
         return redirect('todo_list')
     
@@ -132,10 +186,9 @@ def todo_update(request, todo_id):
         if 'completed' in request.POST:
             if request.POST['completed'] == 'true' and todo.status != 'completed':
                 todo.status = 'completed'
-                todo.completed_at = timezone.now()
             elif request.POST['completed'] == 'false':
                 todo.status = 'pending'
-                todo.completed_at = None
+        todo.completed_at = completed_at_for(todo.status, todo.completed_at)
         
         category_id = request.POST.get('category', None)
         if category_id:
@@ -171,10 +224,10 @@ def todo_update(request, todo_id):
 
 @login_required
 def todo_delete(request, todo_id):
-    todo = get_object_or_404(Todo, id=todo_id)
+    todo, permission = get_todo_or_404(request, todo_id)
     
     # Check if user has permission to delete this todo
-    if todo.user != request.user and not todo.shares.filter(shared_with=request.user).exists():
+    if permission not in DELETE_PERMISSIONS:
         messages.error(request, 'You do not have permission to delete this todo.')
         return redirect('todo_list')
     
@@ -188,21 +241,14 @@ def todo_delete(request, todo_id):
 
 @login_required
 def todo_toggle_complete(request, todo_id):
-    todo = get_object_or_404(Todo, id=todo_id)
+    todo, permission = get_todo_or_404(request, todo_id)
     
     # Check if user has permission to edit this todo
-    if todo.user != request.user and not todo.shares.filter(shared_with=request.user, can_edit=True).exists():
+    if permission not in EDIT_PERMISSIONS:
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
-    if todo.status == 'completed':
-        todo.status = 'pending'
-        todo.completed_at = None
-    else:
-        todo.status = 'completed'
-        todo.completed_at = timezone.now()
-    
-    todo.save()
-    return JsonResponse({'status': todo.status, 'completed_at': todo.completed_at.isoformat() if todo.completed_at else None})
+    state = bulk.toggle([todo.id])[todo.id]
+    return JsonResponse({'status': state['status'], 'completed_at': state['completed_at'].isoformat() if state['completed_at'] else None})
 
 
 @login_required
@@ -225,10 +271,10 @@ def category_create(request):
 
 @login_required
 def share_todo(request, todo_id):
-    todo = get_object_or_404(Todo, id=todo_id)
+    todo, permission = get_todo_or_404(request, todo_id)
     
     # Only the owner can share the todo
-    if todo.user != request.user:
+    if permission != OWNER:
         messages.error(request, 'You can only share todos you created.')
         return redirect('todo_list')
     
@@ -262,15 +308,31 @@ def share_todo(request, todo_id):
     return redirect('todo_list')
 
 
+@login_required
+@require_http_methods(["GET"])
+def dashboard(request):
+    try:
+        start, end = rollups.parse_range(request.GET.get('start'), request.GET.get('end'))
+    except ValueError as exc:
+        messages.error(request, str(exc))
+        start, end = rollups.parse_range()
+    
+    context = {
+        'stats': get_cached_stats(request.user),
+        'analytics': rollups.dashboard(request.user, start, end),
+        'recent_todos': Todo.objects.visible_to(request.user).select_related('category').order_by('-updated_at', '-id')[:5],
+    }
+    return render(request, 'todo/dashboard.html', context)
+
+
 @login_required
 @require_http_methods(["GET"])
 def todo_search(request):
     query = request.GET.get('q', '')
     if query:
-        todos = Todo.objects.filter(
-            Q(user=request.user) | Q(shares__shared_with=request.user),
-            Q(title__icontains=query) | Q(description__icontains=query)
-        ).distinct()
+        todos = full_text_search(
+            Todo.objects.visible_to(request.user).select_related('category'), query
+        )
         
         results = []
         for todo in todos:
@@ -290,17 +352,15 @@ def todo_search(request):
 
 @login_required
 def export_todos(request):
-    """Export todos to JSON or CSV format"""
+    """Export todos to JSON, CSV or NDJSON format"""
     export_format = request.GET.get('format', 'json')
     include_completed = request.GET.get('completed', 'true').lower() == 'true'
     
-    if export_format == 'csv':
-        return export_todos_to_csv(request.user, include_completed)
-    else:  # default to json
-        json_data = export_todos_to_json(request.user, include_completed)
-        response = HttpResponse(json_data, content_type='application/json')
-        response['Content-Disposition'] = f'attachment; filename="todos_{request.user.username}_{timezone.now().strftime("%Y%m%d_%H%M%S")}.json"'
-        return response
+    if request.GET.get('background', 'false').lower() == 'true':
+        job = jobs.enqueue_export(request.user, export_format, include_completed)
+        return JsonResponse(jobs.job_payload(job), status=202)
+    
+    return export_todos_response(request.user, export_format, include_completed)
 
 
 @login_required
@@ -313,23 +373,88 @@ def import_todos(request):
             return redirect('todo_list')
         
         file_name = uploaded_file.name
-        imported_count = 0
         
-        try:
-            if file_name.endswith('.json'):
-                # Read and decode the JSON file
+        if not file_name.endswith(('.json', '.csv')):
+            messages.error(request, 'Unsupported file format. Please upload a JSON or CSV file.')
+            return redirect('todo_list')
+        
+        if uploaded_file.size > jobs.INLINE_IMPORT_MAX_BYTES:
+            jobs.enqueue_import(request.user, uploaded_file)
+            messages.success(request, 'Import queued. You will be notified when it finishes.')
+            return redirect('todo_list')
+        
+        if file_name.endswith('.json'):
+            try:
                 json_data = uploaded_file.read().decode('utf-8')
-                imported_count = import_todos_from_json(request.user, json_data)
-            elif file_name.endswith('.csv'):
-                imported_count = import_todos_from_csv(request.user, uploaded_file)
-            else:
-                messages.error(request, 'Unsupported file format. Please upload a JSON or CSV file.')
+            except UnicodeDecodeError:
+                messages.error(request, 'File is not UTF-8 encoded.')
                 return redirect('todo_list')
-            
-            messages.success(request, f'Successfully imported {imported_count} todos!')
-        except Exception as e:
-            messages.error(request, f'Error importing file: {str(e)}')
+            report = import_todos_from_json(request.user, json_data)
+        else:
+            report = import_todos_from_csv(request.user, uploaded_file)
+        
+        if report.inserted or not report.rejected:
+            messages.success(request, f'Import finished: {report}.')
+        for rejection in report.rejected[:5]:
+            row = f"Row {rejection['row']}: " if rejection['row'] else ''
+            messages.error(request, f"{row}{rejection['reason']}")
     
+    return redirect('todo_list')
+
+
+@login_required
+@require_http_methods(["GET"])
+def job_status(request, job_id):
+    """Status, progress and result of one of the user's background jobs"""
+    job = get_object_or_404(BackgroundJob, id=job_id, user=request.user)
+    return JsonResponse(jobs.job_payload(job))
+
+
+@login_required
+@require_http_methods(["GET"])
+def job_download(request, job_id):
+    """Download the file produced by a finished export job"""
+    job = get_object_or_404(BackgroundJob, id=job_id, user=request.user, kind='export', status='completed')
+    if not job.result_file:
+        raise Http404('Export file not found')
+    return FileResponse(
+        job.result_file.open('rb'),
+        as_attachment=True,
+        filename=os.path.basename(job.result_file.name)
+    )
+
+
+def _visible_attachment(request, attachment_id):
+    # Owner or anyone the todo is shared with, through TodoVisibility
+    attachment = TodoAttachment.objects.filter(
+        id=attachment_id, todo__visibility__user=request.user
+    ).first()
+    if attachment is None:
+        raise Http404('Attachment not found')
+    return attachment
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def attachment_download(request, attachment_id):
+    """Download an attachment of a todo the user can see"""
+    attachment = _visible_attachment(request, attachment_id)
+    if not attachment.file:
+        raise Http404('Attachment not found')
+    return downloads.serve(request, attachment.file, attachment.file_name)
+
+
+@login_required
+@require_http_methods(["GET", "HEAD"])
+def attachment_thumbnail(request, attachment_id):
+    """Preview image of an attachment, once its thumbnail job has run"""
+    attachment = _visible_attachment(request, attachment_id)
+    if not attachment.thumbnail:
+        raise Http404('Thumbnail not found')
+    name = os.path.splitext(attachment.file_name)[0] + os.path.splitext(attachment.thumbnail.name)[1]
+    return downloads.serve(request, attachment.thumbnail, name, as_attachment=False)
+
+
 def bad_request(request, exception):
     """400 Bad Request handler"""
     return render(request, 'todo/400.html', status=40)
@@ -347,5 +472,4 @@ def page_not_found(request, exception):
 
 def server_error(request):
     """500 Server Error handler"""
-    return render(request, 'todo/500.html', status=500)
-    return redirect('todo_list')
\ No newline at end of file
+    return render(request, 'todo/500.html', status=500)
\ No newline at end of file